@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Ingest benchmark of the pre-aggregation stage.
+
+A 100 Hz stream with jittered (so out of order) timestamps is fed in chunks
+to an AggregationStage scoring the mean and p99 of one second windows with
+two detectors. The aggregation cost per raw sample is compared to the cost
+of scoring a raw sample:
+
+    python -m benchmarks.aggregation --seconds 600
+"""
+
+import argparse
+import math
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from cadose.aggregation import AggregationStage, WindowAggregator
+from cadose.cad_ose import ContextualAnomalyDetector
+
+DETECTOR_PARAMS = dict(
+    min_value=0, max_value=100, base_threshold=0.75, rest_period=1,
+    max_lsemi_ctxs_len=7, max_active_neurons_num=15, num_norm_value_bits=10)
+
+
+def high_frequency_stream(seconds, rate, seed=0):
+    """
+    :return: (timestamps, values) of a noisy periodic signal sampled at rate
+             Hz, the timestamps jittered by up to a quarter second
+    """
+    rnd = np.random.RandomState(seed)
+    num_samples = int(seconds * rate)
+    timestamps = np.arange(num_samples) / float(rate)
+    values = 50.0 + 30.0 * np.sin(timestamps / 30.0 * 2 * math.pi) + \
+        rnd.normal(scale=5.0, size=num_samples)
+    timestamps += rnd.uniform(-0.25, 0.25, size=num_samples)
+    return timestamps, values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=int, default=600,
+                        help='length of the stream')
+    parser.add_argument('--rate', type=int, default=100,
+                        help='samples per second')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='number of samples per chunk')
+    args = parser.parse_args(argv)
+
+    timestamps, values = high_frequency_stream(args.seconds, args.rate)
+    chunks = [(timestamps[start:start + args.chunk_size],
+               values[start:start + args.chunk_size])
+              for start in range(0, len(values), args.chunk_size)]
+
+    aggregator = WindowAggregator(1.0, ('mean', 'min', 'max', 'last',
+                                        'p50', 'p99'), allowed_lateness=0.5)
+    start = timer()
+    num_windows = sum(len(aggregator.add(*chunk).starts) for chunk in chunks)
+    num_windows += len(aggregator.flush().starts)
+    aggregation_time = timer() - start
+
+    stage = AggregationStage(
+        WindowAggregator(1.0, ('mean', 'p99'), allowed_lateness=0.5), {
+            'mean': ContextualAnomalyDetector(**DETECTOR_PARAMS),
+            'p99': ContextualAnomalyDetector(**DETECTOR_PARAMS),
+        })
+    start = timer()
+    for chunk in chunks:
+        stage.add(*chunk)
+    stage.flush()
+    stage_time = timer() - start
+
+    num_raw = min(len(values), 1000)
+    start = timer()
+    ContextualAnomalyDetector(**DETECTOR_PARAMS).score_many(values[:num_raw])
+    raw_time = (timer() - start) / num_raw
+
+    num_samples = len(values)
+    print('%d samples, %d windows, %d late samples' % (
+        num_samples, num_windows, aggregator.num_late))
+    print('%-36s %12.3f us' % ('aggregation (6 aggregates) / sample',
+                               aggregation_time / num_samples * 1e6))
+    print('%-36s %12.3f us' % ('stage (2 detectors) / sample',
+                               stage_time / num_samples * 1e6))
+    print('%-36s %12.3f us' % ('scoring a raw sample',
+                               raw_time * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Latency benchmark of ContextualAnomalyDetector.compact.
+
+A detector is trained on a series going through several regimes, so most
+of the contexts learned on the first ones are never activated again, and
+the last regime is then scored by:
+  - a young detector trained on the last regime only,
+  - the trained detector,
+  - a copy of it compacted with max_idle_steps.
+The compacted detector should step much faster than the trained one, the
+contexts it still has are the ones the current regime keeps activating
+(or creating):
+
+    python -m benchmarks.compaction --regimes 6
+"""
+
+import argparse
+import copy
+import math
+import random
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from cadose.cad_ose import ContextualAnomalyDetector
+
+
+def regime_series(num_regimes, regime_len, seed=0):
+    """
+    :return: np.ndarray of num_regimes periodic regimes of regime_len points,
+             each with its own level, amplitude and period
+    """
+    rnd = random.Random(seed)
+    values = []
+    for _ in range(num_regimes):
+        level = rnd.uniform(20, 80)
+        amplitude = rnd.uniform(5, 20)
+        period = rnd.uniform(5, 20)
+        values.extend(level + amplitude * math.sin(i / period) +
+                      rnd.uniform(-2, 2) for i in range(regime_len))
+    return np.array(values)
+
+
+def time_steps(detector, values):
+    """
+    :return: list of the latencies of scoring the values one by one
+    """
+    step_times = []
+    for value in values:
+        start = timer()
+        detector.get_anomaly_score(value)
+        step_times.append(timer() - start)
+    return step_times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--regimes', type=int, default=6,
+                        help='number of regimes of the series')
+    parser.add_argument('--regime-len', type=int, default=300,
+                        help='number of points of every regime')
+    parser.add_argument('--probe', type=int, default=200,
+                        help='number of scored points')
+    parser.add_argument('--max-idle-steps', type=int, default=100,
+                        help='drop the contexts idle for more steps')
+    parser.add_argument('--bitset', action='store_true',
+                        help='use the bitset context operator')
+    args = parser.parse_args(argv)
+
+    series = regime_series(args.regimes, args.regime_len)
+    train, probe = series[:-args.probe], series[-args.probe:]
+    params = dict(
+        min_value=0, max_value=100, base_threshold=0.75, rest_period=1,
+        max_lsemi_ctxs_len=7, max_active_neurons_num=15,
+        num_norm_value_bits=10, bitset=args.bitset)
+
+    young = ContextualAnomalyDetector(**params)
+    young.learn_many(train[-(args.regime_len - args.probe):])
+    trained = ContextualAnomalyDetector(**params)
+    trained.learn_many(train)
+    compacted = copy.deepcopy(trained)
+    start = timer()
+    num_dropped = compacted.compact(max_idle_steps=args.max_idle_steps)
+    compaction_time = timer() - start
+
+    print('%10s %10s %16s %16s' % ('model', 'ctxs', 'p50 step (us)',
+                                   'p99 step (us)'))
+    for name, detector in (('young', young), ('trained', trained),
+                           ('compacted', compacted)):
+        num_ctxs = detector.get_stats()['num_ctxs']
+        step_times = time_steps(detector, probe)
+        print('%10s %10d %16.1f %16.1f' % (
+            name, num_ctxs, np.percentile(step_times, 50) * 1e6,
+            np.percentile(step_times, 99) * 1e6))
+    print('compaction dropped %d contexts in %.3fs' % (
+        num_dropped, compaction_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
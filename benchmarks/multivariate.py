@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+One multivariate detector against one univariate detector per metric.
+
+Three correlated metrics of a host (CPU, I/O and memory following a common
+load) are scored by three ContextualAnomalyDetectors and by one
+MultivariateAnomalyDetector. Then, for one window, the I/O stops following
+the CPU while both stay in their usual ranges, an anomaly only the
+combination of the metrics shows:
+
+    python -m benchmarks.multivariate --length 3000
+"""
+
+import argparse
+import math
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.multivariate import MultivariateAnomalyDetector
+
+METRICS = ('cpu', 'io', 'mem')
+MODEL_PARAMS = dict(base_threshold=0.75, rest_period=1, max_lsemi_ctxs_len=7,
+                    max_active_neurons_num=15)
+
+
+def correlated_metrics(length, anomaly_start, anomaly_length, seed=0):
+    """
+    :return: dict of metric => values, the I/O mirroring the CPU in the
+             anomaly window
+    """
+    rnd = np.random.RandomState(seed)
+    load = 50.0 + 40.0 * np.sin(np.arange(length) / 50.0 * 2 * math.pi)
+    io_load = load.copy()
+    anomaly = slice(anomaly_start, anomaly_start + anomaly_length)
+    io_load[anomaly] = 100.0 - io_load[anomaly]
+
+    def noise():
+        return rnd.normal(scale=2.0, size=length)
+
+    return {
+        'cpu': np.clip(load + noise(), 0, 100),
+        'io': np.clip(0.8 * io_load + noise(), 0, 100),
+        'mem': np.clip(30.0 + 0.5 * load + noise(), 0, 100),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--length', type=int, default=3000,
+                        help='number of points')
+    parser.add_argument('--anomaly-length', type=int, default=25,
+                        help='number of points of the anomaly')
+    parser.add_argument('--num-norm-value-bits', type=int, default=4,
+                        help='number of bits of every metric')
+    args = parser.parse_args(argv)
+
+    anomaly_start = args.length * 4 // 5
+    anomaly = slice(anomaly_start, anomaly_start + args.anomaly_length)
+    metrics = correlated_metrics(args.length, anomaly_start,
+                                 args.anomaly_length)
+
+    start = timer()
+    univariate_detectors = dict(
+        (name, ContextualAnomalyDetector(
+            min_value=0, max_value=100,
+            num_norm_value_bits=args.num_norm_value_bits, **MODEL_PARAMS))
+        for name in METRICS)
+    univariate_scores = np.max([
+        univariate_detectors[name].score_many(metrics[name])
+        for name in METRICS], axis=0)
+    univariate_time = timer() - start
+
+    start = timer()
+    detector = MultivariateAnomalyDetector(
+        [dict(name=name, min_value=0, max_value=100,
+              num_norm_value_bits=args.num_norm_value_bits)
+         for name in METRICS], **MODEL_PARAMS)
+    multivariate_scores = np.asarray(detector.score_many(metrics))
+    multivariate_time = timer() - start
+
+    normal = np.ones(args.length, dtype=bool)
+    normal[anomaly] = False
+    normal[:args.length // 2] = False  # still learning
+
+    print('%-26s %10s %10s %12s %12s' % (
+        '', 'time (s)', 'contexts', 'anomaly max', 'normal p99'))
+    print('%-26s %10.2f %10d %12.3f %12.3f' % (
+        '3 univariate (max score)', univariate_time,
+        sum(univariate_detectors[name].ctx_operator.get_num_ctxs()
+            for name in METRICS),
+        univariate_scores[anomaly].max(),
+        np.percentile(univariate_scores[normal], 99)))
+    print('%-26s %10.2f %10d %12.3f %12.3f' % (
+        '1 multivariate', multivariate_time,
+        detector.ctx_operator.get_num_ctxs(),
+        multivariate_scores[anomaly].max(),
+        np.percentile(multivariate_scores[normal], 99)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
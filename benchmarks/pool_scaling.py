@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Throughput of a DetectorPool against its number of workers.
+
+The same interleaved many-stream batches are scored by pools of 1, 2, 4...
+workers, after a warm-up batch that creates the detectors (the worker
+startup is not timed). The throughput, the speedup over one worker and the
+parallel efficiency (speedup / workers) show how close to linear the pool
+scales on this machine (relative to the first pool size when it is not
+1), an in-process detector per stream gives the cost of the pool itself:
+
+    python -m benchmarks.pool_scaling --streams 64 --workers 1 2 4 8
+"""
+
+import argparse
+import multiprocessing
+import sys
+from timeit import default_timer as timer
+
+from benchmarks.series import many_streams
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.detector_pool import DetectorPool
+
+DETECTOR_PARAMS = dict(
+    min_value=0, max_value=100, base_threshold=0.75, rest_period=1,
+    max_lsemi_ctxs_len=7, max_active_neurons_num=15, num_norm_value_bits=10)
+
+
+def in_process_throughput(warmup, batches):
+    """
+    :return: Points per second scored by one detector per stream in this
+             process
+    """
+    detectors = {}
+    for stream_key, value in warmup:
+        detectors.setdefault(stream_key, ContextualAnomalyDetector(
+                **DETECTOR_PARAMS)).get_anomaly_score(value)
+    num_points = 0
+    start = timer()
+    for batch in batches:
+        for stream_key, value in batch:
+            detectors[stream_key].get_anomaly_score(value)
+        num_points += len(batch)
+    return num_points / (timer() - start)
+
+
+def pool_throughput(num_workers, warmup, batches):
+    """
+    :return: Points per second scored by a pool of num_workers workers
+    """
+    with DetectorPool(num_workers=num_workers, **DETECTOR_PARAMS) as pool:
+        pool.score(warmup)
+        num_points = 0
+        start = timer()
+        for batch in batches:
+            pool.score(batch)
+            num_points += len(batch)
+        return num_points / (timer() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--streams', type=int, default=64,
+                        help='number of streams')
+    parser.add_argument('--points', type=int, default=200,
+                        help='number of timed points per stream')
+    parser.add_argument('--batch-size', type=int, default=4096,
+                        help='number of points per pool.score call')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8],
+                        help='pool sizes to time')
+    args = parser.parse_args(argv)
+
+    # The points are interleaved, the warm-up batch is the first point of
+    # every stream
+    points = many_streams(args.streams, args.points + 1)
+    warmup, points = points[:args.streams], points[args.streams:]
+    batches = [points[start:start + args.batch_size]
+               for start in range(0, len(points), args.batch_size)]
+
+    print('%d streams, %d points, %d CPUs' % (
+        args.streams, len(points), multiprocessing.cpu_count()))
+    print('%-12s %14s %9s %11s' % ('workers', 'points/s', 'speedup',
+                                   'efficiency'))
+    print('%-12s %14.0f' % ('in-process',
+                            in_process_throughput(warmup, batches)))
+    # Relative to the first pool size, usually 1 worker
+    base_workers = args.workers[0]
+    base_throughput = None
+    for num_workers in args.workers:
+        throughput = pool_throughput(num_workers, warmup, batches)
+        if base_throughput is None:
+            base_throughput = throughput
+        speedup = throughput / base_throughput
+        print('%-12d %14.0f %8.2fx %10.0f%%' % (
+            num_workers, throughput, speedup,
+            100.0 * speedup * base_workers / num_workers))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Overhead benchmark of the profiling hooks.
+
+Copies of a trained detector score the same probe points without profiler,
+with stack sampling only and with stack sampling and allocation tracing.
+The mean time per point of each run is reported, and the report of the
+last profile is written to --output-dir when it is given:
+
+    python -m benchmarks.profiling --output-dir profiles
+"""
+
+import argparse
+import copy
+import sys
+from timeit import default_timer as timer
+
+from benchmarks.step_latency import periodic_series
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.profiling import write_report
+
+DETECTOR_PARAMS = dict(
+    min_value=0, max_value=100, base_threshold=0.75, rest_period=1,
+    max_lsemi_ctxs_len=7, max_active_neurons_num=15, num_norm_value_bits=10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--train', type=int, default=400,
+                        help='number of training points')
+    parser.add_argument('--probe', type=int, default=300,
+                        help='number of scored points')
+    parser.add_argument('--output-dir',
+                        help='write the last profile report there')
+    args = parser.parse_args(argv)
+
+    values = periodic_series(args.train + args.probe)
+    trained = ContextualAnomalyDetector(**DETECTOR_PARAMS)
+    trained.learn_many(values[:args.train])
+    probe = values[args.train:]
+
+    print('%-28s %14s %10s' % ('', 'ms / point', 'samples'))
+    profiler = None
+    for name, profile_params in (
+            ('no profiler', None),
+            ('stack sampling', dict(trace_allocations=False)),
+            ('sampling + allocations', dict(trace_allocations=True))):
+        detector = copy.deepcopy(trained)
+        if profile_params is not None:
+            profiler = detector.start_profiling(stream_key='benchmark',
+                                                **profile_params)
+        start = timer()
+        for value in probe:
+            detector.get_anomaly_score(value)
+        elapsed = timer() - start
+        detector.stop_profiling()
+        print('%-28s %14.3f %10s' % (
+            name, elapsed / len(probe) * 1e3,
+            sum(profiler.stacks.values()) if profile_params else '-'))
+
+    if args.output_dir is not None:
+        print('wrote %s and %s' % write_report(profiler.get_report(),
+                                               args.output_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
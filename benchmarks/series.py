@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Synthetic series generators for the benchmarks. Every generator returns a
+float64 numpy array of values in [0, 100] and is deterministic for a seed.
+"""
+
+import numpy as np
+
+LOW, HIGH = 0.0, 100.0
+
+
+def periodic(num_points, seed=0, period=63.0, noise=3.0):
+    rnd = np.random.default_rng(seed)
+    t = np.arange(num_points)
+    values = 50.0 + 40.0 * np.sin(2 * np.pi * t / period) + \
+        rnd.uniform(-noise, noise, num_points)
+    return np.clip(values, LOW, HIGH)
+
+
+def trend(num_points, seed=0, noise=5.0):
+    rnd = np.random.default_rng(seed)
+    values = np.linspace(10.0, 90.0, num_points) + \
+        rnd.normal(0.0, noise, num_points)
+    return np.clip(values, LOW, HIGH)
+
+
+def step_change(num_points, seed=0, noise=2.0):
+    rnd = np.random.default_rng(seed)
+    values = np.where(np.arange(num_points) < num_points // 2, 25.0, 70.0) + \
+        rnd.normal(0.0, noise, num_points)
+    return np.clip(values, LOW, HIGH)
+
+
+def random_walk(num_points, seed=0, step=3.0):
+    rnd = np.random.default_rng(seed)
+    values = 50.0 + np.cumsum(rnd.uniform(-step, step, num_points))
+    # Reflect on the bounds instead of sticking to them
+    span = HIGH - LOW
+    values = np.abs((values - LOW) % (2 * span) - span)
+    return span - values + LOW
+
+
+SERIES = {
+    'periodic': periodic,
+    'trend': trend,
+    'step': step_change,
+    'random_walk': random_walk,
+}
+
+
+def many_streams(num_streams, num_points, seed=0):
+    """
+    A mix of streams of every kind, interleaved point by point.
+
+    :return: list of (stream_key, value)
+    """
+    kinds = sorted(SERIES)
+    streams = []
+    for stream_num in range(num_streams):
+        kind = kinds[stream_num % len(kinds)]
+        streams.append(('%s-%d' % (kind, stream_num),
+                        SERIES[kind](num_points, seed=seed + stream_num)))
+    return [(stream_key, float(values[i]))
+            for i in range(num_points) for stream_key, values in streams]
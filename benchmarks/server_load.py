@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Loopback load generator for cadose.server.
+
+Starts a ScoringServer in process (or connects to a running one with
+--connect / --unix), opens --connections clients each owning a share of
+--num-streams synthetic streams, sends all their records as fast as the
+server takes them and reads the scores back. Reports records/second and
+the send to answer latency, and checks that every stream was answered in
+order and, with --check, with the scores of a ContextualAnomalyDetector
+fed directly. --slow-clients adds connections that read their answers
+slowly, the others must not be held back.
+
+    python -m benchmarks.server_load --connections 4 --num-streams 32
+"""
+
+import argparse
+import asyncio
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from benchmarks import series
+from benchmarks.suite import BASE_PARAMS
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.server import ScoringServer
+
+
+def make_client_records(num_streams, num_points, num_clients, seed=0):
+    """
+    :return: list with one list of (stream_key, timestamp, value) per
+             client, timestamps are the point numbers of the stream
+    """
+    clients = [[] for _ in range(num_clients)]
+    counts = {}
+    stream_nums = {}
+    for stream_key, value in series.many_streams(num_streams, num_points,
+                                                 seed=seed):
+        timestamp = counts.get(stream_key, 0)
+        counts[stream_key] = timestamp + 1
+        stream_num = stream_nums.setdefault(stream_key, len(stream_nums))
+        clients[stream_num % num_clients].append(
+                (stream_key, timestamp, value))
+    return clients
+
+
+async def run_client(open_connection, records, read_delay=0.0):
+    """
+    Sends records and collects the answers.
+
+    :param open_connection: Coroutine function returning (reader, writer)
+    :param records: list of (stream_key, timestamp, value)
+    :param read_delay: Seconds slept after every answer read
+    :return: dict of stream_key => list of (timestamp, score), and the list
+             of latencies
+    """
+    reader, writer = await open_connection()
+    sent_at = {}
+
+    async def send():
+        for stream_key, timestamp, value in records:
+            sent_at[stream_key, timestamp] = timer()
+            writer.write(('%s,%d,%r\n' % (stream_key, timestamp, value))
+                         .encode('utf-8'))
+            await writer.drain()
+        writer.write_eof()
+
+    sender = asyncio.ensure_future(send())
+    answers = {}
+    latencies = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        stream_key, timestamp, score = line.decode('utf-8').rstrip('\n') \
+            .rsplit(',', 2)
+        if stream_key == 'error':
+            raise RuntimeError('server error on line %s: %s'
+                               % (timestamp, score))
+        timestamp = int(timestamp)
+        latencies.append(timer() - sent_at[stream_key, timestamp])
+        answers.setdefault(stream_key, []).append((timestamp, float(score)))
+        if read_delay:
+            await asyncio.sleep(read_delay)
+    await sender
+    writer.close()
+    return answers, latencies
+
+
+def check_answers(records, answers, detector_params, check_scores):
+    """
+    :return: list of problems found in the answers of a client
+    """
+    problems = []
+    streams = {}
+    for stream_key, timestamp, value in records:
+        streams.setdefault(stream_key, []).append((timestamp, value))
+    for stream_key, points in streams.items():
+        stream_answers = answers.get(stream_key, [])
+        timestamps = [timestamp for timestamp, _ in stream_answers]
+        if timestamps != [timestamp for timestamp, _ in points]:
+            problems.append('%s: answers missing or out of order'
+                            % stream_key)
+        elif check_scores:
+            expected = ContextualAnomalyDetector(**detector_params) \
+                .score_many([value for _, value in points])
+            if not np.array_equal(
+                    expected, [score for _, score in stream_answers]):
+                problems.append('%s: scores differ' % stream_key)
+    return problems
+
+
+async def run(args):
+    detector_params = dict(BASE_PARAMS)
+    server = None
+    if args.connect or args.unix_connect:
+        address = args.connect
+    else:
+        server = ScoringServer(detector_params,
+                               max_batch_size=args.max_batch_size,
+                               max_pending=args.max_pending)
+        await server.start(host='127.0.0.1', port=0)
+        address = '127.0.0.1:%d' % server.get_addresses()[0][1]
+
+    if args.unix_connect:
+        def open_connection():
+            return asyncio.open_unix_connection(args.unix_connect)
+    else:
+        host, port = address.rsplit(':', 1)
+
+        def open_connection():
+            return asyncio.open_connection(host, int(port))
+
+    num_clients = args.connections + args.slow_clients
+    clients = make_client_records(args.num_streams, args.num_points,
+                                  num_clients)
+    start = timer()
+    fast_done = []
+
+    async def timed_client(records, read_delay):
+        result = await run_client(open_connection, records, read_delay)
+        if not read_delay:
+            fast_done.append(timer() - start)
+        return result
+
+    results = await asyncio.gather(*[
+        timed_client(records,
+                     args.slow_read_delay if num >= args.connections else 0.0)
+        for num, records in enumerate(clients)])
+    elapsed = timer() - start
+    if server is not None:
+        await server.close()
+
+    num_records = sum(len(records) for records in clients)
+    latencies = np.concatenate([latencies for _, latencies in results
+                                if latencies])
+    print('%d records, %d streams, %d connections (%d slow)'
+          % (num_records, args.num_streams, num_clients, args.slow_clients))
+    print('throughput: %.1f records/s' % (num_records / elapsed))
+    if fast_done:
+        print('fast clients done after %.2fs, all after %.2fs'
+              % (max(fast_done), elapsed))
+    print('latency: p50 %.1f ms, p99 %.1f ms'
+          % (np.percentile(latencies, 50) * 1e3,
+             np.percentile(latencies, 99) * 1e3))
+
+    problems = []
+    for records, (answers, _) in zip(clients, results):
+        problems.extend(check_answers(records, answers, detector_params,
+                                      args.check))
+    for problem in problems:
+        print('PROBLEM: %s' % problem)
+    return 1 if problems else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Loopback load generator for cadose.server.')
+    parser.add_argument('--connect', help='host:port of a running server, '
+                                          'one is started in process '
+                                          'otherwise')
+    parser.add_argument('--unix-connect',
+                        help='Unix socket path of a running server')
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--slow-clients', type=int, default=0,
+                        help='extra connections reading their answers '
+                             'slowly')
+    parser.add_argument('--slow-read-delay', type=float, default=0.01,
+                        help='seconds a slow client waits between answers')
+    parser.add_argument('--num-streams', type=int, default=16)
+    parser.add_argument('--num-points', type=int, default=200,
+                        help='points per stream')
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-pending', type=int, default=1024)
+    parser.add_argument('--check', action='store_true',
+                        help='check the scores against directly fed '
+                             'detectors (the server must use the '
+                             'default detector parameters)')
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Memory per detector of a many-stream deployment, with and without a shared
+dictionary.
+
+Detectors with the same configuration score the streams of a metric family
+(noisy variants of one periodic signal), once each with its own encodings
+and fact groups and once all referencing one SharedDictionary. The memory
+traced by tracemalloc is reported per detector after a short and after a
+long history:
+
+    python -m benchmarks.shared_dictionary --streams 20
+"""
+
+import argparse
+import gc
+import math
+import sys
+import tracemalloc
+
+import numpy as np
+
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.shared_dictionary import clear_shared_dictionaries
+
+DETECTOR_PARAMS = dict(
+    min_value=0, max_value=100, base_threshold=0.75, rest_period=1,
+    max_lsemi_ctxs_len=7, max_active_neurons_num=15, num_norm_value_bits=10)
+
+
+def family_series(num_streams, length, seed=0):
+    """
+    :return: list of num_streams series of length points, the same periodic
+             signal with different noise and phase
+    """
+    rnd = np.random.RandomState(seed)
+    timeline = np.arange(length)
+    return [np.clip(50.0 + 30.0 * np.sin(
+                (timeline + rnd.randint(50)) / 50.0 * 2 * math.pi) +
+                rnd.normal(scale=3.0, size=length), 0, 100)
+            for _ in range(num_streams)]
+
+
+def memory_per_detector(series, detector_params):
+    """
+    :return: (traced memory per detector in bytes after the points, the
+              detectors)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        detectors = [ContextualAnomalyDetector(**detector_params)
+                     for _ in series]
+        for detector, values in zip(detectors, series):
+            detector.score_many(values)
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return memory / float(len(series)), detectors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--streams', type=int, default=20,
+                        help='number of detectors')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[50, 300],
+                        help='number of points per stream')
+    parser.add_argument('--compact', action='store_true',
+                        help='use the compact context operator')
+    args = parser.parse_args(argv)
+
+    detector_params = dict(DETECTOR_PARAMS, compact=args.compact)
+    print('%8s %14s %14s %8s' % ('points', 'private (KB)', 'shared (KB)',
+                                 'saved'))
+    for length in args.lengths:
+        series = family_series(args.streams, length)
+        private, detectors = memory_per_detector(series, detector_params)
+        del detectors
+        clear_shared_dictionaries()
+        shared, detectors = memory_per_detector(
+                series, dict(detector_params, dictionary_id='family'))
+        del detectors
+        clear_shared_dictionaries()
+        print('%8d %14.1f %14.1f %7.1f%%' % (
+            length, private / 1024, shared / 1024,
+            100.0 * (private - shared) / private))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Allocation benchmark of ContextualAnomalyDetector.step.
+
+A detector is trained on a periodic series, then the probe points are
+scored one by one while counting the generation 0 garbage collections
+(driven by the number of container objects allocated and not yet freed)
+and timing every step with tracemalloc tracing on, which makes every
+allocation expensive:
+
+    python -m benchmarks.step_allocations --compact
+"""
+
+import argparse
+import gc
+import sys
+import tracemalloc
+from timeit import default_timer as timer
+
+import numpy as np
+
+from benchmarks.step_latency import periodic_series
+from cadose.cad_ose import ContextualAnomalyDetector
+
+
+def probe(detector, values, trace):
+    """
+    Scores the values one by one.
+
+    :param trace: Trace the allocations with tracemalloc while scoring
+    :return: (list of step latencies, number of generation 0 collections,
+              peak traced memory or None)
+    """
+    step_times = []
+    gc.collect()
+    collections = gc.get_stats()[0]['collections']
+    if trace:
+        tracemalloc.start()
+    try:
+        for value in values:
+            start = timer()
+            detector.get_anomaly_score(value)
+            step_times.append(timer() - start)
+        peak = tracemalloc.get_traced_memory()[1] if trace else None
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return (step_times, gc.get_stats()[0]['collections'] - collections,
+            peak)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--train', type=int, default=600,
+                        help='number of training points')
+    parser.add_argument('--probe', type=int, default=400,
+                        help='number of scored points')
+    parser.add_argument('--compact', action='store_true',
+                        help='use the compact context operator')
+    parser.add_argument('--bitset', action='store_true',
+                        help='use the bitset context operator')
+    args = parser.parse_args(argv)
+
+    series = periodic_series(args.train + 2 * args.probe)
+    detector = ContextualAnomalyDetector(
+        min_value=0, max_value=100, base_threshold=0.75, rest_period=1,
+        max_lsemi_ctxs_len=7, max_active_neurons_num=15,
+        num_norm_value_bits=10, compact=args.compact, bitset=args.bitset)
+    detector.learn_many(series[:args.train])
+
+    print('%10s %16s %16s %18s %14s' % (
+        'tracing', 'p50 step (us)', 'p99 step (us)', 'gen0 gc / 1000',
+        'peak (KiB)'))
+    for trace, values in ((False, series[args.train:][:args.probe]),
+                          (True, series[args.train + args.probe:])):
+        step_times, num_collections, peak = probe(detector, values, trace)
+        print('%10s %16.1f %16.1f %18.1f %14s' % (
+            'on' if trace else 'off',
+            np.percentile(step_times, 50) * 1e6,
+            np.percentile(step_times, 99) * 1e6,
+            1000.0 * num_collections / len(values),
+            '%.1f' % (peak / 1024.0) if trace else '-'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Regression benchmark for the per step latency of the left crossing
+(ContextOperator.cross_ctxs_left) as the model grows.
+
+A detector is trained on a periodic series, then copies of it are inflated
+with cold left semi contexts built on facts the input never produces. The
+same probe series is then scored by every copy while timing the left
+crossing. Only the semi contexts reachable from the current facts should be
+visited, so the latency must stay flat whatever the number of cold semi
+contexts.
+
+    python -m benchmarks.step_latency --max-ratio 2
+"""
+
+import argparse
+import copy
+import math
+import random
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from cadose.cad_ose import ContextualAnomalyDetector
+
+# Facts in this range are never produced by the sensor encoding nor by the
+# neurons, semi contexts built on them are never crossed
+COLD_FACT_BASE = 2 ** 30
+
+
+def periodic_series(num_points, seed=0):
+    rnd = random.Random(seed)
+    return np.array([50.0 + 40.0 * math.sin(i / 10.0) + rnd.uniform(-3, 3)
+                     for i in range(num_points)])
+
+
+def inflate(detector, num_cold_ctxs, seed=0):
+    """
+    Adds num_cold_ctxs contexts on cold left semi contexts to the detector.
+
+    :param detector: A ContextualAnomalyDetector
+    :param num_cold_ctxs: The number of contexts (and left semi contexts)
+    :return: None
+    """
+    rnd = random.Random(seed)
+    new_ctxs = []
+    for i in range(num_cold_ctxs):
+        left_facts = tuple(sorted(COLD_FACT_BASE + rnd.randrange(1 << 20)
+                                  for _ in range(3))) + (
+            COLD_FACT_BASE + (1 << 20) + i,)
+        new_ctxs.append((left_facts, (65536,)))
+    detector.ctx_operator._add_ctxs_by_facts(new_ctxs, zerolevel=False)
+
+
+def time_left_crossing(detector, values):
+    """
+    Scores the values while timing every call to cross_ctxs_left.
+
+    :return: (list of left crossing latencies, list of step latencies)
+    """
+    ctx_operator = detector.ctx_operator
+    cross_ctxs_left = ctx_operator.cross_ctxs_left
+    left_times = []
+
+    def timed_cross_ctxs_left(*args, **kwargs):
+        start = timer()
+        result = cross_ctxs_left(*args, **kwargs)
+        left_times.append(timer() - start)
+        return result
+
+    ctx_operator.cross_ctxs_left = timed_cross_ctxs_left
+    step_times = []
+    try:
+        for value in values:
+            start = timer()
+            detector.get_anomaly_score(value)
+            step_times.append(timer() - start)
+    finally:
+        del ctx_operator.cross_ctxs_left
+    return left_times, step_times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--train', type=int, default=600,
+                        help='number of training points')
+    parser.add_argument('--probe', type=int, default=200,
+                        help='number of timed points per model size')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[0, 10000, 50000, 200000],
+                        help='numbers of cold contexts to add')
+    parser.add_argument('--max-ratio', type=float, default=None,
+                        help='fail if the p50 left crossing latency of the '
+                             'biggest model exceeds the one of the smallest '
+                             'by more than this factor')
+    args = parser.parse_args(argv)
+
+    series = periodic_series(args.train + args.probe)
+    base = ContextualAnomalyDetector(
+        min_value=0, max_value=100, base_threshold=0.75, rest_period=1,
+        max_lsemi_ctxs_len=7, max_active_neurons_num=15,
+        num_norm_value_bits=10)
+    base.learn_many(series[:args.train])
+
+    print('%12s %12s %16s %16s' % ('cold ctxs', 'left semis',
+                                   'p50 left (us)', 'p50 step (us)'))
+    p50s = []
+    for size in args.sizes:
+        detector = copy.deepcopy(base)
+        inflate(detector, size)
+        left_times, step_times = time_left_crossing(
+            detector, series[args.train:])
+        p50_left = np.percentile(left_times, 50) * 1e6
+        p50s.append(p50_left)
+        print('%12d %12d %16.1f %16.1f' % (
+            size, len(detector.ctx_operator.left.semi_ctxs), p50_left,
+            np.percentile(step_times, 50) * 1e6))
+
+    ratio = p50s[-1] / p50s[0]
+    print('p50 left crossing ratio (largest / smallest model): %.2f' % ratio)
+    if args.max_ratio is not None and ratio > args.max_ratio:
+        print('FAIL: ratio above %.2f' % args.max_ratio)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
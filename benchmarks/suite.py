@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Benchmark suite for detector throughput, step latency and model growth.
+
+Every benchmark runs in a fresh process so its RSS is its own. Each one
+varies a single parameter around BASE_PARAMS (stream length,
+num_norm_value_bits, max_lsemi_ctxs_len, max_active_neurons_num) or runs a
+many-stream mix, and reports points/second, p50/p99 step latency, the
+number of contexts along the stream and the RSS. Results are written as
+JSON and can be compared with an earlier run:
+
+    python -m benchmarks.suite --output new.json --compare old.json
+
+The suite also checks that the optimized scoring paths give exactly the
+scores of get_anomaly_score, see SCORING_PATHS.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+
+from benchmarks import series
+from cadose.cad_ose import ContextualAnomalyDetector
+
+BASE_PARAMS = dict(
+    min_value=0.0,
+    max_value=100.0,
+    base_threshold=0.75,
+    rest_period=1,
+    max_lsemi_ctxs_len=7,
+    max_active_neurons_num=15,
+    num_norm_value_bits=10,
+)
+
+SWEEPS = {
+    'num_points': [500, 1000, 2000],
+    'num_norm_value_bits': [6, 10, 14],
+    'max_lsemi_ctxs_len': [5, 7, 9],
+    'max_active_neurons_num': [8, 15, 25],
+}
+
+QUICK_SWEEPS = {
+    'num_points': [300, 600],
+    'num_norm_value_bits': [6, 10],
+    'max_lsemi_ctxs_len': [5, 7],
+    'max_active_neurons_num': [8, 15],
+}
+
+# Number of context count samples taken along a stream
+NUM_GROWTH_SAMPLES = 10
+
+
+def get_rss():
+    """
+    :return: Current resident set size in bytes (peak one when the current
+             one can't be read)
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _summary(latencies, num_points, elapsed, growth, detectors, rss_before):
+    latencies = np.asarray(latencies)
+    return {
+        'num_points': num_points,
+        'points_per_sec': num_points / elapsed if elapsed else 0.0,
+        'p50_latency_us': float(np.percentile(latencies, 50) * 1e6),
+        'p99_latency_us': float(np.percentile(latencies, 99) * 1e6),
+        'num_ctxs': sum(detector.get_stats()['num_ctxs']
+                        for detector in detectors),
+        'ctxs_growth': growth,
+        'rss_bytes': get_rss(),
+        'rss_delta_bytes': get_rss() - rss_before,
+    }
+
+
+def run_single_stream(kind, num_points, params, seed=0):
+    """
+    Scores one synthetic series point by point.
+
+    :return: dict of measures
+    """
+    values = series.SERIES[kind](num_points, seed=seed).tolist()
+    rss_before = get_rss()
+    detector = ContextualAnomalyDetector(**params)
+    latencies = []
+    growth = []
+    sample_every = max(1, num_points // NUM_GROWTH_SAMPLES)
+    get_anomaly_score = detector.get_anomaly_score
+
+    start = timer()
+    for point_num, value in enumerate(values, 1):
+        step_start = timer()
+        get_anomaly_score(value)
+        latencies.append(timer() - step_start)
+        if point_num % sample_every == 0:
+            growth.append([point_num, detector.get_stats()['num_ctxs']])
+    elapsed = timer() - start
+
+    return _summary(latencies, num_points, elapsed, growth, [detector],
+                    rss_before)
+
+
+def run_many_streams(num_streams, num_points, params, seed=0):
+    """
+    Scores an interleaved mix of num_streams synthetic series.
+
+    :return: dict of measures
+    """
+    points = series.many_streams(num_streams, num_points, seed=seed)
+    rss_before = get_rss()
+    detectors = {}
+    latencies = []
+    growth = []
+    sample_every = max(1, len(points) // NUM_GROWTH_SAMPLES)
+
+    start = timer()
+    for point_num, (stream_key, value) in enumerate(points, 1):
+        detector = detectors.get(stream_key)
+        if detector is None:
+            detector = detectors[stream_key] = \
+                ContextualAnomalyDetector(**params)
+        step_start = timer()
+        detector.get_anomaly_score(value)
+        latencies.append(timer() - step_start)
+        if point_num % sample_every == 0:
+            growth.append([point_num,
+                           sum(detector.get_stats()['num_ctxs']
+                               for detector in detectors.values())])
+    elapsed = timer() - start
+
+    result = _summary(latencies, len(points), elapsed, growth,
+                      detectors.values(), rss_before)
+    result['num_streams'] = num_streams
+    return result
+
+
+def _run_benchmark(spec):
+    if spec['kind'] == 'many_streams':
+        return run_many_streams(spec['num_streams'], spec['num_points'],
+                                spec['params'])
+    return run_single_stream(spec['kind'], spec['num_points'],
+                             spec['params'])
+
+
+def make_specs(kinds, sweeps, base_num_points, num_streams, extra_params):
+    """
+    :return: list of benchmark specs, one parameter varied at a time
+    """
+    base_params = dict(BASE_PARAMS, **extra_params)
+    specs = []
+    for kind in kinds:
+        for name, values in sweeps.items():
+            for value in values:
+                params = dict(base_params)
+                num_points = base_num_points
+                if name == 'num_points':
+                    num_points = value
+                else:
+                    params[name] = value
+                specs.append({
+                    'name': '%s/%s=%s' % (kind, name, value),
+                    'kind': kind,
+                    'num_points': num_points,
+                    'params': params,
+                })
+    if num_streams:
+        specs.append({
+            'name': 'many_streams/num_streams=%d' % num_streams,
+            'kind': 'many_streams',
+            'num_streams': num_streams,
+            'num_points': base_num_points // num_streams or 1,
+            'params': base_params,
+        })
+    return specs
+
+
+def _score_per_point(params, values):
+    detector = ContextualAnomalyDetector(**params)
+    return np.array([detector.get_anomaly_score(value) for value in values])
+
+
+def _score_many(params, values):
+    return ContextualAnomalyDetector(**params).score_many(values)
+
+
+def _score_compact(params, values):
+    return ContextualAnomalyDetector(compact=True, **params) \
+        .score_many(values)
+
+
+def _score_bitset(params, values):
+    return ContextualAnomalyDetector(bitset=True, **params) \
+        .score_many(values)
+
+
+def _score_after_learning(params, values):
+    half = len(values) // 2
+    detector = ContextualAnomalyDetector(**params)
+    detector.learn_many(values[:half])
+    return detector.score_many(values[half:])
+
+
+def _score_alert_policy(params, values):
+    policy_params = dict(base_threshold=params['base_threshold'],
+                         rest_period=params['rest_period'])
+    detector = ContextualAnomalyDetector(**dict(
+            params, base_threshold=float('inf'), rest_period=1,
+            alert_policies={'checked': policy_params}))
+    return detector.score_policies(values).policies['checked']
+
+
+def _score_snapshot_restart(params, values):
+    half = len(values) // 2
+    detector = ContextualAnomalyDetector(compact=True, **params)
+    scores = [detector.score_many(values[:half])]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'detector.snapshot')
+        detector.save(path)
+        detector = ContextualAnomalyDetector.load(path, compact=False)
+        scores.append(detector.score_many(values[half:]))
+    return np.concatenate(scores)
+
+
+# Scoring paths checked against get_anomaly_score, they return the scores of
+# the values or of the last ones when they only learn from the first ones
+SCORING_PATHS = {
+    'score_many': _score_many,
+    'compact': _score_compact,
+    'bitset': _score_bitset,
+    'snapshot_restart': _score_snapshot_restart,
+    'learn_then_score': _score_after_learning,
+    'alert_policy': _score_alert_policy,
+}
+
+
+def check_scores(kinds, num_points, params=BASE_PARAMS):
+    """
+    :return: list of (series kind, path name) whose scores differ from the
+             per point get_anomaly_score ones
+    """
+    mismatches = []
+    for kind in kinds:
+        values = series.SERIES[kind](num_points, seed=1)
+        expected = _score_per_point(params, values)
+        for path_name, score in SCORING_PATHS.items():
+            scores = score(params, values)
+            if not np.array_equal(scores,
+                                  expected[len(expected) - len(scores):]):
+                mismatches.append((kind, path_name))
+    return mismatches
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the ratios of the results to a baseline run.
+
+    :return: list of the names of the benchmarks slower than the baseline by
+             more than tolerance
+    """
+    baseline = dict((result['name'], result)
+                    for result in baseline['benchmarks'])
+    regressions = []
+    print('\n%-45s %10s %10s %10s %10s' % ('vs baseline', 'pts/s',
+                                           'p99', 'ctxs', 'rss'))
+    for result in results['benchmarks']:
+        old = baseline.get(result['name'])
+        if old is None:
+            continue
+
+        def ratio(key):
+            return result[key] / old[key] if old[key] else float('nan')
+
+        speedup = ratio('points_per_sec')
+        print('%-45s %9.2fx %9.2fx %9.2fx %9.2fx' % (
+            result['name'], speedup, ratio('p99_latency_us'),
+            ratio('num_ctxs'), ratio('rss_bytes')))
+        if speedup < 1.0 - tolerance:
+            regressions.append(result['name'])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Detector throughput, latency and model growth '
+                        'benchmarks.')
+    parser.add_argument('--series', nargs='+', default=['periodic'],
+                        choices=sorted(series.SERIES),
+                        help='series kinds to run the sweeps on')
+    parser.add_argument('--num-points', type=int, default=1000,
+                        help='stream length when it is not the swept '
+                             'parameter')
+    parser.add_argument('--num-streams', type=int, default=8,
+                        help='streams of the many-stream mix, 0 to skip it')
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller sweeps')
+    parser.add_argument('--compact', action='store_true',
+                        help='benchmark the compact context operator')
+    parser.add_argument('--bitset', action='store_true',
+                        help='benchmark the bitset context operator')
+    parser.add_argument('--output', help='write the results as JSON here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='throughput drop tolerated by --compare')
+    parser.add_argument('--check-points', type=int, default=400,
+                        help='series length of the score identity check, '
+                             '0 to skip it')
+    args = parser.parse_args(argv)
+
+    sweeps = QUICK_SWEEPS if args.quick else SWEEPS
+    extra_params = {}
+    if args.compact:
+        extra_params['compact'] = True
+    if args.bitset:
+        extra_params['bitset'] = True
+    specs = make_specs(args.series, sweeps, args.num_points,
+                       args.num_streams, extra_params)
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': [],
+    }
+    print('%-45s %10s %10s %10s %10s %8s' % ('benchmark', 'pts/s',
+                                             'p50 us', 'p99 us', 'ctxs',
+                                             'rss MB'))
+    mp_context = multiprocessing.get_context('spawn')
+    with mp_context.Pool(1, maxtasksperchild=1) as pool:
+        for spec in specs:
+            result = pool.apply(_run_benchmark, (spec,))
+            result.update(name=spec['name'], params=spec['params'])
+            results['benchmarks'].append(result)
+            print('%-45s %10.1f %10.1f %10.1f %10d %8.1f' % (
+                spec['name'], result['points_per_sec'],
+                result['p50_latency_us'], result['p99_latency_us'],
+                result['num_ctxs'], result['rss_bytes'] / 2.0 ** 20))
+
+    status = 0
+    if args.check_points:
+        mismatches = check_scores(sorted(series.SERIES), args.check_points)
+        results['score_mismatches'] = mismatches
+        for kind, path_name in mismatches:
+            print('MISMATCH: %s scores differ on %s' % (path_name, kind))
+            status = 1
+        if not mismatches:
+            print('\nscores identical for %s'
+                  % ', '.join(sorted(SCORING_PATHS)))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for name in regressions:
+            print('REGRESSION: %s' % name)
+            status = 1
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Pre-aggregation of high frequency streams.
+
+Raw (timestamp, value) samples are grouped into fixed windows and only the
+aggregates of every window (mean, min, max, last, count and percentiles
+such as p95) are scored, possibly each by its own detector:
+
+    aggregator = WindowAggregator(1.0, ('mean', 'max', 'p99'),
+                                  allowed_lateness=0.5)
+    stage = AggregationStage(aggregator, {
+        'mean': ContextualAnomalyDetector(**params),
+        'p99': ContextualAnomalyDetector(**params),
+    })
+    for timestamps, values in chunks:
+        windows = stage.add(timestamps, values)
+
+Chunks are aggregated with a few numpy operations, whatever the number of
+samples and windows in them. Timestamps are numbers (e.g. seconds since
+the epoch) and may come out of order: a window is closed, and its
+aggregates emitted, once a timestamp allowed_lateness past its end shows
+up. The samples of closed windows are dropped and counted in num_late.
+"""
+
+import collections
+
+import numpy as np
+
+# Aggregates besides the percentiles ('p' followed by the percentile)
+AGGREGATES = ('mean', 'min', 'max', 'last', 'count')
+
+Windows = collections.namedtuple('Windows', [
+        'starts',  # np.ndarray of the start timestamps of the windows
+        'aggregates',  # aggregate name => np.ndarray, one value per window
+])
+
+ScoredWindows = collections.namedtuple('ScoredWindows', [
+        'starts',
+        'aggregates',
+        'scores',  # aggregate name => np.ndarray of the detector scores
+])
+
+
+def _parse_percentile(name):
+    """
+    :return: The percentile of an aggregate name like 'p95', None for the
+             other aggregates
+    """
+    if name in AGGREGATES:
+        return None
+    try:
+        percentile = float(name[1:]) if name.startswith('p') else None
+    except ValueError:
+        percentile = None
+    if percentile is None or not 0.0 <= percentile <= 100.0:
+        raise ValueError('unknown aggregate %r' % (name,))
+    return percentile
+
+
+def _aggregate(window_ids, timestamps, values, aggregates):
+    """
+    :param window_ids: np.ndarray of the window of every sample
+    :param timestamps: np.ndarray of the timestamp of every sample
+    :param values: np.ndarray of the value of every sample, in arrival
+                   order
+    :param aggregates: dict of aggregate name => percentile or None
+    :return: (sorted np.ndarray of the distinct window ids, dict of
+             aggregate name => np.ndarray with one value per window)
+    """
+    # By window then timestamp, the ties in arrival order
+    order = np.lexsort((timestamps, window_ids))
+    sorted_ids = window_ids[order]
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.concatenate(
+            [[True], sorted_ids[1:] != sorted_ids[:-1]]))
+    counts = np.diff(np.append(starts, len(sorted_ids)))
+
+    results = {}
+    value_order = None
+    for name, percentile in aggregates.items():
+        if name == 'mean':
+            results[name] = np.add.reduceat(sorted_values, starts) / counts
+        elif name == 'min':
+            results[name] = np.minimum.reduceat(sorted_values, starts)
+        elif name == 'max':
+            results[name] = np.maximum.reduceat(sorted_values, starts)
+        elif name == 'last':
+            results[name] = sorted_values[starts + counts - 1]
+        elif name == 'count':
+            results[name] = counts.astype(np.float64)
+        else:
+            # Linear interpolation between the closest ranks, as
+            # np.percentile does
+            if value_order is None:
+                value_order = values[np.lexsort((values, window_ids))]
+            rank = (counts - 1) * (percentile / 100.0)
+            low = np.floor(rank).astype(np.int64)
+            high = np.minimum(low + 1, counts - 1)
+            low_values = value_order[starts + low]
+            results[name] = low_values + (
+                    value_order[starts + high] - low_values) * (rank - low)
+    return sorted_ids[starts], results
+
+
+class WindowAggregator(object):
+    """
+    Aggregates (timestamp, value) samples into the fixed windows
+    [origin + k * window, origin + (k + 1) * window).
+
+    Only the windows with samples are emitted. The samples of the open
+    windows are buffered until the windows close, so the memory depends on
+    the sample rate and allowed_lateness, not on the length of the stream.
+    """
+    def __init__(self, window, aggregates=('mean',), allowed_lateness=0.0,
+                 origin=0.0):
+        """
+        :param window: Length of the windows, in timestamp units
+        :param aggregates: Names of the aggregates to compute, among
+                           AGGREGATES and 'p<percentile>' ('p50', 'p99.9')
+        :param allowed_lateness: How far past the end of a window samples
+                                 may still arrive, it is closed afterwards
+        :param origin: Start of the window 0
+        """
+        if not window > 0:
+            raise ValueError('the window must be positive')
+        if allowed_lateness < 0:
+            raise ValueError('the allowed lateness must not be negative')
+        if not aggregates:
+            raise ValueError('no aggregate')
+        self.window = float(window)
+        self.allowed_lateness = float(allowed_lateness)
+        self.origin = float(origin)
+        self.aggregates = dict((name, _parse_percentile(name))
+                               for name in aggregates)
+
+        # Samples of the windows still open
+        self._window_ids = np.zeros(0, dtype=np.int64)
+        self._timestamps = np.zeros(0, dtype=np.float64)
+        self._values = np.zeros(0, dtype=np.float64)
+
+        # Id of the first window still open, None before the first sample
+        self.closed_until = None
+        self.max_timestamp = -np.inf
+        self.num_samples = 0
+        self.num_late = 0
+
+    def add(self, timestamps, values):
+        """
+        :param timestamps: 1-d array like of sample timestamps, in any order
+        :param values: 1-d array like of sample values
+        :return: Windows closed by these samples, in time order
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64).ravel()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(timestamps) != len(values):
+            raise ValueError('as many timestamps as values are needed')
+        # A nan timestamp has no window and an infinite one would close
+        # every window
+        if not np.all(np.isfinite(timestamps)):
+            raise ValueError('cannot aggregate non finite timestamps')
+        self.num_samples += len(values)
+
+        window_ids = np.floor(
+                (timestamps - self.origin) / self.window).astype(np.int64)
+        if self.closed_until is not None:
+            on_time = window_ids >= self.closed_until
+            if not on_time.all():
+                self.num_late += len(on_time) - int(np.count_nonzero(on_time))
+                window_ids = window_ids[on_time]
+                timestamps = timestamps[on_time]
+                values = values[on_time]
+
+        self._window_ids = np.concatenate([self._window_ids, window_ids])
+        self._timestamps = np.concatenate([self._timestamps, timestamps])
+        self._values = np.concatenate([self._values, values])
+
+        if len(timestamps):
+            self.max_timestamp = max(self.max_timestamp,
+                                     float(timestamps.max()))
+        if self.max_timestamp == -np.inf:
+            return self._emit(None)
+        # The windows ending before the watermark are complete
+        watermark = self.max_timestamp - self.allowed_lateness
+        return self._emit(int(np.floor(
+                (watermark - self.origin) / self.window)))
+
+    def flush(self):
+        """
+        Closes all the open windows, at the end of a stream.
+
+        :return: Windows of the samples still buffered
+        """
+        if not len(self._window_ids):
+            return self._emit(None)
+        return self._emit(int(self._window_ids.max()) + 1)
+
+    def _emit(self, closed_until):
+        """
+        :param closed_until: Id of the first window to keep open, None to
+                             close none
+        :return: Windows of the closed windows
+        """
+        if closed_until is None or (self.closed_until is not None and
+                                    closed_until <= self.closed_until):
+            return self._get_empty_windows()
+        self.closed_until = closed_until
+
+        closed = self._window_ids < closed_until
+        if not closed.any():
+            return self._get_empty_windows()
+        window_ids, aggregates = _aggregate(
+                self._window_ids[closed], self._timestamps[closed],
+                self._values[closed], self.aggregates)
+        open_windows = ~closed
+        self._window_ids = self._window_ids[open_windows]
+        self._timestamps = self._timestamps[open_windows]
+        self._values = self._values[open_windows]
+        return Windows(self.origin + window_ids * self.window, aggregates)
+
+    def _get_empty_windows(self):
+        return Windows(np.zeros(0, dtype=np.float64), dict(
+                (name, np.zeros(0, dtype=np.float64))
+                for name in self.aggregates))
+
+
+class AggregationStage(object):
+    """
+    A WindowAggregator in front of detectors: every aggregate of the closed
+    windows goes to its detector, the detectors see one point per window.
+    """
+    def __init__(self, aggregator, detectors):
+        """
+        :param aggregator: The WindowAggregator
+        :param detectors: dict of aggregate name => ContextualAnomalyDetector
+                          scoring it, the aggregates without detector are
+                          only passed through
+        """
+        unknown = set(detectors) - set(aggregator.aggregates)
+        if unknown:
+            raise ValueError('no aggregate for the detectors of %s'
+                             % ', '.join(sorted(unknown)))
+        self.aggregator = aggregator
+        self.detectors = detectors
+
+    def add(self, timestamps, values):
+        """
+        :param timestamps: 1-d array like of sample timestamps, in any order
+        :param values: 1-d array like of sample values
+        :return: ScoredWindows of the windows closed by these samples
+        """
+        return self._score(self.aggregator.add(timestamps, values))
+
+    def flush(self):
+        """
+        :return: ScoredWindows of the windows still open
+        """
+        return self._score(self.aggregator.flush())
+
+    def _score(self, windows):
+        return ScoredWindows(windows.starts, windows.aggregates, dict(
+                (name, detector.score_many(windows.aggregates[name]))
+                for name, detector in self.detectors.items()))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+
+from cadose.score_history import ScoreHistory
+
+
+class AlertPolicy(object):
+    """
+    The alert suppression of ContextualAnomalyDetector on its own: a raw
+    score is zeroed when one of the rest_period previous raw scores (1.0
+    before the first one) reached base_threshold. The learned model does not
+    depend on it, so any number of policies can post-process the raw scores
+    of a single detector, each with its own history.
+    """
+    def __init__(self, base_threshold, rest_period, history=None):
+        """
+        :param base_threshold: The score from which the next ones are
+                               suppressed
+        :param rest_period: The number of scores suppressed after it, 0 for
+                            all of them
+        :param history: ScoreHistory to go on from, a new one by default
+        """
+        self.base_threshold = base_threshold
+        self.rest_period = rest_period
+        self.history = ScoreHistory(rest_period) if history is None \
+            else history
+        self.last_score = 0.0
+
+    def apply(self, raw_score):
+        """
+        :param raw_score: The next raw score
+        :return: The score once post-processed, also kept in last_score
+        """
+        history = self.history
+        self.last_score = raw_score if history.max() < self.base_threshold \
+            else 0.0
+        history.append(raw_score)
+        return self.last_score
+
+    def apply_many(self, raw_scores):
+        """
+        :param raw_scores: list of the next raw scores
+        :return: np.ndarray of the post-processed scores
+        """
+        apply = self.apply
+        scores = np.empty(len(raw_scores), dtype=np.float64)
+        for idx, raw_score in enumerate(raw_scores):
+            scores[idx] = apply(raw_score)
+        return scores
+
+    def get_params(self):
+        """
+        :return: dict of the keyword arguments the policy was made with,
+                 apart from the history
+        """
+        return {
+            'base_threshold': self.base_threshold,
+            'rest_period': self.rest_period,
+        }
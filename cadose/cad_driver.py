@@ -17,67 +17,408 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # -----------------------------------------------------------------------------
+"""
+Streaming command line scorer.
 
-import pandas as pd
-import numpy as np
+Reads CSV or NDJSON records from a file or stdin, scores the value of every
+record with one ContextualAnomalyDetector per stream and writes the scores
+as they are computed:
+
+    python -m cadose.cad_driver metrics.csv --min-value 0 --max-value 100
+    tail -f metrics.ndjson | python -m cadose.cad_driver --format ndjson \
+        --key-column host --timestamp-column ts
+
+Records are processed in chunks so memory stays bounded by the chunk size
+and the detectors, whatever the length of the input. When the input is a
+pipe or a terminal, a chunk is scored as soon as no more input is ready
+rather than once it is full, so the scores of a slow stream (tail -f) come
+out as its records come in. matplotlib is only imported with --plot, which
+keeps every value and score in memory.
+"""
+
+import argparse
+import collections
+import csv
+import io
+import itertools
+import json
+import os
+import select
+import stat
+import sys
 
 from cadose.cad_ose import ContextualAnomalyDetector
 
+DETECTOR_DEFAULTS = dict(
+    min_value=0.0,
+    max_value=100.0,
+    base_threshold=0.75,
+    rest_period=1,
+    max_lsemi_ctxs_len=7,
+    max_active_neurons_num=15,
+    num_norm_value_bits=10,
+)
+
+
+def read_csv_records(file):
+    """
+    :param file: A text file with a header line, or an iterable of its lines
+    :return: Generator of dicts, one per line
+    """
+    for record in csv.DictReader(file):
+        yield record
+
+
+def read_ndjson_records(file):
+    """
+    :param file: A text file with one JSON object per line, or an iterable
+                 of its lines
+    :return: Generator of dicts, one per non empty line
+    """
+    for line in file:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_points(records, value_column, key_column=None,
+                timestamp_column=None):
+    """
+    :param records: Iterable of dicts
+    :param value_column: Name of the value field
+    :param key_column: Name of the stream key field, all the records belong
+                       to the same stream when None
+    :param timestamp_column: Name of a field passed through to the output
+    :return: Generator of (stream_key, timestamp, value)
+    """
+    for line_num, record in enumerate(records, 1):
+        try:
+            value = float(record[value_column])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('record %d: no numeric %r field'
+                             % (line_num, value_column))
+        stream_key = None
+        if key_column:
+            try:
+                stream_key = record[key_column]
+            except (KeyError, TypeError):
+                pass
+            # A short CSV line gives None for its missing fields
+            if stream_key is None:
+                raise ValueError('record %d: no %r field'
+                                 % (line_num, key_column))
+        timestamp = record.get(timestamp_column) if timestamp_column \
+            else None
+        yield stream_key, timestamp, value
+
+
+def iter_chunks(iterable, chunk_size, ready=None):
+    """
+    :param ready: Optional callable telling whether the next item can be
+                  read without blocking, a partial chunk is yielded rather
+                  than wait for it
+    :return: Generator of lists of at most chunk_size items
+    """
+    iterator = iter(iterable)
+    if ready is None:
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    chunk = []
+    for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= chunk_size or not ready():
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class FdLines(object):
+    """
+    The lines of a pipe or a terminal read from its file descriptor. The
+    lines read ahead are kept here rather than in the buffers of a text
+    file, which select() can't see, so ready() knows whether the next line
+    can be read without blocking.
+    """
+    def __init__(self, fd, encoding='utf-8', read_size=65536):
+        """
+        :param fd: The file descriptor
+        :param encoding: The encoding of the lines
+        :param read_size: Maximum number of bytes read at once
+        """
+        self.fd = fd
+        self.encoding = encoding
+        self.read_size = read_size
+        self._lines = collections.deque()  # complete lines read ahead
+        self._partial = b''  # start of the next line
+        self._eof = False
+
+    def __iter__(self):
+        lines = self._lines
+        while True:
+            while not lines:
+                if self._eof:
+                    return
+                self._read()
+            yield lines.popleft().decode(self.encoding)
+
+    def ready(self):
+        """
+        :return: Whether the next line (or the end of the input) can be read
+                 without blocking
+        """
+        return bool(self._lines) or self._eof or \
+            bool(select.select([self.fd], [], [], 0)[0])
+
+    def _read(self):
+        data = os.read(self.fd, self.read_size)
+        if not data:
+            self._eof = True
+            if self._partial:
+                self._lines.append(self._partial)
+                self._partial = b''
+            return
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        self._lines.extend(line + b'\n' for line in lines)
+
+
+def input_lines(file):
+    """
+    :param file: The input file
+    :return: (iterable of the lines of file, callable telling whether the
+             next line can be read without blocking, or None when it always
+             can (regular files) or it can't be told)
+    """
+    try:
+        fd = file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return file, None
+    if sys.platform == 'win32' or stat.S_ISREG(os.fstat(fd).st_mode):
+        return file, None
+    lines = FdLines(fd, getattr(file, 'encoding', None) or 'utf-8')
+    return lines, lines.ready
+
+
+def score_chunks(chunks, detector_params, detectors=None):
+    """
+    Scores chunks of points, the points of every stream of a chunk are
+    scored in one score_many call.
+
+    :param chunks: Iterable of lists of (stream_key, timestamp, value)
+    :param detector_params: Keyword arguments of ContextualAnomalyDetector
+    :param detectors: dict of stream_key => detector, filled as new streams
+                      show up
+    :return: Generator of lists of (stream_key, timestamp, value, score) in
+             the input order
+    """
+    if detectors is None:
+        detectors = {}
+    for chunk in chunks:
+        streams = {}
+        for idx, (stream_key, _, value) in enumerate(chunk):
+            indices, values = streams.setdefault(stream_key, ([], []))
+            indices.append(idx)
+            values.append(value)
+
+        scores = [0.0] * len(chunk)
+        for stream_key, (indices, values) in streams.items():
+            detector = detectors.get(stream_key)
+            if detector is None:
+                detector = detectors[stream_key] = \
+                    ContextualAnomalyDetector(**detector_params)
+            for idx, score in zip(indices,
+                                  detector.score_many(values).tolist()):
+                scores[idx] = score
+
+        yield [point + (score,) for point, score in zip(chunk, scores)]
+
 
-def main():
-    base_threshold = 0.75
-    rest_period = 1
-    max_lsemi_ctxs_len = 7
-    max_active_neurons_num = 15
-    num_norm_value_bits = 10
-
-    run(nrows=2500,
-        min_=0,
-        max_=100,
-        base_threshold=base_threshold,
-        max_lsemi_ctxs_len=max_lsemi_ctxs_len,
-        max_active_neurons_num=max_active_neurons_num,
-        num_norm_value_bits=num_norm_value_bits,
-        rest_period=rest_period)
-
-
-def run(nrows, min_, max_,
-        base_threshold,
-        max_lsemi_ctxs_len,
-        max_active_neurons_num,
-        num_norm_value_bits,
-        rest_period):
-
-    # how much we want to learn before we care about good scores
-    # learning_period = min(math.floor(0.15 * nrows), 0.15 * 5000)
-    # rest_period = learning_period/5.0
-    cad = ContextualAnomalyDetector(
-        min_value=min_,  # Minimum value allowed by the system
-        max_value=max_,  # Maximum value allowed by the system
-        base_threshold=base_threshold,  # Base threshold to alert on
-        rest_period=rest_period,  # Duration we wait before next alert
-        max_lsemi_ctxs_len=max_lsemi_ctxs_len,
-        max_active_neurons_num=max_active_neurons_num,
-        num_norm_value_bits=num_norm_value_bits
-    )
-
-    with open('anomalydata/dummy2.csv') as file:
-        data = pd.read_csv(file)
-
-    score = []
-    values = data['value'].values
-    print(max(values), bin(int(max(values))), len(bin(int(max(values)))))
-    print(min(values), bin(int(min(values))), len(bin(int(min(values)))))
-    for line in values:
-        score.append(cad.get_anomaly_score(line))
-
-    print(cad.get_avg_time())
+class CsvWriter(object):
+    def __init__(self, file, key_column, timestamp_column):
+        self.file = file
+        self.writer = csv.writer(file, lineterminator='\n')
+        self.with_key = key_column is not None
+        self.with_timestamp = timestamp_column is not None
+        self.writer.writerow(
+                ([key_column] if self.with_key else []) +
+                ([timestamp_column] if self.with_timestamp else []) +
+                ['value', 'score'])
 
+    def write(self, rows):
+        for stream_key, timestamp, value, score in rows:
+            self.writer.writerow(
+                    ([stream_key] if self.with_key else []) +
+                    ([timestamp] if self.with_timestamp else []) +
+                    [repr(value), repr(score)])
+
+
+class NdjsonWriter(object):
+    def __init__(self, file, key_column, timestamp_column):
+        self.file = file
+        self.key_column = key_column
+        self.timestamp_column = timestamp_column
+
+    def write(self, rows):
+        for stream_key, timestamp, value, score in rows:
+            record = {}
+            if self.key_column is not None:
+                record[self.key_column] = stream_key
+            if self.timestamp_column is not None:
+                record[self.timestamp_column] = timestamp
+            record['value'] = value
+            record['score'] = score
+            self.file.write(json.dumps(record) + '\n')
+
+
+def plot(values, scores):
     import matplotlib.pyplot as plt
-    plt.plot(np.arange(len(values)), values/max(values), c='r')
-    plt.plot(np.arange(len(values)), score, c='b', alpha=0.5)
+
+    max_value = max(values) or 1.0
+    plt.plot(range(len(values)), [value / max_value for value in values],
+             c='r')
+    plt.plot(range(len(values)), scores, c='b', alpha=0.5)
     plt.show()
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Score a stream of values with the contextual '
+                        'anomaly detector.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='CSV or NDJSON file, - (default) for stdin')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file, - (default) for stdout')
+    parser.add_argument('--format', choices=('auto', 'csv', 'ndjson'),
+                        default='auto',
+                        help='input format, auto guesses it from the file '
+                             'extension (csv for stdin)')
+    parser.add_argument('--output-format', choices=('csv', 'ndjson'),
+                        help='output format, defaults to the input one')
+    parser.add_argument('--value-column', default='value')
+    parser.add_argument('--key-column',
+                        help='field holding the stream key, one detector is '
+                             'used per stream')
+    parser.add_argument('--timestamp-column',
+                        help='field copied to the output next to the score')
+    parser.add_argument('--chunk-size', type=int, default=4096,
+                        help='maximum number of records read and scored '
+                             'at once')
+    parser.add_argument('--plot', action='store_true',
+                        help='plot values and scores at the end (single '
+                             'stream, keeps everything in memory)')
+
+    add_detector_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_detector_arguments(parser):
+    """
+    Adds the ContextualAnomalyDetector parameters to an argument parser,
+    see get_detector_params.
+
+    :param parser: argparse.ArgumentParser
+    :return: None
+    """
+    detector = parser.add_argument_group('detector parameters')
+    for name, default in DETECTOR_DEFAULTS.items():
+        detector.add_argument('--' + name.replace('_', '-'),
+                              type=type(default), default=default)
+    detector.add_argument('--max-ctxs', type=int,
+                          help='cap on the number of contexts per stream')
+    detector.add_argument('--compact', action='store_true',
+                          help='use the compact (numpy) context store')
+    detector.add_argument('--bitset', action='store_true',
+                          help='match the semi contexts with bitsets')
+    detector.add_argument('--max-idle-steps', type=int,
+                          help='drop the contexts idle for more steps when '
+                               'compacting')
+    detector.add_argument('--compaction-interval', type=int,
+                          help='compact the model every that many steps')
+    detector.add_argument('--dictionary-id',
+                          help='share the encodings and fact groups of the '
+                               'streams through the dictionary of this id')
+
+
+def get_detector_params(args):
+    """
+    :param args: Arguments parsed by a parser set up by
+                 add_detector_arguments
+    :return: dict of ContextualAnomalyDetector keyword arguments
+    """
+    detector_params = dict((name, getattr(args, name))
+                           for name in DETECTOR_DEFAULTS)
+    detector_params['max_ctxs'] = args.max_ctxs
+    detector_params['compact'] = args.compact
+    detector_params['bitset'] = args.bitset
+    detector_params['max_idle_steps'] = args.max_idle_steps
+    detector_params['compaction_interval'] = args.compaction_interval
+    detector_params['dictionary_id'] = args.dictionary_id
+    return detector_params
+
+
+def run(args, input_file, output_file):
+    """
+    Runs the scoring pipeline of parsed command line arguments.
+
+    :return: None
+    """
+    input_format = args.format
+    if input_format == 'auto':
+        input_format = 'ndjson' if args.input.endswith(
+                ('.ndjson', '.jsonl', '.json')) else 'csv'
+    output_format = args.output_format or input_format
+
+    detector_params = get_detector_params(args)
+
+    lines, ready = input_lines(input_file)
+    records = read_ndjson_records(lines) if input_format == 'ndjson' \
+        else read_csv_records(lines)
+    points = iter_points(records, args.value_column, args.key_column,
+                         args.timestamp_column)
+
+    writer_class = NdjsonWriter if output_format == 'ndjson' else CsvWriter
+    writer = writer_class(output_file, args.key_column,
+                          args.timestamp_column)
+
+    values, scores = [], []
+    chunks = iter_chunks(points, args.chunk_size, ready)
+    for rows in score_chunks(chunks, detector_params):
+        writer.write(rows)
+        output_file.flush()
+        if args.plot:
+            values.extend(row[2] for row in rows)
+            scores.extend(row[3] for row in rows)
+
+    if args.plot:
+        plot(values, scores)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    input_file = sys.stdin if args.input == '-' else \
+        open(args.input, newline='')
+    output_file = sys.stdout if args.output == '-' else \
+        open(args.output, 'w', newline='')
+    try:
+        run(args, input_file, output_file)
+    except ValueError as exc:
+        sys.stderr.write('error: %s\n' % exc)
+        return 1
+    except BrokenPipeError:
+        return 0
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    return 0
+
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
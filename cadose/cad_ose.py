@@ -19,14 +19,117 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # -----------------------------------------------------------------------------
 
+import collections
+import heapq
+import threading
 from timeit import default_timer as timer
-from cadose.context_operator import ContextOperator
+from cadose.alert_policy import AlertPolicy
+from cadose.bitset_context_operator import BitsetContextOperator
+from cadose.compact_context_operator import CompactContextOperator
+from cadose.context_operator import NEURON_FACT_OFFSET, ContextOperator
+from cadose.instrumentation import Instrumentation
+from cadose.profiling import Profiler
+from cadose.score_history import ScoreHistory
+from cadose.shared_dictionary import get_shared_dictionary
+from cadose.snapshot import read_snapshot, write_snapshot
 import numpy as np
 
+# Upper bound of the number of encodings a detector caches
+MAX_CACHED_ENCODINGS = 2 ** 16
+
+# The sensor facts of a value are this offset plus twice its set bits
+SENSOR_FACT_OFFSET = 65536
+
+Encoding = collections.namedtuple('Encoding', [
+        'facts',  # tuple of facts fed to the context operator
+])
+
+PolicyScores = collections.namedtuple('PolicyScores', [
+        'raw',  # the scores before any alert suppression
+        'scores',  # the scores the detector returns (its own policy)
+        'policies',  # alert policy name => its scores
+])
+
+
+def _scale_values(values, min_value, min_value_step):
+    """
+    :param values: np.ndarray of float64 values
+    :param min_value: The value scaled to 0
+    :param min_value_step: The difference of values scaled to 1
+    :return: np.ndarray of the int64 scaled values, truncated towards zero
+             as int() does
+    """
+    norm_values = (values - min_value) / min_value_step
+    if not np.all(np.isfinite(norm_values)):
+        raise ValueError('cannot encode non finite values')
+    # Same truncation towards zero as int()
+    norm_values = norm_values.astype(np.int64)
+    if len(norm_values) and norm_values.min() < 0:
+        # The string encoding of _make_sensor_facts chokes on negative values
+        raise ValueError('cannot encode values below min_value')
+    return norm_values
+
+
+def _make_sensor_facts(norm_value, num_norm_value_bits,
+                       fact_offset=SENSOR_FACT_OFFSET):
+    """
+    :param norm_value: int, the scaled value
+    :param num_norm_value_bits: Number of bits of the scaled values
+    :param fact_offset: The fact of bit 0
+    :return: tuple of the facts of the scaled value
+    """
+    # TODO: Add support for negative values
+
+    # Conver the normal input value to a bianry string representation
+    # strip the '0b' and add zeros on the left up to the number of normal
+    # value bits
+    bin_input_norm_value = format(norm_value, 'b').rjust(
+            num_norm_value_bits, '0')
+
+    # Create the 'facts' which is a tuple derived from the sorted input
+    # reversed bits.
+    # TODO: Write this out in LaTeX to understand what the hell this
+    #       encoding truly is
+    # Also note the original implementation had some 'magic' where the line
+    # would be ... s_num * 2 ** 16 ... and in prediction error below
+    # it would be ... 2 ** ((fact - 2**16)/2.0).
+    # facts = tuple(
+    #         s_num * 2 + (1 if cur_sym == '1' else 0) for s_num, cursym in
+    #         enumerate(reversed(bin_input_norm_value)))
+    # Note that because of the ``s_num * 2 * + int(cur_sym)`` expression
+    # every unset bit (and bit 0 whatever its value) collapses onto the
+    # fact fact_offset. The order of the tuple ends up in the semi context
+    # hashes, so it must stay the order of this set.
+    return tuple(
+            set(fact_offset + s_num * 2 * + int(cur_sym) for s_num, cur_sym
+                in enumerate(reversed(bin_input_norm_value))))
+
+
+def _select_active_neurons(active_ctxs, max_active_neurons_num):
+    """
+    :param active_ctxs: ActiveCtxs of a step
+    :param max_active_neurons_num: The number of neurons, all the active
+                                   contexts when 0
+    :return: The ids of the contexts a stable sort by number of activations
+             puts last (so ties go to the last activated ones), in no
+             particular order. The selection keeps a heap of
+             max_active_neurons_num entries instead of sorting.
+    """
+    ctx_ids, num_activations = active_ctxs
+    num_active_ctxs = len(ctx_ids)
+    if not 0 < max_active_neurons_num < num_active_ctxs:
+        return ctx_ids
+    return [ctx_ids[idx] for idx in heapq.nlargest(
+            max_active_neurons_num, range(num_active_ctxs - 1, -1, -1),
+            key=num_activations.__getitem__)]
+
+
 class ContextualAnomalyDetector(object):
     def __init__(self, min_value, max_value, base_threshold, rest_period,
                  max_lsemi_ctxs_len, max_active_neurons_num,
-                 num_norm_value_bits):
+                 num_norm_value_bits, max_ctxs=None, compact=False,
+                 bitset=False, alert_policies=None, max_idle_steps=None,
+                 compaction_interval=None, dictionary_id=None, debug=False):
         """
         This class is used to first train the detector based on facts and
         contexts of previous known data.
@@ -56,13 +159,44 @@ class ContextualAnomalyDetector(object):
         :param max_lsemi_ctxs_len: Max left semi contexts length TODO ^
         :param max_active_neurons_num: Maximum number of active neurons
         :param num_norm_value_bits: Number of norm values bits (TODO what?)
+        :param max_ctxs: Optional cap on the number of contexts, the coldest
+                         contexts are evicted when it is exceeded
+        :param compact: Store the contexts in numpy arrays
+                        (CompactContextOperator) instead of one object per
+                        context, much smaller for the same scores
+        :param bitset: Match the semi contexts with bitsets of their facts
+                       (BitsetContextOperator), same scores
+        :param alert_policies: Optional dict of name => dict of
+                               base_threshold and rest_period of extra
+                               alert policies, see add_alert_policy
+        :param max_idle_steps: Optional number of steps after which a
+                               context that was not activated is dropped by
+                               compact, not supported by the compact
+                               backend
+        :param compaction_interval: Optional number of steps between two
+                                    calls to compact
+        :param dictionary_id: Optional id of the process-wide
+                              SharedDictionary the encodings and right fact
+                              groups are taken from, for detectors with the
+                              same min_value, max_value and
+                              num_norm_value_bits
+        :param debug: Keep the new context flag of every step in self.flags,
+                      which grows by one element per point
         """
+        self.params = dict(
+                min_value=min_value, max_value=max_value,
+                base_threshold=base_threshold, rest_period=rest_period,
+                max_lsemi_ctxs_len=max_lsemi_ctxs_len,
+                max_active_neurons_num=max_active_neurons_num,
+                num_norm_value_bits=num_norm_value_bits, max_ctxs=max_ctxs,
+                compact=compact, bitset=bitset, alert_policies={},
+                max_idle_steps=max_idle_steps,
+                compaction_interval=compaction_interval,
+                dictionary_id=dictionary_id, debug=debug)
+
         self.min_value = float(min_value)
         self.max_value = float(max_value)
 
-        self.rest_period = rest_period
-        self.base_threshold = base_threshold
-        self.max_active_neurons_num = max_active_neurons_num
         self.num_norm_value_bits = num_norm_value_bits
 
         self.max_bin_value = 2 ** self.num_norm_value_bits - 1.0
@@ -74,23 +208,87 @@ class ContextualAnomalyDetector(object):
 
         self.min_value_step = self.full_value_range / self.max_bin_value
 
+        self._init_model(base_threshold, rest_period, max_lsemi_ctxs_len,
+                         max_active_neurons_num, max_ctxs, compact, bitset,
+                         alert_policies, max_idle_steps, compaction_interval,
+                         dictionary_id, debug)
+
+    def _init_model(self, base_threshold, rest_period, max_lsemi_ctxs_len,
+                    max_active_neurons_num, max_ctxs, compact, bitset,
+                    alert_policies, max_idle_steps, compaction_interval,
+                    dictionary_id, debug):
+        """
+        The part of __init__ that does not depend on how the inputs are
+        encoded, see __init__ for the parameters.
+        """
+        self.rest_period = rest_period
+        self.base_threshold = base_threshold
+        self.max_active_neurons_num = max_active_neurons_num
+
         self.left_facts_group = tuple()
 
+        # Scaled input value => Encoding, the shared dictionary's when there
+        # is one
+        self._encodings = {}
+        self.max_cached_encodings = MAX_CACHED_ENCODINGS
+
         # ctx_operator is TODO is what?
-        self.ctx_operator = ContextOperator(max_lsemi_ctxs_len)
+        if compact and bitset:
+            raise ValueError('compact and bitset are exclusive')
+        if compact and max_idle_steps is not None:
+            raise ValueError('idle contexts can not be dropped by the '
+                             'compact context operator')
+        if compaction_interval is not None and compaction_interval < 1:
+            raise ValueError('the compaction interval must be positive')
+        self.max_idle_steps = max_idle_steps
+        self.compaction_interval = compaction_interval
+        if compact:
+            ctx_operator_class = CompactContextOperator
+        elif bitset:
+            ctx_operator_class = BitsetContextOperator
+        else:
+            ctx_operator_class = ContextOperator
+        self.ctx_operator = ctx_operator_class(max_lsemi_ctxs_len,
+                                               max_ctxs=max_ctxs)
+
+        self.shared_dictionary = None
+        if dictionary_id is not None:
+            self.shared_dictionary = get_shared_dictionary(
+                    dictionary_id, self._get_encoding_key())
+            self._encodings = self.shared_dictionary.encodings
+            self.ctx_operator.share_fact_groups(self.shared_dictionary)
 
         self.potential_new_ctxs = []
 
+        # Reused by every step
+        self.pot_new_zero_level_ctx = []
+
         self.last_predicted_facts = []
 
-        self.result_values_history = [1.0]
+        # Only the last rest_period scores are kept, enough for the rest
+        # period check of _score_facts
+        self.result_values_history = ScoreHistory(rest_period)
+
+        # Name => AlertPolicy, all of them post-process every raw score
+        self.alert_policies = {}
+        self._alert_policy_list = []
+        for name, policy_params in (alert_policies or {}).items():
+            self.add_alert_policy(name, **policy_params)
+
+        # Score of the last point before any alert suppression
+        self.last_raw_score = 0.0
 
         # DEBUG
-        self.flags = []
+        self.flags = [] if debug else None
+
+        self.total_time = 0.0
+        self.num_timed_points = 0
 
-        self.avg_time = []
+        self.instrumentation = None
+        self.profiler = None
 
-    def step(self, facts):  # facts must be distinct and sorted
+    def step(self, facts, predict=True, score=True):
+        # facts must be distinct and sorted
         """
         This function updates the contexts of the left and right side based
         on the dictionary 'facts' that are passed. It is called internally by
@@ -109,9 +307,9 @@ class ContextualAnomalyDetector(object):
         The percent of selected contexts that are active is also calculated. If
         there were so selected contexts it defaults to 0.
 
-        The active contexts are then sorted by how often they were activated,
-        (lowest -> highest). The maximum amount of neurons (user defined) are
-        selected and their context ID's are converted to facts via the
+        The most activated contexts are then selected, at most
+        max_active_neurons_num of them (ties go to the contexts activated
+        last), and their context ID's are converted to facts via the
         operation:
         .. math:
             F \equals \{2^{31} + fact \rvert fact \in N\}
@@ -121,14 +319,26 @@ class ContextualAnomalyDetector(object):
         lowest to highest. We then do a cross context of facts on the left,
         yielding the number of new contexts and the predictions it yielded.
 
+        What the model learns does not depend on the predictions nor on the
+        anomaly values, learn_many skips them.
+
+        Once the step is over the coldest contexts are evicted when there are
+        more than max_ctxs of them, and every compaction_interval steps the
+        model is compacted, see compact.
+
         :param facts:
+        :param predict: Compute the predictions, None is returned instead
+                        otherwise
+        :param score: Compute the anomaly values, None is returned instead
+                      otherwise
         :return:
         """
         # Say the potential new zero level contexts are the left facts
         # and the right facts if there are left facts
-        pot_new_zero_level_ctx = [(self.left_facts_group,
-                                   facts)] \
-            if self.left_facts_group and facts else []
+        pot_new_zero_level_ctx = self.pot_new_zero_level_ctx
+        pot_new_zero_level_ctx.clear()
+        if self.left_facts_group and facts:
+            pot_new_zero_level_ctx.append((self.left_facts_group, facts))
 
         # Get the active contexts, the number of selected contexts and
         # potential new contexts, and their flag from context operator
@@ -139,60 +349,74 @@ class ContextualAnomalyDetector(object):
                     pot_new_zero_level_ctx=pot_new_zero_level_ctx
             )
 
-        # Get the number of unique potential new contexts
-        num_uniq_pot_new_ctx = len(set(potential_new_ctxs)
-                                   .union(pot_new_zero_level_ctx))
-
-        # Get the percentage of currently active contexts and check if
-        # the number is 0
-        if num_selected_ctx:
-            pct_selected_ctx_active = len(active_ctxs) / float(
-                    num_selected_ctx)
-        else:
-            pct_selected_ctx_active = 0.0
-
-        # Get the active contexts (Sorted)
-        active_ctxs = sorted(active_ctxs,
-                             key=lambda ctx: ctx.ctx_num_activations)
+        if score:
+            # Get the percentage of currently active contexts and check if
+            # the number is 0
+            if num_selected_ctx:
+                pct_selected_ctx_active = len(active_ctxs.ctx_ids) / float(
+                        num_selected_ctx)
+            else:
+                pct_selected_ctx_active = 0.0
 
         # Get the active Neurons ID from the contexts in active Neurons
         # This returns the most active Neurons and only the number of the
         # specified by self.max_active_neurons_num
-        active_neurons = [actx.ctx_id for actx in
-                          active_ctxs[-self.max_active_neurons_num:]]
+        active_neurons = _select_active_neurons(active_ctxs,
+                                                self.max_active_neurons_num)
 
         # Create the 'facts' for the new Neuron
-        curr_neur_facts = set(2 ** 31 + fact for fact in active_neurons)
+        curr_neur_facts = [NEURON_FACT_OFFSET + ctx_id
+                           for ctx_id in active_neurons]
+        curr_neur_facts.sort()
 
-        # Replace the left facts with the new current facts we just found
-        self.left_facts_group = set()
-        self.left_facts_group.update(facts, curr_neur_facts)
-        self.left_facts_group = tuple(sorted(self.left_facts_group))
+        # Replace the left facts with the new current facts we just found,
+        # the facts and the neuron facts are distinct and the neuron facts
+        # are above all the others
+        left_facts_group = sorted(facts)
+        left_facts_group += curr_neur_facts
+        self.left_facts_group = tuple(left_facts_group)
 
         # With our new left side facts 'cross contexts left'
         # TODO: Figure out wtf that means
         #       See ctx_operator.cross_ctxs_left
         num_new_ctxs, new_predictions = self.ctx_operator.cross_ctxs_left(
                 facts=self.left_facts_group,
-                potential_new_ctxs=potential_new_ctxs
+                potential_new_ctxs=potential_new_ctxs,
+                predict=predict
         )
 
         # If the cross_ctxs_right returns new_ctx_flag >= 1, add one to
         # num_new ctxs
         num_new_ctxs += 1 if new_ctx_flag else 0
 
-        # Get the percentage added to the unique potential new contexts
-        if new_ctx_flag and num_uniq_pot_new_ctx > 0:
-            pct_pot_uniq_ctx_new = num_new_ctxs / float(
-                    num_uniq_pot_new_ctx)
-        else:
-            pct_pot_uniq_ctx_new = 0.0
-
         # DEBUG
-        self.flags.append(new_ctx_flag)
-
-        return new_predictions, (
-                pct_selected_ctx_active, pct_pot_uniq_ctx_new)
+        if self.flags is not None:
+            self.flags.append(new_ctx_flag)
+
+        anomaly_values = None
+        if score:
+            # Get the percentage added to the unique potential new contexts,
+            # there is one context (added or found) per distinct pair of fact
+            # groups
+            pct_pot_uniq_ctx_new = 0.0
+            if new_ctx_flag:
+                num_uniq_pot_new_ctx = len(
+                        set(self.ctx_operator.pot_new_ctx_ids))
+                if num_uniq_pot_new_ctx > 0:
+                    pct_pot_uniq_ctx_new = num_new_ctxs / float(
+                            num_uniq_pot_new_ctx)
+            anomaly_values = (pct_selected_ctx_active, pct_pot_uniq_ctx_new)
+
+        # Once the step is over, nothing refers to the ids it used anymore
+        if self.ctx_operator.max_ctxs is not None:
+            ctx_id_map = self.ctx_operator.evict_cold_ctxs()
+            if ctx_id_map is not None:
+                self._remap_left_facts_group(ctx_id_map)
+        if self.compaction_interval and \
+                self.ctx_operator.num_steps % self.compaction_interval == 0:
+            self.compact()
+
+        return new_predictions, anomaly_values
 
     def get_anomaly_score(self, input_data):
         """
@@ -211,41 +435,237 @@ class ContextualAnomalyDetector(object):
         """
         start = timer()
 
+        returned_anomaly_score = self._score_facts(self._encode(input_data))
+
+        self.total_time += timer() - start
+        self.num_timed_points += 1
+        # return current_anomaly_score
+        return returned_anomaly_score
+
+    def score_many(self, values):
+        """
+        Batched version of get_anomaly_score. The whole array is scaled and
+        encoded up front, then the facts are fed through step() one after the
+        other, so the returned scores are exactly the ones repeated calls to
+        get_anomaly_score would have produced.
+
+        :param values: A 1-d array like of numeric values
+        :return: np.ndarray of float64 anomaly scores, one per value
+        """
+        start = timer()
+        encodings = self._encode_many(values)
+        return self._score_encodings(encodings, timer() - start)
+
+    def _score_encodings(self, encodings, elapsed=0.0):
+        """
+        The stepping half of score_many, for callers that encode (and so
+        validate) their values before stepping any detector.
+
+        :param encodings: list of Encodings returned by _encode_many
+        :param elapsed: Time already spent on the batch, counted with it
+        :return: np.ndarray of float64 anomaly scores, one per encoding
+        """
+        start = timer()
+
+        scores = np.empty(len(encodings), dtype=np.float64)
+        score_facts = self._score_facts
+        for i, encoding in enumerate(encodings):
+            scores[i] = score_facts(encoding)
+
+        self._record_batch_time(elapsed + timer() - start, len(encodings))
+        return scores
+
+    def get_policy_scores(self, input_data):
+        """
+        Same as get_anomaly_score but gives the score of every alert policy
+        as well, from the same single step of the model.
+
+        :param input_data: A numeric value representative of the data
+        :return: PolicyScores of floats
+        """
+        score = self.get_anomaly_score(input_data)
+        return PolicyScores(self.last_raw_score, score, dict(
+                (name, policy.last_score)
+                for name, policy in self.alert_policies.items()))
+
+    def score_policies(self, values):
+        """
+        Batched version of get_policy_scores: one model pass gives the raw
+        scores, the detector scores (what score_many returns) and the scores
+        of every alert policy.
+
+        :param values: A 1-d array like of numeric values
+        :return: PolicyScores of np.ndarray of float64
+        """
+        start = timer()
+
+        encodings = self._encode_many(values)
+        num_points = len(encodings)
+        raw_scores = np.empty(num_points, dtype=np.float64)
+        scores = np.empty(num_points, dtype=np.float64)
+        policy_scores = [(policy, np.empty(num_points, dtype=np.float64))
+                         for policy in self._alert_policy_list]
+        score_facts = self._score_facts
+        for i, encoding in enumerate(encodings):
+            scores[i] = score_facts(encoding)
+            raw_scores[i] = self.last_raw_score
+            for policy, policy_values in policy_scores:
+                policy_values[i] = policy.last_score
+
+        self._record_batch_time(timer() - start, num_points)
+        return PolicyScores(raw_scores, scores, dict(
+                zip(self.alert_policies,
+                    [policy_values for _, policy_values in policy_scores])))
+
+    def add_alert_policy(self, name, base_threshold, rest_period):
+        """
+        Adds an alert policy post-processing the raw scores on top of the
+        detector's own base_threshold and rest_period. A policy added after
+        some points were scored starts like a new detector would, with
+        nothing suppressed but the first rest_period scores.
+
+        :param name: Name of the policy in PolicyScores.policies
+        :param base_threshold: See AlertPolicy
+        :param rest_period: See AlertPolicy
+        :return: The AlertPolicy
+        """
+        if name in self.alert_policies:
+            raise ValueError('duplicate alert policy %r' % (name,))
+        policy = AlertPolicy(base_threshold, rest_period)
+        self.alert_policies[name] = policy
+        self._alert_policy_list.append(policy)
+        self.params['alert_policies'][name] = policy.get_params()
+        return policy
+
+    def learn_many(self, values):
+        """
+        Feeds the detector with values it only has to learn from (warm-up,
+        backfill) without scoring them. The contexts, activations and left
+        facts are updated exactly as score_many would, but the predictions
+        are only made for the last value and the anomaly values only for
+        the last rest_period values, the ones the next scores depend on.
+        Scoring can go on with score_many or get_anomaly_score afterwards,
+        the scores are the ones scoring every value would have given.
+
+        :param values: A 1-d array like of numeric values
+        :return: None
+        """
+        start = timer()
+        encodings = self._encode_many(values)
+        self._learn_encodings(encodings, timer() - start)
+
+    def _learn_encodings(self, encodings, elapsed=0.0):
+        """
+        The stepping half of learn_many, see _score_encodings.
+
+        :param encodings: list of Encodings returned by _encode_many
+        :param elapsed: Time already spent on the batch, counted with it
+        :return: None
+        """
+        start = timer()
+
+        if encodings:
+            histories = [self.result_values_history] + [
+                policy.history for policy in self._alert_policy_list]
+            windows = [history.window for history in histories]
+            # All the scores count with a rest period of 0
+            num_unscored = 0 if 0 in windows \
+                else max(0, len(encodings) - max(windows))
+            for history in histories:
+                history.skip(num_unscored)
+            learn_facts = self._learn_facts
+            for idx, encoding in enumerate(encodings[:-1]):
+                learn_facts(encoding, idx >= num_unscored)
+            # The predictions of the last value are the ones the next value
+            # is checked against
+            learn_facts(encodings[-1], True, predict=True)
+
+        self._record_batch_time(elapsed + timer() - start, len(encodings))
+
+    def _get_encoding_key(self):
+        """
+        :return: The parameters the encodings depend on, detectors sharing a
+                 dictionary must have the same
+        """
+        return self.min_value, self.max_value, self.num_norm_value_bits
+
+    def _encode(self, input_data):
+        """
+        Converts a single input value to its encoding.
+
+        :param input_data: A numeric value representative of the data
+        :return: Encoding
+        """
         # Min-max scale the normal input value and scale it by the maximum
         # binary value
         norm_input_value = int((input_data - self.min_value)
                                / self.min_value_step)
+        encoding = self._encodings.get(norm_input_value)
+        if encoding is None:
+            encoding = self._add_encoding(norm_input_value)
+        return encoding
+
+    def _encode_many(self, values):
+        """
+        Vectorized version of _encode, the values are scaled at once and
+        every distinct scaled value is only looked up once.
+
+        :param values: A 1-d array like of numeric values
+        :return: list of Encodings, one per value
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return []
+
+        norm_values = _scale_values(values, self.min_value,
+                                    self.min_value_step)
+
+        uniq_values, inverse = np.unique(norm_values, return_inverse=True)
+        encodings = self._encodings
+        encodings_table = []
+        for norm_value in uniq_values.tolist():
+            encoding = encodings.get(norm_value)
+            if encoding is None:
+                encoding = self._add_encoding(norm_value)
+            encodings_table.append(encoding)
+        return [encodings_table[i] for i in inverse.ravel().tolist()]
+
+    def _add_encoding(self, norm_input_value):
+        """
+        Builds the encoding of a scaled value and caches it. There are only
+        2 ** num_norm_value_bits scaled values in [min_value, max_value] but
+        the cache is cleared when it holds max_cached_encodings of them, in
+        case the values drift out of the range.
+
+        :param norm_input_value: int, the scaled value
+        :return: Encoding
+        """
+        encoding = self._make_encoding(norm_input_value)
+        if len(self._encodings) >= self.max_cached_encodings:
+            self._encodings.clear()
+        self._encodings[norm_input_value] = encoding
+        return encoding
+
+    def _make_encoding(self, norm_input_value):
+        """
+        :param norm_input_value: int, the scaled value
+        :return: Encoding
+        """
+        return Encoding(_make_sensor_facts(norm_input_value,
+                                           self.num_norm_value_bits))
 
-        # TODO: Add support for negative values
-
-        # Conver the normal input value to a bianry string representation
-        # strip the '0b' and add zeros on the left up to the number of normal
-        # value bits
-        bin_input_norm_value = format(norm_input_value, 'b').rjust(
-                self.num_norm_value_bits, '0')
-
-        # Create the 'facts' which is a tuple derived from the sorted input
-        # reversed bits.
-        # TODO: Write this out in LaTeX to understand what the hell this
-        #       encoding truly is
-        # Also note the original implementation had some 'magic' where the line
-        # would be ... s_num * 2 ** 16 ... and in prediction error below
-        # it would be ... 2 ** ((fact - 2**16)/2.0).
-        # facts = tuple(
-        #         s_num * 2 + (1 if cur_sym == '1' else 0) for s_num, cursym in
-        #         enumerate(reversed(bin_input_norm_value)))
-        facts = tuple(
-                set(65536 + s_num * 2 * + int(cur_sym) for s_num, cur_sym in
-                    enumerate(reversed(bin_input_norm_value))))
-
-        # Sum the prediction error for all facts that weren't just predicted
-        # Note it is then scaled by the maximum binary value
-        prediction_error = sum(2 ** ((fact - 65536) / 2.0) for fact in facts if
-                               fact not in self.last_predicted_facts) \
-            / self.max_bin_value
+    def _score_facts(self, encoding):
+        """
+        Runs the facts of a single input through the detector and does the
+        score post-processing. This is the sequential core shared by
+        get_anomaly_score and the batched methods.
 
+        :param encoding: Encoding of the input as returned by _encode
+        :return: float, and anomaly score.
+        """
         # Step forward in the facts
-        self.last_predicted_facts, anomaly_values = self.step(facts)
+        self.last_predicted_facts, anomaly_values = \
+            self.step(encoding.facts)
 
         # Calculate the anomaly score for this individual value
         # if prediction_error > 0:
@@ -254,20 +674,263 @@ class ContextualAnomalyDetector(object):
         # else:
         #     current_anomaly_score = 0.0
 
-        if max(self.result_values_history[
-               -int(self.rest_period):]) < self.base_threshold:
+        if self.result_values_history.max() < self.base_threshold:
             returned_anomaly_score = current_anomaly_score
         else:
             returned_anomaly_score = 0.0
 
         self.result_values_history.append(current_anomaly_score)
 
+        self.last_raw_score = current_anomaly_score
+        for policy in self._alert_policy_list:
+            policy.apply(current_anomaly_score)
+
         # if returned_anomaly_score < self.base_threshold / 2.0:
         #     returned_anomaly_score = 0.0
 
-        self.avg_time.append(timer() - start)
-        # return current_anomaly_score
         return returned_anomaly_score
 
+    def _learn_facts(self, encoding, keep_score, predict=False):
+        """
+        Learn-only counterpart of _score_facts, no score is returned.
+
+        :param encoding: Encoding of the input as returned by _encode
+        :param keep_score: Compute the score and append it to the history
+        :param predict: Make the predictions (last_predicted_facts)
+        :return: None
+        """
+        new_predictions, anomaly_values = self.step(
+                encoding.facts, predict=predict, score=keep_score)
+        if predict:
+            self.last_predicted_facts = new_predictions
+        if keep_score:
+            current_anomaly_score = \
+                (1.0 - anomaly_values[0] + anomaly_values[1]) / 2.0
+            self.result_values_history.append(current_anomaly_score)
+            self.last_raw_score = current_anomaly_score
+            for policy in self._alert_policy_list:
+                policy.history.append(current_anomaly_score)
+
+    def _record_batch_time(self, elapsed, num_points):
+        self.total_time += elapsed
+        self.num_timed_points += num_points
+
+    def compact(self, max_idle_steps=None):
+        """
+        Drops the contexts and semi contexts that can't be activated anymore
+        (and the contexts that were not activated for more than
+        max_idle_steps steps) and renumbers the others densely, the neuron
+        facts of left_facts_group with them. Dropping idle contexts changes
+        the next scores, the rest of the compaction does not.
+
+        :param max_idle_steps: Defaults to the max_idle_steps of the detector
+        :return: The number of contexts dropped
+        """
+        if max_idle_steps is None:
+            max_idle_steps = self.max_idle_steps
+        num_ctxs = self.ctx_operator.get_num_ctxs()
+        self._remap_left_facts_group(
+                self.ctx_operator.compact(max_idle_steps))
+        return num_ctxs - self.ctx_operator.get_num_ctxs()
+
+    def _remap_left_facts_group(self, ctx_id_map):
+        """
+        Renumbers the neuron facts of left_facts_group after the contexts
+        were renumbered, the facts of the dropped contexts are removed.
+
+        :param ctx_id_map: np.ndarray of old ctx id => new ctx id, -1 for
+                           the dropped contexts
+        :return: None
+        """
+        ctx_id_map = ctx_id_map.tolist()
+        self.left_facts_group = tuple(
+                fact if fact < NEURON_FACT_OFFSET
+                else NEURON_FACT_OFFSET + ctx_id_map[fact - NEURON_FACT_OFFSET]
+                for fact in self.left_facts_group
+                if fact < NEURON_FACT_OFFSET or
+                ctx_id_map[fact - NEURON_FACT_OFFSET] >= 0)
+
     def get_avg_time(self):
-        return np.mean(self.avg_time)
+        """
+        :return: Mean time spent per point, nan before the first point
+        """
+        if not self.num_timed_points:
+            return float('nan')
+        return self.total_time / self.num_timed_points
+
+    def get_stats(self):
+        """
+        :return: dict with the model size and context eviction counters
+        """
+        return self.ctx_operator.get_stats()
+
+    def enable_instrumentation(self, **histogram_params):
+        """
+        Starts timing the phases of every step (encoding, crossings, context
+        creation, scoring) into bounded histograms and counting the contexts
+        created, active and potentially new at every step. It costs nothing
+        until it is enabled.
+
+        :param histogram_params: Keyword arguments of
+                                 cadose.instrumentation.LatencyHistogram
+        :return: The Instrumentation, its get_stats gives a snapshot of the
+                 phase timings and counters
+        """
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation(**histogram_params)
+            self.instrumentation.attach(self)
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        """
+        Stops the instrumentation and removes its overhead.
+
+        :return: The Instrumentation with the stats recorded so far, or None
+        """
+        instrumentation, self.instrumentation = self.instrumentation, None
+        if instrumentation is not None:
+            instrumentation.detach()
+        return instrumentation
+
+    def start_profiling(self, num_steps=None, duration=None, stream_key=None,
+                        trace_allocations=True, on_finish=None):
+        """
+        Starts sampling the stacks of the steps and tracing their
+        allocations, for num_steps steps or duration seconds, or until
+        stop_profiling when both are None. It can be started at any time,
+        the detector keeps on running meanwhile, and costs nothing until it
+        is.
+
+        :param num_steps: Optional number of steps to profile
+        :param duration: Optional number of seconds to profile
+        :param stream_key: Optional stream key to tag the report with
+        :param trace_allocations: Trace the allocations with tracemalloc
+        :param on_finish: Optional callable called with the Profiler once
+                          it stops on its own or is stopped
+        :return: The cadose.profiling.Profiler, its get_report gives the
+                 collapsed stacks and the JSON summary
+        """
+        if self.profiler is not None and not self.profiler.finished:
+            raise ValueError('the detector is already being profiled')
+        self.profiler = Profiler(num_steps, duration, stream_key,
+                                 trace_allocations, on_finish)
+        self.profiler.attach(self)
+        return self.profiler
+
+    def stop_profiling(self):
+        """
+        Stops the profiler if it is still running.
+
+        :return: The last Profiler, or None
+        """
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.finish()
+        return profiler
+
+    def save(self, path):
+        """
+        Writes a snapshot of the detector (parameters, learned contexts and
+        score history) to path, see cadose.snapshot for the format.
+
+        :param path: The snapshot path
+        :return: None
+        """
+        write_snapshot(path, *self._get_state())
+
+    def save_async(self, path):
+        """
+        Same as save but only the copy of the state is done by the caller,
+        the snapshot is written by a background thread so scoring can go on
+        meanwhile. With the compact backend the copy is a handful of array
+        copies.
+
+        :param path: The snapshot path
+        :return: The started threading.Thread, join it to wait for the
+                 snapshot to be written
+        """
+        thread = threading.Thread(target=write_snapshot,
+                                  args=(path,) + self._get_state())
+        thread.start()
+        return thread
+
+    @classmethod
+    def load(cls, path, mmap=True, compact=None, bitset=None):
+        """
+        Makes a detector from a snapshot written by save.
+
+        :param path: The snapshot path
+        :param mmap: Memory-map the arrays of the snapshot instead of reading
+                     them, the compact backend then runs directly on the
+                     mapped (copy-on-write) pages
+        :param compact: Overrides the backend the snapshot was taken with,
+                        see __init__
+        :param bitset: Same for the bitset backend
+        :return: ContextualAnomalyDetector
+        """
+        header, arrays = read_snapshot(path, mmap=mmap)
+        params = dict(header['params'])
+        if compact is not None or bitset is not None:
+            params['compact'] = bool(compact)
+            params['bitset'] = bool(bitset)
+        detector = cls(**params)
+
+        prefix = 'ctx_operator.'
+        ctx_operator_arrays = dict(
+                (name[len(prefix):], values)
+                for name, values in arrays.items() if name.startswith(prefix))
+        detector.ctx_operator = type(detector.ctx_operator).from_state(
+                header['ctx_operator'], ctx_operator_arrays,
+                params['max_lsemi_ctxs_len'], max_ctxs=params['max_ctxs'])
+        if detector.shared_dictionary is not None:
+            detector.ctx_operator.share_fact_groups(detector.shared_dictionary)
+
+        detector.left_facts_group = tuple(header['left_facts_group'])
+        detector.last_predicted_facts = set(header['last_predicted_facts'])
+        history_prefix = 'history.'
+        detector.result_values_history = ScoreHistory.from_state(
+                header['history'],
+                dict((name[len(history_prefix):], values)
+                     for name, values in arrays.items()
+                     if name.startswith(history_prefix)))
+        for name, policy_history in header['alert_policies'].items():
+            policy_prefix = 'alert_policies.%s.' % name
+            detector.alert_policies[name].history = \
+                ScoreHistory.from_state(policy_history, dict(
+                    (array_name[len(policy_prefix):], values)
+                    for array_name, values in arrays.items()
+                    if array_name.startswith(policy_prefix)))
+        if detector.flags is not None and 'flags' in arrays:
+            detector.flags = arrays['flags'].tolist()
+        return detector
+
+    def _get_state(self):
+        """
+        :return: (header dict, dict of arrays) of the snapshot of the
+                 detector
+        """
+        ctx_operator_scalars, ctx_operator_arrays = \
+            self.ctx_operator.get_state()
+        history_scalars, history_arrays = \
+            self.result_values_history.get_state()
+        header = {
+            'params': self.params,
+            'ctx_operator': ctx_operator_scalars,
+            'history': history_scalars,
+            'alert_policies': {},
+            'left_facts_group': list(self.left_facts_group),
+            'last_predicted_facts': sorted(self.last_predicted_facts),
+        }
+        arrays = dict(('ctx_operator.' + name, values)
+                      for name, values in ctx_operator_arrays.items())
+        arrays.update(('history.' + name, values)
+                      for name, values in history_arrays.items())
+        for name, policy in self.alert_policies.items():
+            policy_scalars, policy_arrays = policy.history.get_state()
+            header['alert_policies'][name] = policy_scalars
+            arrays.update(('alert_policies.%s.%s' % (name, array_name),
+                           values)
+                          for array_name, values in policy_arrays.items())
+        if self.flags is not None:
+            arrays['flags'] = np.array(self.flags, dtype=np.int64)
+        return header, arrays
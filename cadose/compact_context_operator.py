@@ -0,0 +1,630 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import array
+
+import numpy as np
+import recordclass
+
+from cadose.context_operator import ActiveCtxs, compact_state
+from cadose.typed_arrays import GrowableArray, HashTable
+
+CompactHalf = recordclass.recordclass('CompactHalf', [
+        'fact_to_semi_ctx',  # fact => array of semi ctx ids
+        'facts_hash_to_semi_ctx_id',  # facts hash => semi ctx id
+        'colliding_semi_ctx_ids',  # facts => semi ctx id, hash already taken
+        'init_nfacts',  # semi ctx id => number of facts of the semi ctx
+        'facts_offsets',  # semi ctx id => offset of its facts in facts
+        'facts',  # facts of all the semi ctxs, one after the other (uint32)
+        'nfacts_crossed',  # semi ctx id => number of crossed facts
+        'crossed_semi_ctx_ids',  # sorted ids of the crossed semi ctxs
+        'crossing_facts',  # the facts the half was last crossed with
+        'crossed_facts',  # crossed semi ctx id => crossed facts, lazily
+])
+
+
+def _new_half():
+    half = CompactHalf({}, HashTable(), {}, GrowableArray(np.int32),
+                       GrowableArray(np.int64), GrowableArray(np.uint32),
+                       GrowableArray(np.int32), np.zeros(0, dtype=np.intp),
+                       (), {})
+    half.facts_offsets.append(0)
+    return half
+
+
+def _prepare_crossed_semi_ctxs(half, facts):
+    """
+    Vectorized counterpart of context_operator._prepare_crossed_semi_ctxs.
+    Only the number of crossed facts of every crossed semi context is
+    computed, the crossed facts themselves are rebuilt on demand by
+    _get_crossed_facts.
+    :param half:
+    :param facts:
+    :return:
+    """
+    nfacts_crossed = half.nfacts_crossed.data
+    nfacts_crossed[half.crossed_semi_ctx_ids] = 0
+
+    fact_to_semi_ctx = half.fact_to_semi_ctx
+    semi_ctx_ids = [np.frombuffer(fact_to_semi_ctx[fact], dtype=np.int32)
+                    for fact in facts if fact in fact_to_semi_ctx]
+    if semi_ctx_ids:
+        crossed_semi_ctx_ids, counts = np.unique(
+                np.concatenate(semi_ctx_ids), return_counts=True)
+        nfacts_crossed[crossed_semi_ctx_ids] = counts
+    else:
+        crossed_semi_ctx_ids = np.zeros(0, dtype=np.intp)
+
+    half.crossed_semi_ctx_ids = crossed_semi_ctx_ids
+    half.crossing_facts = facts
+    half.crossed_facts = {}
+
+
+def _get_semi_ctx_facts(half, semi_ctx_id):
+    """
+    :return: tuple of the facts the semi context was created with
+    """
+    offsets = half.facts_offsets.data
+    return tuple(half.facts.data[offsets[semi_ctx_id]:
+                                 offsets[semi_ctx_id + 1]].tolist())
+
+
+def _get_num_semi_ctxs(half):
+    return len(half.facts_hash_to_semi_ctx_id) + len(
+            half.colliding_semi_ctx_ids)
+
+
+def _get_crossed_facts(half, semi_ctx_id):
+    """
+    :return: tuple of the facts of the semi context found in the facts the
+             half was last crossed with, in the order of those facts (which
+             is the order context_operator._prepare_crossed_semi_ctxs
+             appends them in)
+    """
+    crossed_facts = half.crossed_facts.get(semi_ctx_id)
+    if crossed_facts is None:
+        semi_ctx_facts = set(_get_semi_ctx_facts(half, semi_ctx_id))
+        crossed_facts = half.crossed_facts[semi_ctx_id] = tuple(
+                fact for fact in half.crossing_facts if fact in semi_ctx_facts)
+    return crossed_facts
+
+
+class CompactContextOperator(object):
+    """
+    Drop-in replacement of ContextOperator storing the model as a struct of
+    arrays instead of one object per context:
+      - the counters and flags of the contexts are typed numpy columns
+        indexed by ctx id,
+      - the facts of the semi contexts are stored once in a flat buffer with
+        offsets, the right facts of a context being the facts of its right
+        semi context,
+      - the left => right maps are (left semi ctx id, right semi ctx id,
+        ctx id) rows kept sorted by left semi ctx id (CSR like) plus a small
+        tail of recent rows merged in from time to time.
+    The crossing of the semi contexts and of the contexts beneath the crossed
+    left semi contexts is done with vectorized numpy operations. Scores are
+    the same as with ContextOperator.
+
+    Facts must fit in 32 bits, which the sensor facts and the neuron facts
+    (2 ** 31 + ctx id) do. Contexts can't be evicted so no last activation
+    step is kept, the contexts evicted before a state was loaded in the
+    operator stay as unreachable entries of the columns until compact()
+    drops them.
+    """
+    # Looked up on the instance so that Instrumentation can time it
+    _prepare_crossed_semi_ctxs = staticmethod(_prepare_crossed_semi_ctxs)
+
+    def __init__(self, max_lsemi_ctxs_len, max_ctxs=None):
+        if max_ctxs is not None:
+            raise ValueError('context eviction is not supported by the '
+                             'compact context operator')
+        self.max_lsemi_ctxs_len = max_lsemi_ctxs_len
+        self.max_ctxs = max_ctxs
+
+        self.left = _new_half()
+        self.right = _new_half()
+
+        # Left => right maps, sorted part
+        self.links_offsets = GrowableArray(np.int64)  # per left semi ctx
+        self.links_offsets.append(0)
+        self.links_rsemi_ctx_ids = np.zeros(0, dtype=np.int32)
+        self.links_ctx_ids = np.zeros(0, dtype=np.int32)
+        # Left => right maps, rows added since the last merge
+        self.tail_lsemi_ctx_ids = GrowableArray(np.int32)
+        self.tail_rsemi_ctx_ids = GrowableArray(np.int32)
+        self.tail_ctx_ids = GrowableArray(np.int32)
+        self.tail_index = {}  # lsemi ctx id << 32 | rsemi ctx id => ctx id
+
+        # Context columns
+        self.c0 = GrowableArray(np.int64)
+        self.c1 = GrowableArray(np.int64)
+        self.num_activations = GrowableArray(np.uint32)
+        self.zerolevel = GrowableArray(np.bool_)
+
+        # Set the new context ID to be false
+        self.new_ctx_id = False
+
+        # See ContextOperator
+        self.pot_new_ctx_ids = []
+        self.potential_new_ctxs = []
+
+        self.num_steps = 0
+        self.num_evicted_ctxs = 0
+        self.num_evicted_semi_ctxs = 0
+        self.num_evictions = 0
+        self.num_compacted_ctxs = 0
+        self.num_compacted_semi_ctxs = 0
+        self.num_compactions = 0
+
+        # Number of unreachable entries of the context columns
+        self.num_dead_ctxs = 0
+
+    def get_num_ctxs(self):
+        """
+        :return: The number of live contexts
+        """
+        return len(self.c0) - self.num_dead_ctxs
+
+    def get_stats(self):
+        """
+        :return: dict with the model size and eviction counters
+        """
+        return {
+            'num_steps': self.num_steps,
+            'num_ctxs': self.get_num_ctxs(),
+            'num_left_semi_ctxs': _get_num_semi_ctxs(self.left),
+            'num_right_semi_ctxs': _get_num_semi_ctxs(self.right),
+            'num_evicted_ctxs': self.num_evicted_ctxs,
+            'num_evicted_semi_ctxs': self.num_evicted_semi_ctxs,
+            'num_evictions': self.num_evictions,
+            'num_compacted_ctxs': self.num_compacted_ctxs,
+            'num_compacted_semi_ctxs': self.num_compacted_semi_ctxs,
+            'num_compactions': self.num_compactions,
+        }
+
+    def get_state(self):
+        """
+        Exports the operator, see ContextOperator.get_state for the layout.
+        The arrays are copies, the operator can keep on running while they
+        are written.
+        :return: (dict of scalars, dict of arrays)
+        """
+        num_ctxs = len(self.c0)
+        num_lsemi_ctxs = len(self.left.init_nfacts)
+        link_lsemi_ctx_ids, link_rsemi_ctx_ids, link_ctx_ids = \
+            self._gather_links(np.arange(num_lsemi_ctxs))
+
+        arrays = {
+            'ctx_alive': np.zeros(num_ctxs, dtype=np.bool_),
+            'c0': self.c0.view().copy(),
+            'c1': self.c1.view().copy(),
+            'num_activations': self.num_activations.view().copy(),
+            'last_activated': np.zeros(num_ctxs, dtype=np.int64),
+            'zerolevel': self.zerolevel.view().copy(),
+            'link_lsemi_ctx_ids': link_lsemi_ctx_ids.astype(np.int32),
+            'link_rsemi_ctx_ids': link_rsemi_ctx_ids,
+            'link_ctx_ids': link_ctx_ids,
+        }
+        arrays['ctx_alive'][link_ctx_ids] = True
+
+        for half, prefix in ((self.left, 'left_'), (self.right, 'right_')):
+            hash_table = half.facts_hash_to_semi_ctx_id
+            semi_alive = np.zeros(len(half.init_nfacts), dtype=np.bool_)
+            semi_alive[hash_table.values[
+                hash_table.keys != HashTable.EMPTY]] = True
+            semi_alive[list(half.colliding_semi_ctx_ids.values())] = True
+            index_facts = sorted(half.fact_to_semi_ctx)
+            index_semi_ctx_ids = [half.fact_to_semi_ctx[fact]
+                                  for fact in index_facts]
+            arrays.update({
+                prefix + 'semi_alive': semi_alive,
+                prefix + 'init_nfacts': half.init_nfacts.view().copy(),
+                prefix + 'facts_offsets': half.facts_offsets.view().copy(),
+                prefix + 'facts': half.facts.view().copy(),
+                prefix + 'hash_keys': hash_table.keys.copy(),
+                prefix + 'hash_values': hash_table.values.copy(),
+                prefix + 'index_facts': np.array(index_facts,
+                                                 dtype=np.int64),
+                prefix + 'index_offsets': np.cumsum(
+                        [0] + [len(semi_ctx_ids) for semi_ctx_ids
+                               in index_semi_ctx_ids], dtype=np.int64),
+                prefix + 'index_semi_ctx_ids': np.array(
+                        [semi_ctx_id for semi_ctx_ids in index_semi_ctx_ids
+                         for semi_ctx_id in semi_ctx_ids], dtype=np.int32),
+            })
+
+        crossed_semi_ctx_ids = self.left.crossed_semi_ctx_ids.tolist()
+        crossed_facts = [_get_crossed_facts(self.left, semi_ctx_id)
+                         for semi_ctx_id in crossed_semi_ctx_ids]
+        arrays['left_crossed_semi_ctx_ids'] = np.array(crossed_semi_ctx_ids,
+                                                       dtype=np.int64)
+        arrays['left_crossed_facts_offsets'] = np.cumsum(
+                [0] + [len(facts) for facts in crossed_facts],
+                dtype=np.int64)
+        arrays['left_crossed_facts'] = np.array(
+                [fact for facts in crossed_facts for fact in facts],
+                dtype=np.int64)
+
+        scalars = {
+            'num_steps': self.num_steps,
+            'num_evicted_ctxs': self.num_evicted_ctxs,
+            'num_evicted_semi_ctxs': self.num_evicted_semi_ctxs,
+            'num_evictions': self.num_evictions,
+            'num_compacted_ctxs': self.num_compacted_ctxs,
+            'num_compacted_semi_ctxs': self.num_compacted_semi_ctxs,
+            'num_compactions': self.num_compactions,
+        }
+        return scalars, arrays
+
+    @classmethod
+    def from_state(cls, scalars, arrays, max_lsemi_ctxs_len, max_ctxs=None):
+        """
+        Rebuilds an operator from the output of get_state (of any context
+        operator). The big arrays are used as they are, when they are memory
+        maps the operator runs on them until they have to grow.
+        :param scalars: dict of scalars
+        :param arrays: dict of arrays
+        :param max_lsemi_ctxs_len: See __init__
+        :param max_ctxs: See __init__
+        :return: CompactContextOperator
+        """
+        ctx_operator = cls(max_lsemi_ctxs_len, max_ctxs=max_ctxs)
+        for name, value in scalars.items():
+            setattr(ctx_operator, name, value)
+        ctx_operator.num_dead_ctxs = int(np.count_nonzero(
+                ~arrays['ctx_alive']))
+
+        ctx_operator.c0 = GrowableArray.wrap(arrays['c0'])
+        ctx_operator.c1 = GrowableArray.wrap(arrays['c1'])
+        ctx_operator.num_activations = GrowableArray.wrap(
+                arrays['num_activations'])
+        ctx_operator.zerolevel = GrowableArray.wrap(arrays['zerolevel'])
+
+        for half, prefix in ((ctx_operator.left, 'left_'),
+                             (ctx_operator.right, 'right_')):
+            half.init_nfacts = GrowableArray.wrap(
+                    arrays[prefix + 'init_nfacts'])
+            half.facts_offsets = GrowableArray.wrap(
+                    arrays[prefix + 'facts_offsets'])
+            half.facts = GrowableArray.wrap(arrays[prefix + 'facts'])
+            half.facts_hash_to_semi_ctx_id = HashTable.from_arrays(
+                    arrays[prefix + 'hash_keys'],
+                    arrays[prefix + 'hash_values'])
+
+            # The live semi ctxs missing from the hash table share their
+            # hash with another one
+            hash_table = half.facts_hash_to_semi_ctx_id
+            semi_alive = arrays[prefix + 'semi_alive']
+            colliding = semi_alive.copy()
+            colliding[hash_table.values[
+                hash_table.keys != HashTable.EMPTY]] = False
+            half.colliding_semi_ctx_ids = dict(
+                    (_get_semi_ctx_facts(half, semi_ctx_id), semi_ctx_id)
+                    for semi_ctx_id in np.flatnonzero(colliding).tolist())
+            half.nfacts_crossed = GrowableArray.wrap(
+                    np.zeros(len(half.init_nfacts), dtype=np.int32))
+
+            index_semi_ctx_ids = arrays[prefix + 'index_semi_ctx_ids']
+            index_offsets = arrays[prefix + 'index_offsets'].tolist()
+            half.fact_to_semi_ctx = dict(
+                    (fact, array.array(
+                        'i', index_semi_ctx_ids[start:end].tobytes()))
+                    for fact, start, end in zip(
+                        arrays[prefix + 'index_facts'].tolist(),
+                        index_offsets, index_offsets[1:]))
+
+        link_lsemi_ctx_ids = arrays['link_lsemi_ctx_ids']
+        num_lsemi_ctxs = len(ctx_operator.left.init_nfacts)
+        ctx_operator.links_offsets = GrowableArray(np.int64,
+                                                   num_lsemi_ctxs + 1)
+        ctx_operator.links_offsets.append(0)
+        ctx_operator.links_offsets.extend(np.cumsum(np.bincount(
+                link_lsemi_ctx_ids, minlength=num_lsemi_ctxs)))
+        ctx_operator.links_rsemi_ctx_ids = arrays['link_rsemi_ctx_ids']
+        ctx_operator.links_ctx_ids = arrays['link_ctx_ids']
+
+        # The crossed facts of the crossed left semi ctxs are known, the
+        # facts the left half was crossed with are not needed
+        left = ctx_operator.left
+        crossed_semi_ctx_ids = arrays['left_crossed_semi_ctx_ids']
+        crossed_facts = arrays['left_crossed_facts'].tolist()
+        crossed_facts_offsets = arrays['left_crossed_facts_offsets'].tolist()
+        left.crossed_semi_ctx_ids = crossed_semi_ctx_ids.astype(np.intp)
+        left.crossed_facts = dict(
+                (semi_ctx_id, tuple(crossed_facts[start:end]))
+                for semi_ctx_id, start, end in zip(
+                    crossed_semi_ctx_ids.tolist(), crossed_facts_offsets,
+                    crossed_facts_offsets[1:]))
+        left.nfacts_crossed.data[left.crossed_semi_ctx_ids] = np.diff(
+                crossed_facts_offsets)
+
+        return ctx_operator
+
+    def compact(self, max_idle_steps=None):
+        """
+        See ContextOperator.compact. The activation steps of the contexts
+        are not kept so idle contexts can't be dropped.
+        :param max_idle_steps: Must be None
+        :return: np.ndarray of old ctx id => new ctx id, -1 for the dropped
+                 contexts
+        """
+        if max_idle_steps is not None:
+            raise ValueError('idle contexts can not be dropped by the '
+                             'compact context operator')
+        scalars, arrays = self.get_state()
+        scalars, arrays, ctx_id_map = compact_state(scalars, arrays)
+        vars(self).update(vars(type(self).from_state(
+                scalars, arrays, self.max_lsemi_ctxs_len,
+                max_ctxs=self.max_ctxs)))
+        return ctx_id_map
+
+    def share_fact_groups(self, shared_dictionary):
+        """
+        The fact groups are already stored in flat arrays, with no tuple per
+        group, only the encodings are shared.
+
+        :param shared_dictionary: SharedDictionary
+        :return: None
+        """
+
+    def cross_ctxs_right(self, facts, pot_new_zero_level_ctx):
+        """
+        See ContextOperator.cross_ctxs_right.
+        :param facts: The facts
+        :param pot_new_zero_level_ctx: The potential new zero level contexts
+        :return:
+        """
+        self.num_steps += 1
+
+        self._prepare_crossed_semi_ctxs(self.right, facts)
+
+        self.pot_new_ctx_ids.clear()
+        num_new_ctxs = self._add_ctxs_by_facts(pot_new_zero_level_ctx,
+                                               zerolevel=True)
+
+        active_ctxs = ActiveCtxs([], [])
+        potential_new_ctxs = self.potential_new_ctxs
+        potential_new_ctxs.clear()
+        lsemi_ctx_ids, rsemi_ctx_ids, ctx_ids = self._gather_links(
+                self.left.crossed_semi_ctx_ids)
+        if not len(ctx_ids):
+            self.new_ctx_id = False
+            return active_ctxs, 0, potential_new_ctxs, num_new_ctxs
+
+        # Same as the ctx_id != self.new_ctx_id test, False == 0
+        selected = ctx_ids != int(self.new_ctx_id)
+
+        lnfacts_crossed = self.left.nfacts_crossed.data[lsemi_ctx_ids]
+        lfull = lnfacts_crossed == self.left.init_nfacts.data[lsemi_ctx_ids]
+        rinit_nfacts = self.right.init_nfacts.data[rsemi_ctx_ids]
+        rnfacts_crossed = self.right.nfacts_crossed.data[rsemi_ctx_ids]
+
+        full = selected & lfull
+        num_selected_ctx = int(np.count_nonzero(full))
+        full_ctx_ids = ctx_ids[full]
+        self.c0.data[full_ctx_ids] += rinit_nfacts[full]
+        self.c1.data[full_ctx_ids] += rnfacts_crossed[full]
+
+        active = full & (rnfacts_crossed == rinit_nfacts)
+        if active.any():
+            active_ctx_ids = ctx_ids[active]
+            self.num_activations.data[active_ctx_ids] += 1
+            active_ctxs = ActiveCtxs(
+                    active_ctx_ids.tolist(),
+                    self.num_activations.data[active_ctx_ids].tolist())
+
+        if num_new_ctxs:
+            potential = selected & ~active & self.zerolevel.data[ctx_ids] & \
+                (rnfacts_crossed > 0) & \
+                (lnfacts_crossed <= self.max_lsemi_ctxs_len)
+            for lsemi_ctx_id, rsemi_ctx_id in zip(
+                    lsemi_ctx_ids[potential].tolist(),
+                    rsemi_ctx_ids[potential].tolist()):
+                potential_new_ctxs.append(
+                        (_get_crossed_facts(self.left, lsemi_ctx_id),
+                         _get_crossed_facts(self.right, rsemi_ctx_id)))
+
+        # Set the new context ID to be false
+        self.new_ctx_id = False
+
+        return active_ctxs, num_selected_ctx, potential_new_ctxs, num_new_ctxs
+
+    def cross_ctxs_left(self, facts, potential_new_ctxs, predict=True):
+        """
+        See ContextOperator.cross_ctxs_left, the prediction weights of all the
+        contexts of the fully crossed left semi contexts are computed at once.
+        :param facts: The facts
+        :param potential_new_ctxs: The potential new contexts
+        :param predict: Compute the predictions
+        :return:
+        """
+        self._prepare_crossed_semi_ctxs(self.left, facts)
+
+        num_new_ctxs = self._add_ctxs_by_facts(potential_new_ctxs,
+                                               zerolevel=False)
+        return num_new_ctxs, self._predict() if predict else None
+
+    def _predict(self):
+        crossed_semi_ctx_ids = self.left.crossed_semi_ctx_ids
+        full = self.left.nfacts_crossed.data[crossed_semi_ctx_ids] == \
+            self.left.init_nfacts.data[crossed_semi_ctx_ids]
+        _, rsemi_ctx_ids, ctx_ids = self._gather_links(
+                crossed_semi_ctx_ids[full])
+        if not len(ctx_ids):
+            return set()
+
+        c0 = self.c0.data[ctx_ids]
+        c1 = self.c1.data[ctx_ids]
+        pred_weights = np.zeros(len(ctx_ids), dtype=np.float64)
+        np.divide(c1, c0, out=pred_weights, where=c0 > 0)
+
+        # Every context sharing the highest weight predicts (all of them when
+        # no weight is above 0)
+        prediction_rsemi_ctx_ids = np.unique(
+                rsemi_ctx_ids[pred_weights == pred_weights.max()])
+
+        new_predictions = set()
+        for rsemi_ctx_id in prediction_rsemi_ctx_ids.tolist():
+            new_predictions.update(_get_semi_ctx_facts(self.right,
+                                                       rsemi_ctx_id))
+        return new_predictions
+
+    def _gather_links(self, lsemi_ctx_ids):
+        """
+        Gathers the contexts of some left semi contexts.
+        :param lsemi_ctx_ids: Sorted array of left semi ctx ids
+        :return: (left semi ctx ids, right semi ctx ids, ctx ids) arrays,
+                 sorted by left semi ctx id then in creation order, the order
+                 of the left semi contexts rsemi_ctx_id_to_ctx_id dicts
+        """
+        offsets = self.links_offsets.data
+        starts = offsets[lsemi_ctx_ids]
+        lengths = offsets[lsemi_ctx_ids + 1] - starts
+        num_links = int(lengths.sum())
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        idx = shifts + np.arange(num_links)
+        link_lsemi_ctx_ids = np.repeat(lsemi_ctx_ids, lengths)
+        link_rsemi_ctx_ids = self.links_rsemi_ctx_ids[idx]
+        link_ctx_ids = self.links_ctx_ids[idx]
+
+        if len(self.tail_ctx_ids):
+            tail_lsemi_ctx_ids = self.tail_lsemi_ctx_ids.view()
+            in_tail = np.isin(tail_lsemi_ctx_ids, lsemi_ctx_ids)
+            if in_tail.any():
+                link_lsemi_ctx_ids = np.concatenate(
+                        (link_lsemi_ctx_ids, tail_lsemi_ctx_ids[in_tail]))
+                link_rsemi_ctx_ids = np.concatenate(
+                        (link_rsemi_ctx_ids,
+                         self.tail_rsemi_ctx_ids.view()[in_tail]))
+                link_ctx_ids = np.concatenate(
+                        (link_ctx_ids, self.tail_ctx_ids.view()[in_tail]))
+                order = np.argsort(link_lsemi_ctx_ids, kind='stable')
+                link_lsemi_ctx_ids = link_lsemi_ctx_ids[order]
+                link_rsemi_ctx_ids = link_rsemi_ctx_ids[order]
+                link_ctx_ids = link_ctx_ids[order]
+
+        return link_lsemi_ctx_ids, link_rsemi_ctx_ids, link_ctx_ids
+
+    def _find_link(self, lsemi_ctx_id, rsemi_ctx_id):
+        """
+        :return: The ctx id of the (left semi ctx, right semi ctx) pair or
+                 None
+        """
+        ctx_id = self.tail_index.get(lsemi_ctx_id << 32 | rsemi_ctx_id)
+        if ctx_id is None:
+            start, end = self.links_offsets.data[lsemi_ctx_id:
+                                                 lsemi_ctx_id + 2]
+            found = np.flatnonzero(
+                    self.links_rsemi_ctx_ids[start:end] == rsemi_ctx_id)
+            if len(found):
+                ctx_id = int(self.links_ctx_ids[start + found[0]])
+        return ctx_id
+
+    def _add_link(self, lsemi_ctx_id, rsemi_ctx_id, ctx_id):
+        self.tail_lsemi_ctx_ids.append(lsemi_ctx_id)
+        self.tail_rsemi_ctx_ids.append(rsemi_ctx_id)
+        self.tail_ctx_ids.append(ctx_id)
+        self.tail_index[lsemi_ctx_id << 32 | rsemi_ctx_id] = ctx_id
+        if len(self.tail_ctx_ids) > max(256, len(self.links_ctx_ids) // 32):
+            self._merge_links()
+
+    def _merge_links(self):
+        """
+        Merges the tail of recent links in the sorted links.
+        """
+        num_lsemi_ctxs = len(self.left.init_nfacts)
+        offsets = self.links_offsets.view()
+        lsemi_ctx_ids = np.concatenate((
+                np.repeat(np.arange(len(offsets) - 1, dtype=np.int32),
+                          np.diff(offsets)),
+                self.tail_lsemi_ctx_ids.view()))
+        order = np.argsort(lsemi_ctx_ids, kind='stable')
+        self.links_rsemi_ctx_ids = np.concatenate((
+                self.links_rsemi_ctx_ids,
+                self.tail_rsemi_ctx_ids.view()))[order]
+        self.links_ctx_ids = np.concatenate((
+                self.links_ctx_ids, self.tail_ctx_ids.view()))[order]
+
+        self.links_offsets = GrowableArray(np.int64, num_lsemi_ctxs + 1)
+        self.links_offsets.append(0)
+        self.links_offsets.extend(np.cumsum(
+                np.bincount(lsemi_ctx_ids, minlength=num_lsemi_ctxs)))
+
+        self.tail_lsemi_ctx_ids = GrowableArray(np.int32)
+        self.tail_rsemi_ctx_ids = GrowableArray(np.int32)
+        self.tail_ctx_ids = GrowableArray(np.int32)
+        self.tail_index = {}
+
+    def _add_ctxs_by_facts(self, new_ctxs, zerolevel):
+        num_added_ctxs = 0
+        pot_new_ctx_ids = self.pot_new_ctx_ids
+
+        for left_facts, right_facts in new_ctxs:
+            lsemi_ctx_id = self._add_semi_ctx_by_facts(self.left, left_facts)
+            rsemi_ctx_id = self._add_semi_ctx_by_facts(self.right,
+                                                       right_facts)
+
+            ctx_id = self._find_link(lsemi_ctx_id, rsemi_ctx_id)
+            if ctx_id is None:
+                ctx_id = len(self.c0)
+                self.c0.append(0)
+                self.c1.append(0)
+                self.num_activations.append(0)
+                self.zerolevel.append(zerolevel)
+                self._add_link(lsemi_ctx_id, rsemi_ctx_id, ctx_id)
+                num_added_ctxs += 1
+                if zerolevel:
+                    self.new_ctx_id = ctx_id
+            elif zerolevel:
+                self.zerolevel.data[ctx_id] = True
+            pot_new_ctx_ids.append(ctx_id)
+
+        return num_added_ctxs
+
+    def _add_semi_ctx_by_facts(self, half, facts):
+        facts_hash = hash(facts)
+        semi_ctx_id = half.facts_hash_to_semi_ctx_id.get(facts_hash)
+        if semi_ctx_id is not None:
+            # The whole facts are compared, a semi ctx is never reused for
+            # other facts with the same hash
+            if _get_semi_ctx_facts(half, semi_ctx_id) == facts:
+                return semi_ctx_id
+            semi_ctx_id = half.colliding_semi_ctx_ids.get(facts)
+
+        if semi_ctx_id is None:
+            semi_ctx_id = len(half.init_nfacts)
+            if half.facts_hash_to_semi_ctx_id.setdefault(
+                    facts_hash, semi_ctx_id) != semi_ctx_id:
+                half.colliding_semi_ctx_ids[facts] = semi_ctx_id
+            half.init_nfacts.append(len(facts))
+            half.nfacts_crossed.append(0)
+            half.facts.extend(facts)
+            half.facts_offsets.append(len(half.facts))
+            if half is self.left:
+                self.links_offsets.append(self.links_offsets.data[
+                                              len(self.links_offsets) - 1])
+            for fact in facts:
+                semi_ctx_ids = half.fact_to_semi_ctx.get(fact)
+                if semi_ctx_ids is None:
+                    semi_ctx_ids = half.fact_to_semi_ctx[fact] = \
+                        array.array('i')
+                semi_ctx_ids.append(semi_ctx_id)
+        return semi_ctx_id
@@ -20,12 +20,25 @@
 # -----------------------------------------------------------------------------
 
 import collections
+import heapq
+import operator
 
+import numpy as np
 import recordclass
 
+from cadose.fact_groups import FactGroupTable
+from cadose.typed_arrays import HashTable
+
+# Neuron facts are the ids of active contexts shifted by this offset
+NEURON_FACT_OFFSET = 2 ** 31
+
+# Fraction of max_ctxs evicted at once when the cap is hit, so the cost of an
+# eviction (a pass over the whole model) is amortized over many new contexts
+EVICTION_FRACTION = 0.1
+
 Half = recordclass.recordclass('Half', [
         'fact_to_semi_ctx',  # fact => semi ctx
-        'facts_hash_to_semi_ctx_id',  # facts hash => semi ctx ids (seq ints)
+        'fact_groups',  # FactGroupTable of the facts of the semi ctxs, by id
         'semi_ctxs',  # semi ctx id => semi ctx
         'crossed_semi_ctxs',  # subset of semi_ctxs with len(.facts) > 0
 ])
@@ -34,83 +47,719 @@ Ctx = recordclass.recordclass('Ctx', [
         'c0',
         'c1',
         'num_activations',
-        'right_facts',
+        'rsemi_ctx_id',  # the right facts are the facts of this semi ctx
         'zerolevel',
+        'last_activated',  # step of the last activation (or of creation)
 ])
 
 SemiCtx = recordclass.recordclass('SemiCtx', [
         'facts',
         'init_nfacts',
         'rsemi_ctx_id_to_ctx_id',
+        'semi_ctx_id',
+        'pred_weight',  # highest prediction weight of the contexts (left)
+        'pred_rsemi_ctx_ids',  # right semi ctx ids of the contexts with it
 ])
 
-ActiveCtx = collections.namedtuple('ActiveCtx', [
-        'ctx_id',
-        'ctx_num_activations',
+# The contexts activated by a step, as parallel lists
+ActiveCtxs = collections.namedtuple('ActiveCtxs', [
+        'ctx_ids',
+        'num_activations',
 ])
 
 
+_semi_ctx_id = operator.attrgetter('semi_ctx_id')
+
+
 def _prepare_crossed_semi_ctxs(half, facts):
     """
-    Reassigns the facts for each semi context
+    Reassigns the facts for each semi context. Only the semi contexts reached
+    from the facts through the fact index are touched, so the cost depends on
+    the number of facts and not on the size of the half.
     :param half:
     :param facts:
     :return:
     """
-    # Erase cross semi contexts
+    # Erase cross semi contexts, their lists are reused
     for semi_ctx in half.crossed_semi_ctxs:
-        semi_ctx.facts = []
+        semi_ctx.facts.clear()
 
     # For every fact append it to every semi contexts fact attribute
     # Here we get every fact that we wish to assign to a semi context from
-    # from that half and give to the semi context
+    # from that half and give to the semi context, a semi context is crossed
+    # as soon as it gets its first fact
+    crossed_semi_ctxs = []
     for fact in facts:
-        for semi_ctx in half.fact_to_semi_ctx.get(fact, []):
+        for semi_ctx in half.fact_to_semi_ctx.get(fact, ()):
+            if not semi_ctx.facts:
+                crossed_semi_ctxs.append(semi_ctx)
             semi_ctx.facts.append(fact)
 
-    # Set the crossed semi contexts to all the semi contexts in the half
-    # if it exists
-    half.crossed_semi_ctxs = [semi_ctx for semi_ctx in half.semi_ctxs
-                              if semi_ctx.facts]
+    # Keep the crossed semi contexts in semi_ctxs order, the activation order
+    # of the contexts (and so the tie breaking of the active neurons) depends
+    # on it
+    crossed_semi_ctxs.sort(key=_semi_ctx_id)
+    half.crossed_semi_ctxs = crossed_semi_ctxs
+
+
+def _get_facts_tuple(semi_ctxs_facts, semi_ctx):
+    """
+    :param semi_ctxs_facts: dict of semi ctx id => tuple of crossed facts,
+                            filled as semi contexts are asked for
+    :return: The crossed facts of semi_ctx as a tuple
+    """
+    facts = semi_ctxs_facts.get(semi_ctx.semi_ctx_id)
+    if facts is None:
+        facts = semi_ctxs_facts[semi_ctx.semi_ctx_id] = tuple(semi_ctx.facts)
+    return facts
+
+
+def _index_pred_weight(lsemi_ctx, ctxs):
+    """
+    Recomputes the highest prediction weight of the contexts of a left semi
+    context and the right semi contexts of the contexts sharing it.
+    :param lsemi_ctx:
+    :param ctxs: ctx id => Ctx (or anything with c0 and c1)
+    :return:
+    """
+    pred_weight = 0.0
+    pred_rsemi_ctx_ids = []
+    for rsemi_ctx_id, ctx_id in lsemi_ctx.rsemi_ctx_id_to_ctx_id.items():
+        ctx = ctxs[ctx_id]
+        weight = ctx.c1 / float(ctx.c0) if ctx.c0 > 0 else 0.0
+        if weight > pred_weight:
+            pred_weight = weight
+            pred_rsemi_ctx_ids = [rsemi_ctx_id]
+        elif weight == pred_weight:
+            pred_rsemi_ctx_ids.append(rsemi_ctx_id)
+    lsemi_ctx.pred_weight = pred_weight
+    lsemi_ctx.pred_rsemi_ctx_ids = pred_rsemi_ctx_ids
+
+
+def _drop_semi_ctxs(half, dead_semi_ctxs):
+    """
+    Removes semi contexts from a half: their slot in semi_ctxs is set to None
+    and they are dropped from the fact index, the fact groups and the crossed
+    semi contexts.
+    :param half:
+    :param dead_semi_ctxs: set of id() of the semi contexts to remove
+    :return: The number of removed semi contexts
+    """
+    dead_semi_ctx_ids = set()
+    for semi_ctx_id, semi_ctx in enumerate(half.semi_ctxs):
+        if semi_ctx is not None and id(semi_ctx) in dead_semi_ctxs:
+            half.semi_ctxs[semi_ctx_id] = None
+            dead_semi_ctx_ids.add(semi_ctx_id)
+    if not dead_semi_ctx_ids:
+        return 0
+
+    for fact in list(half.fact_to_semi_ctx):
+        semi_ctxs = [semi_ctx for semi_ctx in half.fact_to_semi_ctx[fact]
+                     if id(semi_ctx) not in dead_semi_ctxs]
+        if semi_ctxs:
+            half.fact_to_semi_ctx[fact] = semi_ctxs
+        else:
+            del half.fact_to_semi_ctx[fact]
+
+    half.fact_groups.remove(dead_semi_ctx_ids)
+
+    half.crossed_semi_ctxs = [semi_ctx for semi_ctx in half.crossed_semi_ctxs
+                              if id(semi_ctx) not in dead_semi_ctxs]
+
+    return len(dead_semi_ctx_ids)
+
+
+def _get_half_state(half, prefix, arrays):
+    """
+    Exports a half in the flat layout of ContextOperator.get_state.
+    :param half:
+    :param prefix: Prefix of the array names ('left_' or 'right_')
+    :param arrays: dict the arrays are added to
+    :return:
+    """
+    semi_ctxs = half.semi_ctxs
+    num_semi_ctxs = len(semi_ctxs)
+    fact_groups = half.fact_groups
+
+    index_facts = sorted(half.fact_to_semi_ctx)
+    index_semi_ctx_ids = []
+    index_offsets = [0]
+    for fact in index_facts:
+        for semi_ctx in half.fact_to_semi_ctx[fact]:
+            index_semi_ctx_ids.append(semi_ctx.semi_ctx_id)
+        index_offsets.append(len(index_semi_ctx_ids))
+
+    semi_ctxs_facts = [facts or () for facts in fact_groups.groups]
+    hash_table = HashTable.from_items(fact_groups.get_hashes())
+
+    arrays[prefix + 'semi_alive'] = np.fromiter(
+            (semi_ctx is not None for semi_ctx in semi_ctxs),
+            dtype=np.bool_, count=num_semi_ctxs)
+    arrays[prefix + 'init_nfacts'] = np.fromiter(
+            (semi_ctx.init_nfacts if semi_ctx is not None else 0
+             for semi_ctx in semi_ctxs),
+            dtype=np.int32, count=num_semi_ctxs)
+    arrays[prefix + 'facts_offsets'] = np.cumsum(
+            [0] + [len(facts) for facts in semi_ctxs_facts], dtype=np.int64)
+    arrays[prefix + 'facts'] = np.array(
+            [fact for facts in semi_ctxs_facts for fact in facts],
+            dtype=np.uint32)
+    arrays[prefix + 'hash_keys'] = hash_table.keys
+    arrays[prefix + 'hash_values'] = hash_table.values
+    arrays[prefix + 'index_facts'] = np.array(index_facts, dtype=np.int64)
+    arrays[prefix + 'index_offsets'] = np.array(index_offsets,
+                                                dtype=np.int64)
+    arrays[prefix + 'index_semi_ctx_ids'] = np.array(index_semi_ctx_ids,
+                                                     dtype=np.int32)
+
+
+def _set_half_state(half, prefix, arrays, is_left):
+    """
+    Rebuilds a half from the flat layout of ContextOperator.get_state.
+    """
+    half.semi_ctxs = [
+        SemiCtx([], init_nfacts, {} if is_left else None, semi_ctx_id,
+                0.0, [] if is_left else None)
+        if alive else None
+        for semi_ctx_id, (alive, init_nfacts) in enumerate(zip(
+                arrays[prefix + 'semi_alive'].tolist(),
+                arrays[prefix + 'init_nfacts'].tolist()))]
+
+    index_semi_ctx_ids = arrays[prefix + 'index_semi_ctx_ids'].tolist()
+    index_offsets = arrays[prefix + 'index_offsets'].tolist()
+    index_facts = arrays[prefix + 'index_facts'].tolist()
+    half.fact_to_semi_ctx = dict(
+            (fact, [half.semi_ctxs[semi_ctx_id] for semi_ctx_id
+                    in index_semi_ctx_ids[start:end]])
+            for fact, start, end in zip(index_facts, index_offsets,
+                                        index_offsets[1:]))
+
+    half.fact_groups = _get_fact_groups(prefix, arrays)
+    half.crossed_semi_ctxs = []
+
+
+def _get_fact_groups(prefix, arrays):
+    """
+    :return: FactGroupTable of the semi ctx facts of a half in the flat
+             layout of ContextOperator.get_state
+    """
+    facts = arrays[prefix + 'facts'].tolist()
+    facts_offsets = arrays[prefix + 'facts_offsets'].tolist()
+    groups = [tuple(facts[start:end]) if alive else None
+              for alive, start, end in zip(
+                    arrays[prefix + 'semi_alive'].tolist(),
+                    facts_offsets, facts_offsets[1:])]
+    return FactGroupTable.from_groups(groups)
+
+
+def _get_owners(offsets):
+    """
+    :param offsets: Offsets of rows in a flat array (one more than rows)
+    :return: The row of every element of the flat array
+    """
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _remap_neuron_facts(facts, ctx_id_map):
+    """
+    :param facts: np.ndarray of facts
+    :param ctx_id_map: old ctx id => new ctx id
+    :return: int64 copy of facts with the neuron facts renumbered
+    """
+    facts = facts.astype(np.int64)
+    neuron = facts >= NEURON_FACT_OFFSET
+    facts[neuron] = NEURON_FACT_OFFSET + ctx_id_map[
+            facts[neuron] - NEURON_FACT_OFFSET]
+    return facts
+
+
+def _find_dead_ctxs(scalars, arrays, max_idle_steps):
+    """
+    :return: bool np.ndarray of the contexts compact_state drops: the
+             evicted ones, the ones idle for more than max_idle_steps and the
+             ones of the left semi contexts referring to one of them (the
+             neuron fact of a dropped context never shows up again so they
+             can't be fully crossed anymore), until none is left
+    """
+    ctx_dead = ~arrays['ctx_alive']
+    if max_idle_steps is not None:
+        ctx_dead |= scalars['num_steps'] - arrays['last_activated'] > \
+            max_idle_steps
+
+    left_facts = arrays['left_facts'].astype(np.int64)
+    neuron = left_facts >= NEURON_FACT_OFFSET
+    neuron_lsemi_ctx_ids = _get_owners(arrays['left_facts_offsets'])[neuron]
+    neuron_ctx_ids = left_facts[neuron] - NEURON_FACT_OFFSET
+    link_lsemi_ctx_ids = arrays['link_lsemi_ctx_ids']
+    link_ctx_ids = arrays['link_ctx_ids']
+
+    num_dead_ctxs = np.count_nonzero(ctx_dead)
+    while True:
+        orphans = np.zeros(len(arrays['left_semi_alive']), dtype=np.bool_)
+        orphans[neuron_lsemi_ctx_ids[ctx_dead[neuron_ctx_ids]]] = True
+        ctx_dead[link_ctx_ids[orphans[link_lsemi_ctx_ids]]] = True
+        prev_num_dead_ctxs, num_dead_ctxs = \
+            num_dead_ctxs, np.count_nonzero(ctx_dead)
+        if num_dead_ctxs == prev_num_dead_ctxs:
+            return ctx_dead
+
+
+def _compact_half(arrays, prefix, semi_live, ctx_id_map, compacted):
+    """
+    Copies a half of the flat layout of ContextOperator.get_state to
+    compacted with only the live semi contexts, renumbered in the same order.
+    :param arrays: The arrays of the state
+    :param prefix: Prefix of the array names ('left_' or 'right_')
+    :param semi_live: bool np.ndarray of the semi contexts kept
+    :param ctx_id_map: old ctx id => new ctx id, applied to the neuron facts
+                       of the left half
+    :param compacted: dict the arrays are added to
+    :return: old semi ctx id => new semi ctx id, -1 for the dropped ones
+    """
+    is_left = prefix == 'left_'
+    semi_ctx_id_map = np.where(semi_live, np.cumsum(semi_live) - 1, -1)
+    num_semi_ctxs = int(np.count_nonzero(semi_live))
+
+    nfacts = np.diff(arrays[prefix + 'facts_offsets'])
+    facts = arrays[prefix + 'facts'][np.repeat(semi_live, nfacts)]
+    facts_offsets = np.cumsum(np.concatenate([[0], nfacts[semi_live]]),
+                              dtype=np.int64)
+    if is_left:
+        facts = _remap_neuron_facts(facts, ctx_id_map).astype(np.uint32)
+        # The hash of the left fact groups changes with the neuron facts
+        facts_list = facts.tolist()
+        offsets_list = facts_offsets.tolist()
+        hash_table = HashTable.from_items(
+                (hash(tuple(facts_list[start:end])), semi_ctx_id)
+                for semi_ctx_id, (start, end) in enumerate(
+                    zip(offsets_list, offsets_list[1:])))
+    else:
+        semi_ctx_id_map_list = semi_ctx_id_map.tolist()
+        hash_table = HashTable.from_items(
+                (facts_hash, semi_ctx_id_map_list[semi_ctx_id])
+                for facts_hash, semi_ctx_id in HashTable.from_arrays(
+                    arrays[prefix + 'hash_keys'],
+                    arrays[prefix + 'hash_values']).items()
+                if semi_ctx_id_map_list[semi_ctx_id] >= 0)
+
+    index_semi_ctx_ids = arrays[prefix + 'index_semi_ctx_ids']
+    index_live = semi_live[index_semi_ctx_ids]
+    index_entry_facts = np.repeat(arrays[prefix + 'index_facts'],
+                                  np.diff(arrays[prefix + 'index_offsets']))
+    index_entry_facts = index_entry_facts[index_live]
+    if is_left:
+        index_entry_facts = _remap_neuron_facts(index_entry_facts,
+                                                ctx_id_map)
+    # The entries stay grouped by fact and the facts sorted
+    index_facts, index_counts = np.unique(index_entry_facts,
+                                          return_counts=True)
+
+    compacted.update({
+        prefix + 'semi_alive': np.ones(num_semi_ctxs, dtype=np.bool_),
+        prefix + 'init_nfacts': arrays[prefix + 'init_nfacts'][semi_live],
+        prefix + 'facts_offsets': facts_offsets,
+        prefix + 'facts': facts,
+        prefix + 'hash_keys': hash_table.keys,
+        prefix + 'hash_values': hash_table.values,
+        prefix + 'index_facts': index_facts.astype(np.int64),
+        prefix + 'index_offsets': np.cumsum(
+                np.concatenate([[0], index_counts]), dtype=np.int64),
+        prefix + 'index_semi_ctx_ids': semi_ctx_id_map[
+                index_semi_ctx_ids[index_live]].astype(np.int32),
+    })
+    return semi_ctx_id_map
+
+
+def compact_state(scalars, arrays, max_idle_steps=None):
+    """
+    Compacts a state in the flat layout of ContextOperator.get_state: the
+    evicted contexts, the contexts idle for more than max_idle_steps and the
+    contexts and semi contexts nothing can reach anymore are dropped, the
+    others are renumbered densely in the same order, the neuron facts with
+    them. Since the order of the ids is kept a compaction that drops no live
+    context changes no score.
+
+    Context 0 keeps its id even when it is dropped: it is never crossed
+    (ctx id 0 is the new_ctx_id of cross_ctxs_right when there is none),
+    another context must not take its place.
+    :param scalars: dict of scalars
+    :param arrays: dict of arrays
+    :param max_idle_steps: Drop the contexts last activated (or created) more
+                           than max_idle_steps steps ago, None to keep them
+    :return: (dict of scalars, dict of arrays, np.ndarray of old ctx id =>
+             new ctx id, -1 for the dropped contexts)
+    """
+    ctx_dead = _find_dead_ctxs(scalars, arrays, max_idle_steps)
+    ctx_live = ~ctx_dead
+    ctx_slots = ctx_live.copy()
+    ctx_slots[:1] = True
+    ctx_id_map = np.where(ctx_live, np.cumsum(ctx_slots) - 1, -1)
+
+    compacted = {
+        'ctx_alive': ctx_live[ctx_slots],
+        'c0': arrays['c0'][ctx_slots],
+        'c1': arrays['c1'][ctx_slots],
+        'num_activations': arrays['num_activations'][ctx_slots],
+        'last_activated': arrays['last_activated'][ctx_slots],
+        'zerolevel': arrays['zerolevel'][ctx_slots],
+    }
+    if len(ctx_dead) and ctx_dead[0]:
+        for name in ('c0', 'c1', 'num_activations', 'last_activated',
+                     'zerolevel'):
+            compacted[name][0] = 0
+
+    link_lsemi_ctx_ids = arrays['link_lsemi_ctx_ids']
+    link_rsemi_ctx_ids = arrays['link_rsemi_ctx_ids']
+    link_ctx_ids = arrays['link_ctx_ids']
+    link_live = ctx_live[link_ctx_ids]
+    lsemi_live = arrays['left_semi_alive'] & (np.bincount(
+            link_lsemi_ctx_ids[link_live],
+            minlength=len(arrays['left_semi_alive'])) > 0)
+    rsemi_live = arrays['right_semi_alive'] & (np.bincount(
+            link_rsemi_ctx_ids[link_live],
+            minlength=len(arrays['right_semi_alive'])) > 0)
+    lsemi_ctx_id_map = _compact_half(arrays, 'left_', lsemi_live,
+                                     ctx_id_map, compacted)
+    rsemi_ctx_id_map = _compact_half(arrays, 'right_', rsemi_live,
+                                     ctx_id_map, compacted)
+
+    compacted['link_lsemi_ctx_ids'] = lsemi_ctx_id_map[
+            link_lsemi_ctx_ids[link_live]].astype(np.int32)
+    compacted['link_rsemi_ctx_ids'] = rsemi_ctx_id_map[
+            link_rsemi_ctx_ids[link_live]].astype(np.int32)
+    compacted['link_ctx_ids'] = ctx_id_map[
+            link_ctx_ids[link_live]].astype(np.int32)
+
+    crossed_semi_ctx_ids = arrays['left_crossed_semi_ctx_ids']
+    crossed_live = lsemi_live[crossed_semi_ctx_ids]
+    crossed_nfacts = np.diff(arrays['left_crossed_facts_offsets'])
+    compacted['left_crossed_semi_ctx_ids'] = lsemi_ctx_id_map[
+            crossed_semi_ctx_ids[crossed_live]].astype(np.int64)
+    compacted['left_crossed_facts_offsets'] = np.cumsum(
+            np.concatenate([[0], crossed_nfacts[crossed_live]]),
+            dtype=np.int64)
+    compacted['left_crossed_facts'] = _remap_neuron_facts(
+            arrays['left_crossed_facts'][
+                np.repeat(crossed_live, crossed_nfacts)], ctx_id_map)
+
+    scalars = dict(scalars)
+    scalars['num_compacted_ctxs'] = scalars.get('num_compacted_ctxs', 0) + \
+        int(np.count_nonzero(arrays['ctx_alive'] & ctx_dead))
+    scalars['num_compacted_semi_ctxs'] = \
+        scalars.get('num_compacted_semi_ctxs', 0) + int(
+            np.count_nonzero(arrays['left_semi_alive'] & ~lsemi_live) +
+            np.count_nonzero(arrays['right_semi_alive'] & ~rsemi_live))
+    scalars['num_compactions'] = scalars.get('num_compactions', 0) + 1
+    return scalars, compacted, ctx_id_map
 
 
 class ContextOperator(object):
     """
     TODO Write a docstring for this one
+
+    Every left semi context keeps the highest prediction weight (c1 / c0)
+    of its contexts and which contexts have it. Weights only change when a
+    left semi context is fully crossed in cross_ctxs_right, which visits all
+    its contexts anyway and rebuilds it, so predicting only looks at the
+    fully crossed left semi contexts and not at the contexts beneath them.
+
+    When max_ctxs is set the number of live contexts is bounded: once it is
+    exceeded evict_cold_ctxs evicts the coldest contexts (least recently
+    activated, then least activated) together with the semi contexts nothing
+    refers to anymore, then compacts the operator so the ids stay dense and
+    ctxs and semi_ctxs stay proportional to max_ctxs.
     """
-    def __init__(self, max_lsemi_ctxs_len):
+    # Looked up on the instance so that Instrumentation can time it
+    _prepare_crossed_semi_ctxs = staticmethod(_prepare_crossed_semi_ctxs)
+
+    def __init__(self, max_lsemi_ctxs_len, max_ctxs=None):
         self.max_lsemi_ctxs_len = max_lsemi_ctxs_len
+        self.max_ctxs = max_ctxs
 
         # Initialize both halves attributes to be empty
-        self.left = Half({}, {}, [], [])
-        self.right = Half({}, {}, [], [])
+        self.left = Half({}, FactGroupTable(), [], [])
+        self.right = Half({}, FactGroupTable(), [], [])
         self.ctxs = []
 
+        # Optional SharedDictionary the right fact groups are interned in
+        self.shared_dictionary = None
+
         # Set the new context ID to be false
         self.new_ctx_id = False
 
+        # Ids of the contexts of the potential new contexts of the last step,
+        # whether they were added or already known
+        self.pot_new_ctx_ids = []
+
+        # Scratch buffers of cross_ctxs_right, cleared and refilled by every
+        # step rather than allocated anew
+        self.active_ctxs = ActiveCtxs([], [])
+        self.potential_new_ctxs = []
+        self.rsemi_ctxs_facts = {}
+
+        self.num_steps = 0
+        self.num_evicted_ctxs = 0
+        self.num_evicted_semi_ctxs = 0
+        self.num_evictions = 0
+        self.num_compacted_ctxs = 0
+        self.num_compacted_semi_ctxs = 0
+        self.num_compactions = 0
+
+        # Number of None slots in ctxs
+        self.num_dead_ctxs = 0
+
+    def get_num_ctxs(self):
+        """
+        :return: The number of live (not evicted) contexts
+        """
+        return len(self.ctxs) - self.num_dead_ctxs
+
+    def get_stats(self):
+        """
+        :return: dict with the model size and eviction counters
+        """
+        return {
+            'num_steps': self.num_steps,
+            'num_ctxs': self.get_num_ctxs(),
+            'num_left_semi_ctxs': len(self.left.fact_groups),
+            'num_right_semi_ctxs': len(self.right.fact_groups),
+            'num_evicted_ctxs': self.num_evicted_ctxs,
+            'num_evicted_semi_ctxs': self.num_evicted_semi_ctxs,
+            'num_evictions': self.num_evictions,
+            'num_compacted_ctxs': self.num_compacted_ctxs,
+            'num_compacted_semi_ctxs': self.num_compacted_semi_ctxs,
+            'num_compactions': self.num_compactions,
+        }
+
+    def get_state(self):
+        """
+        Exports the operator as flat arrays. The layout is the same for all
+        the context operators so a state can be loaded in any of them:
+          - per ctx id: ctx_alive, c0, c1, num_activations, last_activated,
+            zerolevel,
+          - per half (left_ / right_ prefix) and semi ctx id: semi_alive,
+            init_nfacts, facts_offsets (one more) into facts (in the order
+            the semi ctx was created with), the hash table of the semi ctx
+            ids (hash_keys, hash_values, see HashTable, the semi ctxs missing
+            from it have the hash of another one) and the fact index in CSR
+            form (index_facts, index_offsets, index_semi_ctx_ids),
+          - the left => right maps as rows sorted by left semi ctx id then
+            insertion order: link_lsemi_ctx_ids, link_rsemi_ctx_ids,
+            link_ctx_ids,
+          - the crossed left semi contexts: left_crossed_semi_ctx_ids and
+            their crossed facts (left_crossed_facts_offsets,
+            left_crossed_facts). The right crossing is reset by every step
+            so it isn't kept.
+        :return: (dict of scalars, dict of arrays)
+        """
+        arrays = {}
+        ctxs = self.ctxs
+        num_ctxs = len(ctxs)
+
+        def column(attr, dtype):
+            return np.fromiter(
+                    (getattr(ctx, attr) if ctx is not None else 0
+                     for ctx in ctxs), dtype=dtype, count=num_ctxs)
+
+        arrays['ctx_alive'] = np.fromiter((ctx is not None for ctx in ctxs),
+                                          dtype=np.bool_, count=num_ctxs)
+        arrays['c0'] = column('c0', np.int64)
+        arrays['c1'] = column('c1', np.int64)
+        arrays['num_activations'] = column('num_activations', np.uint32)
+        arrays['last_activated'] = column('last_activated', np.int64)
+        arrays['zerolevel'] = column('zerolevel', np.bool_)
+
+        self._get_half_state(self.left, 'left_', arrays)
+        self._get_half_state(self.right, 'right_', arrays)
+
+        links = [(lsemi_ctx.semi_ctx_id, rsemi_ctx_id, ctx_id)
+                 for lsemi_ctx in self.left.semi_ctxs if lsemi_ctx is not None
+                 for rsemi_ctx_id, ctx_id
+                 in lsemi_ctx.rsemi_ctx_id_to_ctx_id.items()]
+        links = np.array(links, dtype=np.int32).reshape(-1, 3)
+        arrays['link_lsemi_ctx_ids'] = links[:, 0].copy()
+        arrays['link_rsemi_ctx_ids'] = links[:, 1].copy()
+        arrays['link_ctx_ids'] = links[:, 2].copy()
+
+        crossed_semi_ctxs = self.left.crossed_semi_ctxs
+        crossed_facts = [self._get_crossed_facts(self.left, semi_ctx)
+                         for semi_ctx in crossed_semi_ctxs]
+        arrays['left_crossed_semi_ctx_ids'] = np.array(
+                [semi_ctx.semi_ctx_id for semi_ctx in crossed_semi_ctxs],
+                dtype=np.int64)
+        arrays['left_crossed_facts_offsets'] = np.cumsum(
+                [0] + [len(facts) for facts in crossed_facts],
+                dtype=np.int64)
+        arrays['left_crossed_facts'] = np.array(
+                [fact for facts in crossed_facts for fact in facts],
+                dtype=np.int64)
+
+        scalars = {
+            'num_steps': self.num_steps,
+            'num_evicted_ctxs': self.num_evicted_ctxs,
+            'num_evicted_semi_ctxs': self.num_evicted_semi_ctxs,
+            'num_evictions': self.num_evictions,
+            'num_compacted_ctxs': self.num_compacted_ctxs,
+            'num_compacted_semi_ctxs': self.num_compacted_semi_ctxs,
+            'num_compactions': self.num_compactions,
+        }
+        return scalars, arrays
+
+    @classmethod
+    def from_state(cls, scalars, arrays, max_lsemi_ctxs_len, max_ctxs=None):
+        """
+        Rebuilds an operator from the output of get_state (of any context
+        operator).
+        :param scalars: dict of scalars
+        :param arrays: dict of arrays
+        :param max_lsemi_ctxs_len: See __init__
+        :param max_ctxs: See __init__
+        :return: ContextOperator
+        """
+        ctx_operator = cls(max_lsemi_ctxs_len, max_ctxs=max_ctxs)
+        for name, value in scalars.items():
+            setattr(ctx_operator, name, value)
+        ctx_operator.num_dead_ctxs = int(np.count_nonzero(
+                ~arrays['ctx_alive']))
+
+        left, right = ctx_operator.left, ctx_operator.right
+        ctx_operator._set_half_state(left, 'left_', arrays, is_left=True)
+        ctx_operator._set_half_state(right, 'right_', arrays, is_left=False)
+
+        ctx_operator.ctxs = [
+            Ctx(c0, c1, num_activations, None, zerolevel, last_activated)
+            if alive else None
+            for alive, c0, c1, num_activations, zerolevel, last_activated
+            in zip(arrays['ctx_alive'].tolist(), arrays['c0'].tolist(),
+                   arrays['c1'].tolist(), arrays['num_activations'].tolist(),
+                   arrays['zerolevel'].tolist(),
+                   arrays['last_activated'].tolist())]
+
+        for lsemi_ctx_id, rsemi_ctx_id, ctx_id in zip(
+                arrays['link_lsemi_ctx_ids'].tolist(),
+                arrays['link_rsemi_ctx_ids'].tolist(),
+                arrays['link_ctx_ids'].tolist()):
+            left.semi_ctxs[lsemi_ctx_id].rsemi_ctx_id_to_ctx_id[
+                rsemi_ctx_id] = ctx_id
+            ctx_operator.ctxs[ctx_id].rsemi_ctx_id = rsemi_ctx_id
+        for lsemi_ctx in left.semi_ctxs:
+            if lsemi_ctx is not None:
+                _index_pred_weight(lsemi_ctx, ctx_operator.ctxs)
+
+        crossed_facts = arrays['left_crossed_facts'].tolist()
+        crossed_facts_offsets = arrays['left_crossed_facts_offsets'].tolist()
+        ctx_operator._set_crossed_semi_ctxs(left, [
+            (semi_ctx_id, crossed_facts[start:end])
+            for semi_ctx_id, start, end in zip(
+                    arrays['left_crossed_semi_ctx_ids'].tolist(),
+                    crossed_facts_offsets, crossed_facts_offsets[1:])])
+
+        return ctx_operator
+
+    def compact(self, max_idle_steps=None):
+        """
+        Drops the evicted and unreachable contexts and semi contexts (and the
+        idle contexts when max_idle_steps is set) and renumbers the others
+        densely, see compact_state. The operator is rebuilt from its
+        compacted state, it walks the whole model.
+        :param max_idle_steps: See compact_state
+        :return: np.ndarray of old ctx id => new ctx id, -1 for the dropped
+                 contexts, the neuron facts kept outside of the operator
+                 must be renumbered with it
+        """
+        scalars, arrays = self.get_state()
+        scalars, arrays, ctx_id_map = compact_state(scalars, arrays,
+                                                    max_idle_steps)
+        # Update in place, the instrumentation wrappers set on the instance
+        # stay in place
+        shared_dictionary = self.shared_dictionary
+        vars(self).update(vars(type(self).from_state(
+                scalars, arrays, self.max_lsemi_ctxs_len,
+                max_ctxs=self.max_ctxs)))
+        if shared_dictionary is not None:
+            self.share_fact_groups(shared_dictionary)
+        return ctx_id_map
+
+    def share_fact_groups(self, shared_dictionary):
+        """
+        Interns the right fact groups in a dictionary shared with other
+        operators. The right facts are sensor facts only, unlike the left
+        facts they are the same for every detector with the same encoding.
+
+        :param shared_dictionary: SharedDictionary
+        :return: None
+        """
+        self.shared_dictionary = shared_dictionary
+        self.right.fact_groups.share(shared_dictionary)
+
+    # The semi context layout dependent parts of get_state and from_state
+
+    _get_half_state = staticmethod(_get_half_state)
+    _set_half_state = staticmethod(_set_half_state)
+
+    @staticmethod
+    def _get_crossed_facts(half, semi_ctx):
+        """
+        :return: The facts semi_ctx was crossed with, in crossing order
+        """
+        return semi_ctx.facts
+
+    @staticmethod
+    def _set_crossed_semi_ctxs(half, crossed):
+        """
+        Restores the crossing of a half.
+        :param half:
+        :param crossed: list of (semi ctx id, crossed facts) sorted by id
+        :return:
+        """
+        for semi_ctx_id, facts in crossed:
+            semi_ctx = half.semi_ctxs[semi_ctx_id]
+            semi_ctx.facts = facts
+            half.crossed_semi_ctxs.append(semi_ctx)
+
     def cross_ctxs_right(self, facts, pot_new_zero_level_ctx):
         """
         TODO: Write a docstring that describes the crazy logic below in a
               significantly more compact and logical manner.
         :param facts: The facts
         :param pot_new_zero_level_ctx: The potential new zero level contexts
-        :return:
+        :return: (ActiveCtxs in activation order, number of selected
+                 contexts, list of potential new contexts, number of new
+                 contexts), the lists are scratch buffers of the operator
+                 overwritten by the next step
         """
+        self.num_steps += 1
+
         # Reset the crossed semi contexts for the right half
-        _prepare_crossed_semi_ctxs(self.right, facts)
+        self._prepare_crossed_semi_ctxs(self.right, facts)
 
         # Get the number of new contexts
+        self.pot_new_ctx_ids.clear()
         num_new_ctxs = self._add_ctxs_by_facts(pot_new_zero_level_ctx,
                                                zerolevel=True)
 
         # Initialize some variables
-        active_ctxs = []
+        active_ctxs = self.active_ctxs
+        active_ctx_ids = active_ctxs.ctx_ids
+        active_num_activations = active_ctxs.num_activations
+        active_ctx_ids.clear()
+        active_num_activations.clear()
         num_selected_ctx = 0
-        potential_new_ctxs = []
+        potential_new_ctxs = self.potential_new_ctxs
+        potential_new_ctxs.clear()
+        # The crossed facts of every semi context as one tuple per step,
+        # shared by all the potential new contexts made of it
+        rsemi_ctxs_facts = self.rsemi_ctxs_facts
+        rsemi_ctxs_facts.clear()
 
         # Loop through the left semi contexts
         for lsemi_ctx in self.left.crossed_semi_ctxs:
+            lsemi_ctx_facts = None
+            # The weights of the contexts of a fully crossed left semi
+            # context change, its prediction weight is recomputed on the way
+            lfull = len(lsemi_ctx.facts) == lsemi_ctx.init_nfacts
+            pred_weight = 0.0
+            pred_rsemi_ctx_ids = []
             # Loop through the right semi context ID's
             # TODO: Update the deprecated iteritems() call
             for rsemi_ctx_id, ctx_id in lsemi_ctx.rsemi_ctx_id_to_ctx_id.items():
@@ -126,19 +775,21 @@ class ContextOperator(object):
                     # the context 0 by the right semi context initial number
                     # of faces, and the context 1 by the length of right semi
                     # context facts
-                    if len(lsemi_ctx.facts) == lsemi_ctx.init_nfacts:
+                    if lfull:
                         num_selected_ctx += 1
                         ctx.c0 += rsemi_ctx.init_nfacts
                         ctx.c1 += len(rsemi_ctx.facts)
                         # If the right semi contexts facts are equal to the
                         # initial facts increment the contexts number of
-                        # activations by 1, and append a 'recordclass'
-                        # ActiveCtx to the active contexts, with context ID and
-                        # the contexts number of activations
+                        # activations by 1, and append the context ID and
+                        # the contexts number of activations to the active
+                        # contexts
                         if len(rsemi_ctx.facts) == rsemi_ctx.init_nfacts:
                             ctx.num_activations += 1
-                            active_ctxs.append(
-                                ActiveCtx(ctx_id, ctx.num_activations))
+                            ctx.last_activated = self.num_steps
+                            active_ctx_ids.append(ctx_id)
+                            active_num_activations.append(
+                                    ctx.num_activations)
                         # If the above is not true check if we are on the
                         # contexts zero level, if the number of new contexts
                         # is not zero, if the right semi contexts facts is
@@ -148,8 +799,12 @@ class ContextOperator(object):
                                 lsemi_ctx.facts) <= self.max_lsemi_ctxs_len:
                             # Append the left semi context facts to the right
                             # semi context facts
-                            potential_new_ctxs.append((tuple(lsemi_ctx.facts),
-                                                       tuple(rsemi_ctx.facts)))
+                            if lsemi_ctx_facts is None:
+                                lsemi_ctx_facts = tuple(lsemi_ctx.facts)
+                            potential_new_ctxs.append((
+                                    lsemi_ctx_facts,
+                                    _get_facts_tuple(rsemi_ctxs_facts,
+                                                     rsemi_ctx)))
                     # If the the length of the left semi context facts is not
                     # equal to the initial number of facts, check to see if
                     # the context is at zero level, and the number of new
@@ -160,73 +815,107 @@ class ContextOperator(object):
                     #       above this, why is that?
                     elif ctx.zerolevel and num_new_ctxs and rsemi_ctx.facts and len(
                             lsemi_ctx.facts) <= self.max_lsemi_ctxs_len:
-                        potential_new_ctxs.append((tuple(lsemi_ctx.facts),
-                                                   tuple(rsemi_ctx.facts)))
+                        if lsemi_ctx_facts is None:
+                            lsemi_ctx_facts = tuple(lsemi_ctx.facts)
+                        potential_new_ctxs.append((
+                                lsemi_ctx_facts,
+                                _get_facts_tuple(rsemi_ctxs_facts, rsemi_ctx)))
+
+                # Same weights and ties as _index_pred_weight
+                if lfull:
+                    ctx = self.ctxs[ctx_id]
+                    weight = ctx.c1 / float(ctx.c0) if ctx.c0 > 0 else 0.0
+                    if weight > pred_weight:
+                        pred_weight = weight
+                        pred_rsemi_ctx_ids = [rsemi_ctx_id]
+                    elif weight == pred_weight:
+                        pred_rsemi_ctx_ids.append(rsemi_ctx_id)
+
+            if lfull:
+                lsemi_ctx.pred_weight = pred_weight
+                lsemi_ctx.pred_rsemi_ctx_ids = pred_rsemi_ctx_ids
 
         # Set the new context ID to be false
         self.new_ctx_id = False
 
         return active_ctxs, num_selected_ctx, potential_new_ctxs, num_new_ctxs
 
-    def cross_ctxs_left(self, facts, potential_new_ctxs):
+    def cross_ctxs_left(self, facts, potential_new_ctxs, predict=True):
+        """
+        :param facts: The facts
+        :param potential_new_ctxs: The potential new contexts
+        :param predict: Compute the predictions, which nothing the model
+                        learns depends on
+        :return: (number of new contexts, set of predicted facts or None)
+        """
         # Reset the crossed semi contexts
-        _prepare_crossed_semi_ctxs(self.left, facts)
+        self._prepare_crossed_semi_ctxs(self.left, facts)
 
         # Get the number of new contexts
         num_new_ctxs = self._add_ctxs_by_facts(potential_new_ctxs,
                                                zerolevel=False)
+
+        new_predictions = self._predict() if predict else None
+
+        return num_new_ctxs, new_predictions
+
+    def _predict(self):
+        """
+        :return: set of the right facts of the contexts with the highest
+                 prediction weight among the contexts of the fully crossed
+                 left semi contexts
+        """
         # TODO: Investigate why this was cut from the code for 'patent' reasons
         max_pred_weight = 0.0
-        prediction_ctxs = []
+        prediction_rsemi_ctx_ids = []
 
-        # Iterate over the left semi contexts
-        for lsemi_ctx in self.left.semi_ctxs:
+        # Iterate over the crossed left semi contexts, the others have no
+        # facts and can't pass the test below
+        for lsemi_ctx in self.left.crossed_semi_ctxs:
             # Check to see if both the length of the left semi contexts and
             # the length of the left semi contexts initial number of facts
             # are equal and that they are greater than 0
             if 0 < len(lsemi_ctx.facts) == lsemi_ctx.init_nfacts:
-                # Loop over context ID's in the left semi context's
-                for ctx_id in lsemi_ctx.rsemi_ctx_id_to_ctx_id.values():
-                    # Set the context based off the context ID
-                    ctx = self.ctxs[ctx_id]
-                    # Calculate the current prediction weight given ctx.c0 > 0
-                    curr_pred_weight = ctx.c1 / float(
-                        ctx.c0) if ctx.c0 > 0 else 0.0
-
-                    # If the current prediction weight is larger than the max
-                    # prediction weight, set max to current, and also say the
-                    # prediction context is the list of the context
-                    if curr_pred_weight > max_pred_weight:
-                        max_pred_weight = curr_pred_weight
-                        prediction_ctxs = [ctx]
-                    # If the current prediction weight is equal to the max
-                    # append the context to the prediction contexts
-                    elif curr_pred_weight == max_pred_weight:
-                        prediction_ctxs.append(ctx)
+                # The highest weight of the contexts of the left semi context
+                # is kept up to date by cross_ctxs_right, the contexts
+                # sharing the highest weight overall all predict (all of them
+                # when no weight is above 0)
+                curr_pred_weight = lsemi_ctx.pred_weight
+                if curr_pred_weight > max_pred_weight:
+                    max_pred_weight = curr_pred_weight
+                    prediction_rsemi_ctx_ids = [lsemi_ctx.pred_rsemi_ctx_ids]
+                elif curr_pred_weight == max_pred_weight:
+                    prediction_rsemi_ctx_ids.append(
+                            lsemi_ctx.pred_rsemi_ctx_ids)
 
         # Create a set of new predictions (which are facts) that loops through
         # all the prediction contexts and every right side fact in that context
-        new_predictions = set(
-                fact for ctx in prediction_ctxs for fact in ctx.right_facts)
-
-        return num_new_ctxs, new_predictions
+        right_facts = self.right.fact_groups.groups
+        return set(fact for rsemi_ctx_ids in prediction_rsemi_ctx_ids
+                   for rsemi_ctx_id in rsemi_ctx_ids
+                   for fact in right_facts[rsemi_ctx_id])
 
     def _add_ctxs_by_facts(self, new_ctxs, zerolevel):
         num_added_ctxs = 0
+        pot_new_ctx_ids = self.pot_new_ctx_ids
 
         for left_facts, right_facts in new_ctxs:
             lsemi_ctx_id = self._add_semi_ctx_by_facts(self.left, left_facts)
             rsemi_ctx_id = self._add_semi_ctx_by_facts(self.right, right_facts)
 
             next_free_ctx_id_number = len(self.ctxs)
-            ctx_id = self.left.semi_ctxs[
-                lsemi_ctx_id].rsemi_ctx_id_to_ctx_id.setdefault(rsemi_ctx_id,
-                                                                next_free_ctx_id_number)
+            lsemi_ctx = self.left.semi_ctxs[lsemi_ctx_id]
+            ctx_id = lsemi_ctx.rsemi_ctx_id_to_ctx_id.setdefault(
+                    rsemi_ctx_id, next_free_ctx_id_number)
 
+            pot_new_ctx_ids.append(ctx_id)
             if ctx_id == next_free_ctx_id_number:
-                ctx = Ctx(0, 0, 0, right_facts, zerolevel)
+                ctx = Ctx(0, 0, 0, rsemi_ctx_id, zerolevel, self.num_steps)
                 self.ctxs.append(ctx)
                 num_added_ctxs += 1
+                # A new context has a weight of 0
+                if lsemi_ctx.pred_weight == 0.0:
+                    lsemi_ctx.pred_rsemi_ctx_ids.append(rsemi_ctx_id)
                 if zerolevel:
                     self.new_ctx_id = ctx_id
             else:
@@ -237,14 +926,105 @@ class ContextOperator(object):
         return num_added_ctxs
 
     def _add_semi_ctx_by_facts(self, half, facts):
-        next_semi_ctx_number = len(half.facts_hash_to_semi_ctx_id)
-        semi_ctx_id = half.facts_hash_to_semi_ctx_id.setdefault(hash(facts),
-                                                                next_semi_ctx_number)
+        next_semi_ctx_number = len(half.semi_ctxs)
+        semi_ctx_id = half.fact_groups.intern(facts)
         if semi_ctx_id == next_semi_ctx_number:
-            semi_ctx = SemiCtx([], len(facts),
-                               {} if half == self.left else None)
+            # The interned tuple, its facts may be shared
+            facts = half.fact_groups[semi_ctx_id]
+            is_left = half is self.left
+            semi_ctx = SemiCtx([], len(facts), {} if is_left else None,
+                               semi_ctx_id, 0.0, [] if is_left else None)
             half.semi_ctxs.append(semi_ctx)
             for fact in facts:
                 semi_ctxs = half.fact_to_semi_ctx.setdefault(fact, [])
                 semi_ctxs.append(semi_ctx)
         return semi_ctx_id
+
+    def evict_cold_ctxs(self):
+        """
+        When there are more than max_ctxs contexts, evicts the coldest ones
+        until the live contexts are back to (1 - EVICTION_FRACTION) *
+        max_ctxs, then drops what they leave dangling:
+          - left semi contexts with a neuron fact of an evicted context can
+            never be fully crossed again, they go with all their contexts
+            (which may in turn orphan more left semi contexts),
+          - semi contexts without any context left.
+        The operator is then compacted, see compact. This walks the whole
+        model, hence the batching, and must only be called between two
+        steps.
+        :return: np.ndarray of old ctx id => new ctx id, -1 for the evicted
+                 contexts, the neuron facts kept outside of the operator
+                 must be renumbered with it, or None when nothing was
+                 evicted
+        """
+        if self.max_ctxs is None or self.get_num_ctxs() <= self.max_ctxs:
+            return None
+        num_to_evict = self.get_num_ctxs() - int(
+                self.max_ctxs * (1.0 - EVICTION_FRACTION))
+
+        coldest = heapq.nsmallest(
+                num_to_evict,
+                ((ctx.last_activated, ctx.num_activations, ctx_id)
+                 for ctx_id, ctx in enumerate(self.ctxs) if ctx is not None))
+        num_evicted_ctxs = 0
+        for _, _, ctx_id in coldest:
+            self.ctxs[ctx_id] = None
+            num_evicted_ctxs += 1
+
+        dead_semi_ctxs = set()
+        fact_to_lsemi_ctx = self.left.fact_to_semi_ctx
+        while True:
+            # Left semi contexts referring to an evicted neuron
+            orphans = [semi_ctx
+                       for fact, semi_ctxs in fact_to_lsemi_ctx.items()
+                       if fact >= NEURON_FACT_OFFSET and
+                       self.ctxs[fact - NEURON_FACT_OFFSET] is None
+                       for semi_ctx in semi_ctxs
+                       if id(semi_ctx) not in dead_semi_ctxs]
+            if not orphans:
+                break
+            for lsemi_ctx in orphans:
+                if id(lsemi_ctx) in dead_semi_ctxs:
+                    continue
+                dead_semi_ctxs.add(id(lsemi_ctx))
+                for ctx_id in lsemi_ctx.rsemi_ctx_id_to_ctx_id.values():
+                    if self.ctxs[ctx_id] is not None:
+                        self.ctxs[ctx_id] = None
+                        num_evicted_ctxs += 1
+                lsemi_ctx.rsemi_ctx_id_to_ctx_id = {}
+
+        # Drop the evicted contexts from the left => right maps and collect
+        # the right semi contexts still in use
+        used_rsemi_ctx_ids = set()
+        for lsemi_ctx in self.left.semi_ctxs:
+            if lsemi_ctx is None:
+                continue
+            rsemi_ctx_id_to_ctx_id = lsemi_ctx.rsemi_ctx_id_to_ctx_id
+            dead_rsemi_ctx_ids = [rsemi_ctx_id for rsemi_ctx_id, ctx_id
+                                  in rsemi_ctx_id_to_ctx_id.items()
+                                  if self.ctxs[ctx_id] is None]
+            for rsemi_ctx_id in dead_rsemi_ctx_ids:
+                del rsemi_ctx_id_to_ctx_id[rsemi_ctx_id]
+            if rsemi_ctx_id_to_ctx_id:
+                used_rsemi_ctx_ids.update(rsemi_ctx_id_to_ctx_id)
+                if dead_rsemi_ctx_ids:
+                    _index_pred_weight(lsemi_ctx, self.ctxs)
+            else:
+                dead_semi_ctxs.add(id(lsemi_ctx))
+
+        for rsemi_ctx_id, rsemi_ctx in enumerate(self.right.semi_ctxs):
+            if rsemi_ctx is not None and \
+                    rsemi_ctx_id not in used_rsemi_ctx_ids:
+                dead_semi_ctxs.add(id(rsemi_ctx))
+
+        self.num_evicted_semi_ctxs += _drop_semi_ctxs(self.left,
+                                                      dead_semi_ctxs)
+        self.num_evicted_semi_ctxs += _drop_semi_ctxs(self.right,
+                                                      dead_semi_ctxs)
+        self.num_evicted_ctxs += num_evicted_ctxs
+        self.num_dead_ctxs += num_evicted_ctxs
+        self.num_evictions += 1
+
+        # Renumber densely rather than leave None slots behind, the next
+        # passes only walk the live contexts
+        return self.compact()
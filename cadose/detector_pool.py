@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import multiprocessing
+import zlib
+from timeit import default_timer as timer
+
+import numpy as np
+
+from cadose.cad_ose import ContextualAnomalyDetector, _scale_values
+
+
+def shard_of(stream_key, num_shards):
+    """
+    Maps a stream key to a shard number. hash() is salted per interpreter so
+    a crc of the key repr is used instead, the same key always lands on the
+    same shard.
+
+    :param stream_key: Any key with a stable repr (str, int, tuple of those)
+    :param num_shards: The number of shards
+    :return: int in [0, num_shards)
+    """
+    return zlib.crc32(repr(stream_key).encode('utf-8')) % num_shards
+
+
+def _group_points(points, num_shards):
+    """
+    Splits a batch of (stream_key, value) points per shard and per stream,
+    keeping the order of the points of every stream.
+
+    :param points: Iterable of (stream_key, value)
+    :param num_shards: The number of shards
+    :return: (number of points, list with one {stream_key: (indices, values)}
+             dict per shard)
+    """
+    shards = [{} for _ in range(num_shards)]
+    shard_cache = {}
+    num_points = 0
+    for idx, (stream_key, value) in enumerate(points):
+        shard = shard_cache.get(stream_key)
+        if shard is None:
+            shard = shard_cache[stream_key] = shard_of(stream_key, num_shards)
+        indices, values = shards[shard].setdefault(stream_key, ([], []))
+        indices.append(idx)
+        values.append(value)
+        num_points += 1
+    return num_points, shards
+
+
+def _encode_streams(payload, get_detector):
+    """
+    Encodes the values of every stream of a batch before any detector is
+    stepped, so a value that can't be encoded fails the batch while no
+    stream has consumed any of its points and the batch can be retried.
+
+    :param payload: dict of stream_key => np.ndarray of values
+    :param get_detector: Callable giving the detector of a stream key
+    :return: list of (stream_key, detector, list of Encodings, time spent
+             encoding them)
+    """
+    encoded = []
+    for stream_key, values in payload.items():
+        detector = get_detector(stream_key)
+        start = timer()
+        encodings = detector._encode_many(values)
+        encoded.append((stream_key, detector, encodings, timer() - start))
+    return encoded
+
+
+def _worker_main(conn, detector_params):
+    """
+    Worker process loop. The worker owns the detectors (and so the context
+    operators) of every stream sharded to it, and serves the commands sent
+    by the DetectorPool until it is told to stop.
+
+    :param conn: The worker end of the pool pipe
+    :param detector_params: Keyword arguments of ContextualAnomalyDetector
+    :return: None
+    """
+    detectors = {}
+    # Reports of the profilers that stopped since the last 'profiles'
+    reports = []
+
+    def on_profile_finish(profiler):
+        reports.append(profiler.get_report())
+
+    def get_detector(stream_key):
+        detector = detectors.get(stream_key)
+        if detector is None:
+            detector = detectors[stream_key] = \
+                ContextualAnomalyDetector(**detector_params)
+        return detector
+
+    while True:
+        command, payload = conn.recv()
+        if command == 'stop':
+            break
+        try:
+            if command == 'score':
+                result = dict(
+                        (stream_key,
+                         detector._score_encodings(encodings, elapsed))
+                        for stream_key, detector, encodings, elapsed
+                        in _encode_streams(payload, get_detector))
+            elif command == 'learn':
+                for _, detector, encodings, elapsed in _encode_streams(
+                        payload, get_detector):
+                    detector._learn_encodings(encodings, elapsed)
+                result = None
+            elif command == 'streams':
+                result = list(detectors)
+            elif command == 'profile':
+                stream_keys, profile_params = payload
+                if stream_keys is None:
+                    stream_keys = list(detectors)
+                result = 0
+                for stream_key in stream_keys:
+                    detector = get_detector(stream_key)
+                    # Those already being profiled are left as they are
+                    if detector.profiler is None or detector.profiler.finished:
+                        detector.start_profiling(
+                                stream_key=stream_key,
+                                on_finish=on_profile_finish, **profile_params)
+                        result += 1
+            elif command == 'profiles':
+                if payload:
+                    for detector in detectors.values():
+                        detector.stop_profiling()
+                result = reports[:]
+                del reports[:]
+            else:
+                raise ValueError('unknown command %r' % (command,))
+        except Exception as exc:
+            conn.send(('error', exc))
+        else:
+            conn.send(('ok', result))
+    conn.close()
+
+
+class DetectorPool(object):
+    """
+    A pool of worker processes sharing the detectors of many streams. Stream
+    keys are hashed to workers, each worker owns the detectors of its streams
+    so every stream is always scored by the same process, in order.
+
+    Batches of (stream_key, value) points are split per worker, scored in
+    parallel and the scores are returned in the input order. A batch with a
+    value that can't be encoded fails before any detector consumed a point
+    of it, so it can be fixed and sent again.
+    """
+    def __init__(self, num_workers=None, **detector_params):
+        """
+        :param num_workers: Number of worker processes, defaults to the
+                            number of CPUs
+        :param detector_params: Keyword arguments used to create the
+                                ContextualAnomalyDetector of every stream
+        """
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.detector_params = detector_params
+        # The scaling of the values, the batches are checked with it before
+        # they are sent to the workers
+        detector = ContextualAnomalyDetector(**detector_params)
+        self._min_value = detector.min_value
+        self._min_value_step = detector.min_value_step
+
+        self._conns = []
+        self._workers = []
+        for _ in range(self.num_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_worker_main,
+                                             args=(child_conn,
+                                                   detector_params),
+                                             daemon=True)
+            worker.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._workers.append(worker)
+
+    def score(self, points):
+        """
+        Scores a batch of points.
+
+        :param points: Iterable of (stream_key, value)
+        :return: np.ndarray of float64 anomaly scores in the input order
+        """
+        num_points, shards = _group_points(points, self.num_workers)
+        scores = np.empty(num_points, dtype=np.float64)
+        results = self._dispatch('score', shards)
+        for shard, result in zip(shards, results):
+            for stream_key, stream_scores in result.items():
+                scores[shard[stream_key][0]] = stream_scores
+        return scores
+
+    def learn(self, points):
+        """
+        Feeds a batch of points to the detectors without returning scores.
+
+        :param points: Iterable of (stream_key, value)
+        :return: None
+        """
+        _, shards = _group_points(points, self.num_workers)
+        self._dispatch('learn', shards)
+
+    def stream_keys(self):
+        """
+        :return: list of the stream keys the pool has detectors for
+        """
+        keys = []
+        for result in self._dispatch('streams',
+                                     [None] * self.num_workers):
+            keys.extend(result)
+        return keys
+
+    def start_profiling(self, stream_keys=None, **profile_params):
+        """
+        Starts profiling the detectors of some streams in the workers, see
+        ContextualAnomalyDetector.start_profiling. The reports are collected
+        by get_profiles.
+
+        :param stream_keys: Keys of the streams to profile, their detectors
+                            are created if needed, None for all the streams
+                            having a detector
+        :param profile_params: num_steps, duration and trace_allocations
+        :return: Number of profilers started, the detectors already being
+                 profiled are skipped
+        """
+        if stream_keys is None:
+            payloads = [(None, profile_params)] * self.num_workers
+        else:
+            shards = [[] for _ in range(self.num_workers)]
+            for stream_key in stream_keys:
+                shards[shard_of(stream_key, self.num_workers)].append(
+                        stream_key)
+            payloads = [(shard, profile_params) for shard in shards]
+        return sum(self._dispatch('profile', payloads))
+
+    def get_profiles(self, stop=False):
+        """
+        :param stop: Stop the running profilers first
+        :return: list of the cadose.profiling.ProfileReports of the
+                 profilers that stopped since the last call
+        """
+        reports = []
+        for result in self._dispatch('profiles', [stop] * self.num_workers):
+            reports.extend(result)
+        return reports
+
+    def close(self):
+        """
+        Stops the worker processes, the detectors state is lost.
+
+        :return: None
+        """
+        for conn in self._conns:
+            try:
+                conn.send(('stop', None))
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for worker in self._workers:
+            worker.join()
+        self._conns = []
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _worker_error(self, shard):
+        """
+        :param shard: The shard of a worker whose pipe is broken
+        :return: RuntimeError naming the shard and how its worker exited
+        """
+        worker = self._workers[shard]
+        worker.join(1.0)
+        return RuntimeError('the worker of shard %d (pid %s) died, exit code '
+                            '%s, the detectors of its streams are lost' % (
+                                shard, worker.pid, worker.exitcode))
+
+    def _dispatch(self, command, payloads):
+        """
+        Sends one payload per worker and waits for all the answers. Workers
+        with an empty payload are skipped.
+
+        :param command: The worker command
+        :param payloads: One payload per worker
+        :return: list of results, one per worker
+        """
+        if not self._conns:
+            raise RuntimeError('the pool is closed')
+
+        if command in ('score', 'learn'):
+            payloads = [
+                dict((stream_key, np.asarray(values, dtype=np.float64))
+                     for stream_key, (_, values) in payload.items())
+                for payload in payloads]
+            values = [stream_values for payload in payloads
+                      for stream_values in payload.values()]
+            if values:
+                # Rejects what the workers would fail to encode, without
+                # encoding anything
+                _scale_values(np.concatenate(values), self._min_value,
+                              self._min_value_step)
+
+        error = None
+        busy = []
+        for shard, (conn, payload) in enumerate(zip(self._conns, payloads)):
+            if command in ('score', 'learn') and not payload:
+                busy.append(False)
+                continue
+            try:
+                conn.send((command, payload))
+            except OSError:
+                if error is None:
+                    error = self._worker_error(shard)
+                busy.append(False)
+                continue
+            busy.append(True)
+
+        # Every sent payload is answered before any error is raised, so the
+        # pipes of the live workers stay in sync
+        results = []
+        for shard, (conn, sent) in enumerate(zip(self._conns, busy)):
+            if not sent:
+                results.append({})
+                continue
+            try:
+                status, result = conn.recv()
+            except (EOFError, OSError):
+                status, result = 'error', self._worker_error(shard)
+            if status == 'error' and error is None:
+                error = result
+            results.append(result if status == 'ok' else {})
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+
+class FactGroupTable(object):
+    """
+    Interning table of fact groups, the tuples of facts the semi contexts are
+    made of: every distinct tuple gets a sequential id and is stored once, so
+    everything referring to a group keeps its id instead of a tuple of its
+    own. Lookups compare the whole tuples, two groups with the same hash()
+    are never merged.
+
+    A table sharing a SharedDictionary stores the tuple interned in it
+    rather than its own copy of every new group.
+    """
+
+    def __init__(self):
+        self.ids = {}  # facts => group id
+        self.groups = []  # group id => facts, None once removed
+        self.shared = None  # optional SharedDictionary the groups are in
+
+    @classmethod
+    def from_groups(cls, groups):
+        """
+        :param groups: list of group id => tuple of facts, or None for the
+                       removed groups
+        :return: FactGroupTable
+        """
+        table = cls()
+        table.groups = groups
+        table.ids = dict((facts, group_id)
+                         for group_id, facts in enumerate(groups)
+                         if facts is not None)
+        return table
+
+    def __len__(self):
+        """
+        :return: The number of groups, removed ones excluded
+        """
+        return len(self.ids)
+
+    def __getitem__(self, group_id):
+        return self.groups[group_id]
+
+    def intern(self, facts):
+        """
+        :param facts: tuple of facts
+        :return: The id of the group, a new one (the previous length of
+                 groups) when the group wasn't in the table
+        """
+        group_id = self.ids.get(facts)
+        if group_id is None:
+            if self.shared is not None:
+                facts = self.shared.intern(facts)
+            group_id = len(self.groups)
+            self.groups.append(facts)
+            self.ids[facts] = group_id
+        return group_id
+
+    def share(self, shared):
+        """
+        Interns the groups, the current and the new ones, in shared.
+
+        :param shared: SharedDictionary
+        :return: None
+        """
+        self.shared = shared
+        for group_id, facts in enumerate(self.groups):
+            if facts is None:
+                continue
+            interned = shared.intern(facts)
+            self.groups[group_id] = interned
+            # Assigning an equal key would keep the old key object
+            del self.ids[facts]
+            self.ids[interned] = group_id
+
+    def get_hashes(self):
+        """
+        :return: list of (facts hash, group id) of the groups, by group id
+        """
+        return [(hash(facts), group_id)
+                for group_id, facts in enumerate(self.groups)
+                if facts is not None]
+
+    def remove(self, group_ids):
+        """
+        :param group_ids: set of ids of groups to remove
+        :return:
+        """
+        for group_id in group_ids:
+            facts = self.groups[group_id]
+            self.groups[group_id] = None
+            del self.ids[facts]
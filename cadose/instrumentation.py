@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import bisect
+import math
+from timeit import default_timer as timer
+
+# Phases of a step, in the order they run
+PHASES = (
+    'encode',
+    'prepare_crossed_semi_ctxs',
+    'cross_ctxs_right',
+    'add_ctxs_by_facts',
+    'cross_ctxs_left',
+    'evict_cold_ctxs',
+    'compact',
+    'score',
+)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of durations with a fixed number of log-spaced buckets, its
+    memory does not grow with the number of recorded durations. Percentiles
+    are the upper bound of the bucket they fall in, so they are exact within
+    a factor 10 ** (1 / buckets_per_decade).
+    """
+    def __init__(self, min_value=1e-7, max_value=10.0, buckets_per_decade=10):
+        """
+        :param min_value: Upper bound of the first bucket, in seconds
+        :param max_value: Durations above it land in the last bucket
+        :param buckets_per_decade: Resolution of the histogram
+        """
+        num_buckets = int(math.ceil(
+                math.log10(max_value / min_value) * buckets_per_decade)) + 1
+        self.bounds = [min_value * 10 ** (i / float(buckets_per_decade))
+                       for i in range(num_buckets)]
+        self.counts = [0] * (num_buckets + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value, count=1):
+        """
+        :param value: A duration in seconds
+        :param count: Number of times value is recorded
+        :return: None
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += count
+        self.count += count
+        self.total += value * count
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """
+        :param q: Percentile in [0, 100]
+        :return: Upper bound of the bucket holding the q-th percentile, 0.0
+                 when nothing was recorded
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(self.count * q / 100.0)))
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                break
+        return self.bounds[idx] if idx < len(self.bounds) else self.max
+
+    def get_stats(self):
+        """
+        :return: dict with the count, mean, p50, p90, p99 and max durations
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class Counter(object):
+    """
+    Total, maximum and number of the samples of a per step quantity.
+    """
+    def __init__(self):
+        self.total = 0
+        self.max = 0
+        self.num_samples = 0
+
+    def add(self, value):
+        self.total += value
+        self.num_samples += 1
+        if value > self.max:
+            self.max = value
+
+    def get_stats(self):
+        return {
+            'total': self.total,
+            'mean': self.total / float(self.num_samples)
+            if self.num_samples else 0.0,
+            'max': self.max,
+        }
+
+
+class Instrumentation(object):
+    """
+    Per phase timings and per step counters of a detector.
+
+    Nothing in the detector or context operator code checks whether it is
+    instrumented: attach() shadows the timed methods with wrappers set on
+    the instances, and detach() deletes them, so a detector that is not
+    instrumented runs the very same code as before.
+
+    Phase durations are exclusive, the time spent in a nested phase (e.g.
+    add_ctxs_by_facts in cross_ctxs_right) is only counted once, in the
+    nested phase.
+    """
+    def __init__(self, **histogram_params):
+        """
+        :param histogram_params: Keyword arguments of the LatencyHistogram of
+                                 every phase
+        """
+        self.phases = dict((phase, LatencyHistogram(**histogram_params))
+                           for phase in PHASES)
+        self.counters = {
+            'new_ctxs': Counter(),
+            'active_ctxs': Counter(),
+            'potential_new_ctxs': Counter(),
+        }
+        self._nested_time = 0.0
+        self._num_new_right_ctxs = 0
+        self._targets = []
+
+    def attach(self, detector):
+        """
+        Starts timing detector.
+
+        :param detector: A ContextualAnomalyDetector
+        :return: None
+        """
+        ctx_operator = detector.ctx_operator
+        self._wrap(detector, '_encode', 'encode')
+        self._wrap(detector, '_encode_many', 'encode', batched=True)
+        self._wrap(detector, '_score_facts', 'score')
+        self._wrap(detector, '_learn_facts', 'score')
+        self._wrap(ctx_operator, '_prepare_crossed_semi_ctxs',
+                   'prepare_crossed_semi_ctxs')
+        self._wrap(ctx_operator, '_add_ctxs_by_facts', 'add_ctxs_by_facts')
+        self._wrap(ctx_operator, 'evict_cold_ctxs', 'evict_cold_ctxs')
+        self._wrap(ctx_operator, 'compact', 'compact')
+        self._wrap(ctx_operator, 'cross_ctxs_right', 'cross_ctxs_right',
+                   self._count_right)
+        self._wrap(ctx_operator, 'cross_ctxs_left', 'cross_ctxs_left',
+                   self._count_left)
+
+    def detach(self):
+        """
+        Stops timing, the recorded stats are kept.
+
+        :return: None
+        """
+        for target, name in self._targets:
+            target.__dict__.pop(name, None)
+        self._targets = []
+
+    def get_stats(self):
+        """
+        :return: dict with a 'phases' dict of phase => duration stats (in
+                 seconds) and a 'counters' dict of counter => per step stats
+        """
+        return {
+            'phases': dict((phase, histogram.get_stats())
+                           for phase, histogram in self.phases.items()),
+            'counters': dict((name, counter.get_stats())
+                             for name, counter in self.counters.items()),
+        }
+
+    def _count_right(self, result):
+        active_ctxs, _, potential_new_ctxs, num_new_ctxs = result
+        self.counters['active_ctxs'].add(len(active_ctxs.ctx_ids))
+        self.counters['potential_new_ctxs'].add(len(potential_new_ctxs))
+        self._num_new_right_ctxs = num_new_ctxs
+
+    def _count_left(self, result):
+        self.counters['new_ctxs'].add(self._num_new_right_ctxs + result[0])
+
+    def _wrap(self, target, name, phase, on_result=None, batched=False):
+        """
+        Shadows the target.name method with a timed wrapper.
+
+        :param target: The instance
+        :param name: The method name
+        :param phase: The phase the method time is recorded in
+        :param on_result: Optional callable fed with the method result
+        :param batched: The method takes a sequence of values as first
+                        argument, its time is recorded once per value
+        :return: None
+        """
+        method = getattr(target, name, None)
+        if method is None:
+            return
+        histogram = self.phases[phase]
+
+        def timed(*args, **kwargs):
+            outer_nested_time = self._nested_time
+            self._nested_time = 0.0
+            start = timer()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                elapsed = timer() - start
+                own_time = elapsed - self._nested_time
+                self._nested_time = outer_nested_time + elapsed
+            if batched:
+                if len(result):
+                    histogram.record(own_time / len(result), len(result))
+            else:
+                histogram.record(own_time)
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        setattr(target, name, timed)
+        self._targets.append((target, name))
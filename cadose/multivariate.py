@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import collections
+
+import numpy as np
+
+from cadose.cad_ose import (SENSOR_FACT_OFFSET, ContextualAnomalyDetector,
+                            Encoding, _make_sensor_facts, _scale_values)
+from cadose.context_operator import NEURON_FACT_OFFSET
+
+Input = collections.namedtuple('Input', [
+        'name',
+        'min_value',
+        'min_value_step',  # difference of values scaled to 1
+        'num_norm_value_bits',
+        'max_bin_value',
+        'fact_offset',  # fact of bit 0, the input facts follow
+])
+
+
+class MultivariateAnomalyDetector(ContextualAnomalyDetector):
+    """
+    Detector of several named inputs (e.g. the CPU, memory and I/O of a
+    host) sharing one context memory. Every input is scaled and encoded as
+    ContextualAnomalyDetector does, with its own min_value, max_value and
+    number of bits, into its own range of facts, and the facts of all the
+    inputs of a point are the facts of one step. The contexts can then span
+    several inputs: a combination of values never seen together is
+    anomalous even when each of them is not.
+
+    Points are dicts of input name => value or sequences of values in the
+    order of the inputs, get_anomaly_score and learn_many / score_many take
+    one point and a dict of input name => values or an array of one row per
+    point respectively.
+
+    A value above the max_value of its input is encoded as max_value: it
+    would set bits of the range of the next input otherwise.
+
+    With a single input and values up to max_value the scores are the ones
+    of ContextualAnomalyDetector.
+    """
+    def __init__(self, inputs, base_threshold, rest_period,
+                 max_lsemi_ctxs_len, max_active_neurons_num, max_ctxs=None,
+                 compact=False, bitset=False, alert_policies=None,
+                 max_idle_steps=None, compaction_interval=None,
+                 dictionary_id=None, debug=False):
+        """
+        :param inputs: list of dicts of name, min_value, max_value and
+                       num_norm_value_bits of every input
+        See ContextualAnomalyDetector for the other parameters.
+        """
+        if not inputs:
+            raise ValueError('no input')
+        self.params = dict(
+                inputs=[dict(input_params) for input_params in inputs],
+                base_threshold=base_threshold, rest_period=rest_period,
+                max_lsemi_ctxs_len=max_lsemi_ctxs_len,
+                max_active_neurons_num=max_active_neurons_num,
+                max_ctxs=max_ctxs, compact=compact, bitset=bitset,
+                alert_policies={}, max_idle_steps=max_idle_steps,
+                compaction_interval=compaction_interval,
+                dictionary_id=dictionary_id, debug=debug)
+
+        self.inputs = []
+        fact_offset = SENSOR_FACT_OFFSET
+        for input_params in inputs:
+            num_norm_value_bits = input_params['num_norm_value_bits']
+            max_bin_value = 2 ** num_norm_value_bits - 1.0
+            full_value_range = float(input_params['max_value']) - \
+                float(input_params['min_value'])
+            if full_value_range == 0.0:
+                full_value_range = max_bin_value
+            self.inputs.append(Input(
+                    input_params['name'], float(input_params['min_value']),
+                    full_value_range / max_bin_value, num_norm_value_bits,
+                    max_bin_value, fact_offset))
+            fact_offset += 2 * num_norm_value_bits
+        if fact_offset >= NEURON_FACT_OFFSET:
+            raise ValueError('too many input bits')
+        self.input_names = [input_.name for input_ in self.inputs]
+        if len(set(self.input_names)) != len(self.input_names):
+            raise ValueError('duplicate input names')
+
+        self._init_model(base_threshold, rest_period, max_lsemi_ctxs_len,
+                         max_active_neurons_num, max_ctxs, compact, bitset,
+                         alert_policies, max_idle_steps, compaction_interval,
+                         dictionary_id, debug)
+
+    def _get_encoding_key(self):
+        return tuple(self.inputs)
+
+    def _encode(self, input_data):
+        """
+        :param input_data: dict of input name => value or sequence of values
+        :return: Encoding
+        """
+        if isinstance(input_data, dict):
+            input_data = [input_data[name] for name in self.input_names]
+        if len(input_data) != len(self.inputs):
+            raise ValueError('expected %d input values' % len(self.inputs))
+        norm_values = tuple(
+                min(int((value - input_.min_value) / input_.min_value_step),
+                    int(input_.max_bin_value))
+                for input_, value in zip(self.inputs, input_data))
+        encoding = self._encodings.get(norm_values)
+        if encoding is None:
+            encoding = self._add_encoding(norm_values)
+        return encoding
+
+    def _encode_many(self, values):
+        """
+        Vectorized version of _encode, every distinct combination of scaled
+        values is only looked up once.
+
+        :param values: dict of input name => 1-d array like of values, or
+                       2-d array like of one row of input values per point
+        :return: list of Encodings, one per point
+        """
+        if isinstance(values, dict):
+            values = np.column_stack([
+                    np.asarray(values[name], dtype=np.float64).ravel()
+                    for name in self.input_names])
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim != 2 or values.shape[1] != len(self.inputs):
+            raise ValueError('expected one column per input')
+        if not len(values):
+            return []
+
+        norm_values = np.column_stack([
+                np.minimum(_scale_values(values[:, idx], input_.min_value,
+                                         input_.min_value_step),
+                           int(input_.max_bin_value))
+                for idx, input_ in enumerate(self.inputs)])
+
+        uniq_values, inverse = np.unique(norm_values, axis=0,
+                                         return_inverse=True)
+        encodings = self._encodings
+        encodings_table = []
+        for row in uniq_values.tolist():
+            row = tuple(row)
+            encoding = encodings.get(row)
+            if encoding is None:
+                encoding = self._add_encoding(row)
+            encodings_table.append(encoding)
+        return [encodings_table[i] for i in inverse.ravel().tolist()]
+
+    def _make_encoding(self, norm_input_value):
+        """
+        :param norm_input_value: tuple of the scaled values of the inputs
+        :return: Encoding
+        """
+        facts = ()
+        for input_, norm_value in zip(self.inputs, norm_input_value):
+            facts += _make_sensor_facts(
+                    norm_value, input_.num_norm_value_bits, input_.fact_offset)
+        return Encoding(facts)
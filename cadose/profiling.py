@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Opt-in profiling of the steps of a detector.
+
+A Profiler attached to a detector (see
+ContextualAnomalyDetector.start_profiling) samples the stack of the thread
+running the detector steps and traces the memory allocated meanwhile with
+tracemalloc, for a number of steps or a time window, then stops on its own.
+Its report is tagged with the stream key and the model size, and exported
+as collapsed stacks (the input of flame graph tools such as flamegraph.pl or
+speedscope) and as a JSON summary of the CPU time by function and of the
+allocation sites:
+
+    profiler = detector.start_profiling(num_steps=1000, stream_key='cpu')
+    ...  # the detector keeps on scoring
+    write_report(profiler.get_report(), 'profiles')
+
+Nothing runs until a profiler is started: the step wrapper is set on the
+detector instance and deleted when the profiler stops, as Instrumentation
+does, and the sampling thread only runs while a profiler does.
+"""
+
+import collections
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from timeit import default_timer as timer
+
+# Time between two stack samples, in seconds. The interpreter switch
+# interval is lowered to it while sampling, so the sampling thread gets the
+# GIL that often.
+SAMPLING_INTERVAL = 0.001
+
+# Number of functions and of allocation sites in a summary
+NUM_TOP_ENTRIES = 30
+
+ProfileReport = collections.namedtuple('ProfileReport', [
+        'summary',  # JSON serializable dict
+        'collapsed_stacks',  # list of 'frame;frame;... samples' lines
+])
+
+_IGNORED_ALLOCATION_FILES = (tracemalloc.__file__, __file__)
+
+
+def _get_frame_name(code):
+    return '%s:%s' % (os.path.basename(code.co_filename),
+                      getattr(code, 'co_qualname', code.co_name))
+
+
+def _to_json(value):
+    # numpy scalars of the model stats, repr of anything else
+    return value.item() if hasattr(value, 'item') else repr(value)
+
+
+class _Sampler(object):
+    """
+    The thread sampling the stacks of the running profilers, one per
+    process whatever the number of profilers.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profilers = set()
+        self.thread = None
+        self.switch_interval = None
+
+    def add(self, profiler):
+        with self.lock:
+            self.profilers.add(profiler)
+            if self.thread is None:
+                self.switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(SAMPLING_INTERVAL)
+                self.thread = threading.Thread(
+                        target=self._run, name='cadose-profiler', daemon=True)
+                self.thread.start()
+
+    def remove(self, profiler):
+        with self.lock:
+            self.profilers.discard(profiler)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.profilers:
+                    sys.setswitchinterval(self.switch_interval)
+                    self.thread = None
+                    return
+                profilers = list(self.profilers)
+            frames = sys._current_frames()
+            for profiler in profilers:
+                thread_id = profiler.thread_id
+                if thread_id is not None:
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profiler.add_sample(frame)
+            del frames
+            time.sleep(SAMPLING_INTERVAL)
+
+
+_sampler = _Sampler()
+
+_tracing_lock = threading.Lock()
+_num_tracing_profilers = 0
+_started_tracing = False
+
+
+def _start_tracing():
+    global _num_tracing_profilers, _started_tracing
+    with _tracing_lock:
+        if not _num_tracing_profilers and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _num_tracing_profilers += 1
+
+
+def _stop_tracing():
+    global _num_tracing_profilers, _started_tracing
+    with _tracing_lock:
+        _num_tracing_profilers -= 1
+        # Tracing started by someone else is left running
+        if not _num_tracing_profilers and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+class Profiler(object):
+    """
+    Profile of the steps of one detector, see the module docstring.
+
+    The CPU time of every function is estimated from the share of the stack
+    samples it appears in, scaled to the CPU time of the profiled steps
+    (which is measured). The allocation sites are the lines the memory
+    allocated during the profile and still alive at its end was allocated
+    from. tracemalloc traces every thread of the process, so the
+    allocations of what runs concurrently are included.
+    """
+    def __init__(self, num_steps=None, duration=None, stream_key=None,
+                 trace_allocations=True, on_finish=None):
+        """
+        :param num_steps: Optional number of steps to profile
+        :param duration: Optional number of seconds to profile, checked
+                         after every step
+        :param stream_key: Optional key of the stream the detector scores,
+                           copied into the report
+        :param trace_allocations: Trace the allocations with tracemalloc,
+                                  which slows every allocation down
+        :param on_finish: Optional callable called with the profiler once
+                          it stops, from the thread running the last step
+                          or calling finish
+        """
+        self.num_steps = num_steps
+        self.duration = duration
+        self.stream_key = stream_key
+        self.trace_allocations = trace_allocations
+        self.on_finish = on_finish
+
+        self.stacks = collections.Counter()  # tuple of frames => samples
+        self.num_profiled_steps = 0
+        self.step_time = 0.0
+        self.cpu_time = 0.0
+        self.start_time = None
+        self.finish_time = None
+        self.model_size = {}
+        self.allocations = []  # (site, size, count), biggest first
+        self.finished = False
+
+        # Id of the thread running a profiled step, None between steps
+        self.thread_id = None
+
+        self._detector = None
+        self._profiled_step = None
+        self._start_snapshot = None
+        self._finish_lock = threading.Lock()
+
+    def attach(self, detector):
+        """
+        Starts profiling the steps of detector.
+
+        :param detector: A ContextualAnomalyDetector
+        :return: None
+        """
+        self._detector = detector
+        self.model_size['start'] = detector.ctx_operator.get_stats()
+        if self.trace_allocations:
+            _start_tracing()
+            self._start_snapshot = tracemalloc.take_snapshot()
+        step = detector.step
+
+        def profiled_step(*args, **kwargs):
+            self.thread_id = threading.get_ident()
+            start_cpu_time = time.thread_time()
+            start = timer()
+            try:
+                return step(*args, **kwargs)
+            finally:
+                self.thread_id = None
+                end = timer()
+                self.step_time += end - start
+                self.cpu_time += time.thread_time() - start_cpu_time
+                self.num_profiled_steps += 1
+                if (self.num_steps is not None and
+                        self.num_profiled_steps >= self.num_steps) or \
+                        (self.duration is not None and
+                         end - self.start_time >= self.duration):
+                    self.finish()
+
+        self._profiled_step = profiled_step
+        self.start_time = timer()
+        detector.step = profiled_step
+        _sampler.add(self)
+
+    def finish(self):
+        """
+        Stops profiling, the report is kept. Calling it again does nothing.
+
+        :return: None
+        """
+        with self._finish_lock:
+            if self.finished or self._detector is None:
+                return
+            self.finished = True
+        _sampler.remove(self)
+        detector = self._detector
+        if detector.__dict__.get('step') is self._profiled_step:
+            del detector.step
+        self.finish_time = timer()
+        self.model_size['end'] = detector.ctx_operator.get_stats()
+        if self._start_snapshot is not None:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, filename)
+                    for filename in _IGNORED_ALLOCATION_FILES])
+            _stop_tracing()
+            self.allocations = [
+                    (str(stat.traceback), stat.size_diff, stat.count_diff)
+                    for stat in snapshot.compare_to(self._start_snapshot,
+                                                    'lineno')
+                    if stat.size_diff > 0][:NUM_TOP_ENTRIES]
+            self._start_snapshot = None
+        self._detector = None
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def add_sample(self, frame):
+        """
+        Records the stack of a profiled step, called by the sampling thread.
+
+        :param frame: The innermost frame of the thread running the step
+        :return: None
+        """
+        wrapper_code = self._profiled_step.__code__
+        frames = []
+        while frame is not None and frame.f_code is not wrapper_code:
+            frames.append(_get_frame_name(frame.f_code))
+            frame = frame.f_back
+        # Not in the step (yet or anymore) when the wrapper wasn't reached
+        if frame is not None and frames:
+            frames.reverse()
+            self.stacks[tuple(frames)] += 1
+
+    def get_collapsed_stacks(self):
+        """
+        :return: list of 'outer;...;inner samples' lines, one per distinct
+                 stack
+        """
+        return ['%s %d' % (';'.join(frames), num_samples)
+                for frames, num_samples in sorted(self.stacks.items())]
+
+    def get_functions(self):
+        """
+        :return: list of dicts of the function, its self and total (with
+                 the functions it calls) samples and estimated CPU seconds,
+                 highest self time first
+        """
+        self_samples = collections.Counter()
+        total_samples = collections.Counter()
+        for frames, num_samples in self.stacks.items():
+            self_samples[frames[-1]] += num_samples
+            for frame in set(frames):
+                total_samples[frame] += num_samples
+        num_samples = sum(self.stacks.values())
+        seconds_per_sample = self.cpu_time / num_samples if num_samples \
+            else 0.0
+        return [{
+            'function': function,
+            'self_samples': self_samples[function],
+            'total_samples': total_samples[function],
+            'self_seconds': self_samples[function] * seconds_per_sample,
+            'total_seconds': total_samples[function] * seconds_per_sample,
+        } for function in sorted(total_samples, key=lambda function: (
+            -self_samples[function], -total_samples[function]))]
+
+    def get_summary(self):
+        """
+        :return: JSON serializable dict of the profile
+        """
+        end = self.finish_time if self.finished else timer()
+        return {
+            'stream_key': self.stream_key,
+            'finished': self.finished,
+            'num_steps': self.num_profiled_steps,
+            'wall_seconds': end - self.start_time
+            if self.start_time is not None else 0.0,
+            'step_seconds': self.step_time,
+            'cpu_seconds': self.cpu_time,
+            'num_samples': sum(self.stacks.values()),
+            'sampling_interval': SAMPLING_INTERVAL,
+            'model_size': dict(self.model_size),
+            'functions': self.get_functions()[:NUM_TOP_ENTRIES],
+            'allocations': [{'site': site, 'size': size, 'count': count}
+                            for site, size, count in self.allocations],
+        }
+
+    def get_report(self):
+        """
+        :return: ProfileReport, picklable unlike the profiler
+        """
+        return ProfileReport(self.get_summary(), self.get_collapsed_stacks())
+
+
+def write_report(report, directory, name=None):
+    """
+    Writes the collapsed stacks of a report to <name>.folded and its summary
+    to <name>.json.
+
+    :param report: ProfileReport
+    :param directory: The output directory, created when missing
+    :param name: The file name without extension, defaults to the stream
+                 key (or 'profile') with the characters unsafe in a file
+                 name replaced
+    :return: (collapsed stacks path, summary path)
+    """
+    if name is None:
+        stream_key = report.summary.get('stream_key')
+        if stream_key is None:
+            name = 'profile'
+        elif isinstance(stream_key, (tuple, list)):
+            name = '.'.join(str(part) for part in stream_key)
+        else:
+            name = str(stream_key)
+        name = re.sub(r'[^\w.-]', '_', name)
+    os.makedirs(directory, exist_ok=True)
+    stacks_path = os.path.join(directory, name + '.folded')
+    summary_path = os.path.join(directory, name + '.json')
+    with open(stacks_path, 'w') as stacks_file:
+        for line in report.collapsed_stacks:
+            stacks_file.write(line + '\n')
+    with open(summary_path, 'w') as summary_file:
+        json.dump(report.summary, summary_file, indent=2, default=_to_json)
+    return stacks_path, summary_path
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import collections
+
+import numpy as np
+
+
+class ScoreHistory(object):
+    """
+    The last scores of a detector in a ring buffer, together with the
+    maximum of the last `window` scores maintained by a monotonic deque, so
+    appending a score and reading the maximum are O(1) (amortized) and the
+    memory does not depend on the number of scores seen. The ring grows
+    with the scores up to its capacity, a short stream doesn't pay for a
+    large capacity.
+
+    A window of 0 means the maximum over every score ever appended, which is
+    what history[-0:] selects. Nothing ever leaves that window, so a single
+    running maximum is kept instead of the deque.
+    """
+    def __init__(self, window, capacity=None, initial=(1.0,)):
+        """
+        :param window: Number of last scores max() is computed over, 0 for
+                       all of them
+        :param capacity: Number of scores kept for values(), defaults to the
+                         window (at least 1)
+        :param initial: Scores appended at creation
+        """
+        window = int(window)
+        if window < 0:
+            raise ValueError('the rest period must not be negative')
+        self.window = window
+        self.capacity = max(1, window if capacity is None else capacity)
+        # min(count, capacity) scores, score seq at seq % capacity
+        self._ring = []
+        self._count = 0
+        # (sequence number, score) with decreasing scores
+        self._max_deque = collections.deque()
+        for score in initial:
+            self.append(score)
+
+    def append(self, score):
+        """
+        :param score: The new score
+        :return: None
+        """
+        seq = self._count
+        self._put(seq, score)
+        self._count = seq + 1
+
+        max_deque = self._max_deque
+        if not self.window:
+            if not max_deque:
+                max_deque.append((seq, score))
+            elif max_deque[0][1] <= score:
+                max_deque[0] = (seq, score)
+            return
+        while max_deque and max_deque[-1][1] <= score:
+            max_deque.pop()
+        max_deque.append((seq, score))
+        if max_deque[0][0] <= seq - self.window:
+            max_deque.popleft()
+
+    def skip(self, num_scores):
+        """
+        Counts num_scores scores that were not computed, values() holds nan
+        for them. max() is only right again once window scores have been
+        appended.
+
+        :param num_scores: The number of skipped scores
+        :return: None
+        """
+        if num_scores <= 0:
+            return
+        for seq in range(self._count,
+                         self._count + min(num_scores, self.capacity)):
+            self._put(seq, float('nan'))
+        self._count += num_scores
+        self._max_deque.clear()
+
+    def _put(self, seq, score):
+        ring = self._ring
+        if len(ring) < self.capacity:
+            # Not full yet, seq is the next slot
+            ring.append(score)
+        else:
+            ring[seq % self.capacity] = score
+
+    def max(self):
+        """
+        :return: The maximum of the last window scores
+        """
+        return self._max_deque[0][1]
+
+    def values(self):
+        """
+        :return: list of the kept scores, oldest first
+        """
+        if self._count <= self.capacity:
+            return self._ring[:self._count]
+        start = self._count % self.capacity
+        return self._ring[start:] + self._ring[:start]
+
+    def __len__(self):
+        """
+        :return: The number of scores ever appended
+        """
+        return self._count
+
+    def get_state(self):
+        """
+        :return: (dict of scalars, dict of arrays) from which from_state
+                 rebuilds the history
+        """
+        max_seqs, max_scores = zip(*self._max_deque) if self._max_deque \
+            else ((), ())
+        scalars = {
+            'window': self.window,
+            'capacity': self.capacity,
+            'count': self._count,
+        }
+        arrays = {
+            'values': np.array(self.values(), dtype=np.float64),
+            'max_seqs': np.array(max_seqs, dtype=np.int64),
+            'max_scores': np.array(max_scores, dtype=np.float64),
+        }
+        return scalars, arrays
+
+    @classmethod
+    def from_state(cls, scalars, arrays):
+        """
+        :param scalars: Scalars returned by get_state
+        :param arrays: Arrays returned by get_state
+        :return: ScoreHistory
+        """
+        history = cls(scalars['window'], scalars['capacity'], initial=())
+        values = arrays['values'].tolist()
+        count = scalars['count']
+        # Every slot below len(values) is set
+        history._ring = [0.0] * len(values)
+        for seq, score in enumerate(values, count - len(values)):
+            history._ring[seq % history.capacity] = score
+        history._count = count
+        history._max_deque.extend(zip(arrays['max_seqs'].tolist(),
+                                      arrays['max_scores'].tolist()))
+        return history
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Asyncio scoring server.
+
+Clients connect over TCP or a Unix socket and send newline-delimited
+records:
+
+    stream_key,timestamp,value
+
+and get back one line per record (or per alert, see alert_threshold):
+
+    stream_key,timestamp,score
+
+or ``error,<line number>,<message>`` for a record that can't be parsed or
+scored.
+The stream key may hold commas, the timestamp is passed through as is.
+
+Points are queued per stream and fed to the stream detector in batches
+(score_many) run in an executor, so the event loop keeps serving the other
+connections meanwhile. A stream has at most one batch in flight: its points
+are scored in the order they were received, and a connection gets the
+scores of a stream in the order it sent the points. Scores of different
+streams may come back interleaved in any order.
+
+Every connection can have at most max_pending records waiting for their
+answer. Past that the server stops reading from it, which pushes back on
+the client through the socket buffers; a client not reading its answers
+only ever throttles itself.
+
+    python -m cadose.server --port 9000 --max-value 100
+
+With --profile-dir, a SIGUSR1 profiles the steps of every stream (see
+cadose.profiling) and writes the reports of each stream to that directory,
+without restarting the server:
+
+    kill -USR1 <server pid>
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import signal
+import sys
+
+from cadose.cad_driver import add_detector_arguments, get_detector_params
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.profiling import write_report
+
+
+class _Stream(object):
+    def __init__(self, stream_key, detector):
+        self.stream_key = stream_key
+        self.detector = detector
+        # (connection, line number, timestamp, value) waiting to be scored
+        self.points = collections.deque()
+        self.draining = False
+
+
+class _Connection(object):
+    """
+    Answers of a connection. Answers are written by a task of their own so
+    a slow client never holds a stream back, each answer frees one of the
+    max_pending slots once written.
+    """
+    def __init__(self, writer, max_pending):
+        self.writer = writer
+        self.slots = asyncio.Semaphore(max_pending)
+        self.max_pending = max_pending
+        self.answers = asyncio.Queue()
+        self.closed = False
+        self.task = asyncio.ensure_future(self._write_answers())
+
+    def answer(self, line):
+        self.answers.put_nowait(line)
+
+    def skip(self):
+        # A record without answer frees its slot right away
+        self.slots.release()
+
+    async def drain(self):
+        """
+        Waits for the answers of all the records read so far.
+        """
+        for _ in range(self.max_pending):
+            await self.slots.acquire()
+
+    async def _write_answers(self):
+        writer = self.writer
+        while True:
+            line = await self.answers.get()
+            if not self.closed:
+                try:
+                    writer.write(line.encode('utf-8'))
+                    if self.answers.empty():
+                        await writer.drain()
+                except (ConnectionError, OSError):
+                    # Answers of a gone client are dropped
+                    self.closed = True
+            self.slots.release()
+
+
+def _write_profile(output_dir, profiler):
+    write_report(profiler.get_report(), output_dir)
+
+
+def score_points(detector, values):
+    """
+    Scores a batch of values, falling back to one value at a time when the
+    batch holds values the detector can't encode so that only those fail.
+    Encoding comes first in both cases, a failing value leaves the detector
+    untouched.
+
+    :param detector: A ContextualAnomalyDetector
+    :param values: list of floats
+    :return: list of scores, with the exception instead of the score of the
+             values that failed
+    """
+    try:
+        return detector.score_many(values).tolist()
+    except ValueError:
+        scores = []
+        for value in values:
+            try:
+                scores.append(detector.get_anomaly_score(value))
+            except (ValueError, OverflowError) as exc:
+                scores.append(exc)
+        return scores
+
+
+def parse_record(line):
+    """
+    :param line: A 'stream_key,timestamp,value' line
+    :return: (stream_key, timestamp, value)
+    """
+    fields = line.rsplit(',', 2)
+    if len(fields) != 3:
+        raise ValueError('expected stream_key,timestamp,value')
+    stream_key, timestamp, value = fields
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError('value %r is not a number' % (value,))
+    return stream_key, timestamp, value
+
+
+class ScoringServer(object):
+    """
+    Serves the detectors of every stream over newline-delimited records,
+    see the module docstring for the protocol.
+    """
+    def __init__(self, detector_params, max_batch_size=256, max_pending=1024,
+                 alert_threshold=None, executor=None):
+        """
+        :param detector_params: Keyword arguments used to create the
+                                ContextualAnomalyDetector of every stream
+        :param max_batch_size: Maximum number of points of a stream scored
+                               at once
+        :param max_pending: Maximum number of records of a connection
+                            waiting for their answer
+        :param alert_threshold: Only answer the records scoring at least
+                                this much, None to answer all of them
+        :param executor: concurrent.futures.Executor the batches are scored
+                         in, a single thread by default. It must run the
+                         callables in the caller's process, the detectors
+                         live there
+        """
+        self.detector_params = detector_params
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.alert_threshold = alert_threshold
+        self.executor = executor or \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.streams = {}
+        self.num_records = 0
+        self.num_batches = 0
+        self._server = None
+
+    async def start(self, host=None, port=None, path=None):
+        """
+        Starts listening on a TCP host:port or on a Unix socket path.
+
+        :return: The asyncio server
+        """
+        if path is not None:
+            self._server = await asyncio.start_unix_server(
+                    self._handle_connection, path=path)
+        else:
+            self._server = await asyncio.start_server(
+                    self._handle_connection, host=host, port=port)
+        return self._server
+
+    def get_addresses(self):
+        """
+        :return: list of the addresses the server listens on
+        """
+        return [sock.getsockname() for sock in self._server.sockets]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening and waits for the batches in flight.
+
+        :return: None
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        while any(stream.draining for stream in self.streams.values()):
+            await asyncio.sleep(0.01)
+
+    def start_profiling(self, stream_keys=None, output_dir=None,
+                        **profile_params):
+        """
+        Starts profiling the detectors of some streams while they keep on
+        scoring, see ContextualAnomalyDetector.start_profiling. Streams
+        created afterwards are not profiled.
+
+        :param stream_keys: Keys of the streams to profile, None for all the
+                            current streams
+        :param output_dir: Optional directory the report of every stream is
+                           written to once its profiler stops, see
+                           cadose.profiling.write_report
+        :param profile_params: num_steps, duration and trace_allocations
+        :return: dict of stream key => Profiler, the streams unknown or
+                 already being profiled are skipped
+        """
+        on_finish = functools.partial(_write_profile, output_dir) \
+            if output_dir is not None else None
+
+        profilers = {}
+        for stream_key in self.streams if stream_keys is None \
+                else stream_keys:
+            stream = self.streams.get(stream_key)
+            if stream is None:
+                continue
+            profiler = stream.detector.profiler
+            if profiler is None or profiler.finished:
+                profilers[stream_key] = stream.detector.start_profiling(
+                        stream_key=stream_key, on_finish=on_finish,
+                        **profile_params)
+        return profilers
+
+    async def _handle_connection(self, reader, writer):
+        connection = _Connection(writer, self.max_pending)
+        line_num = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line_num += 1
+                line = line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                await connection.slots.acquire()
+                try:
+                    stream_key, timestamp, value = parse_record(line)
+                except ValueError as exc:
+                    connection.answer('error,%d,%s\n' % (line_num, exc))
+                    continue
+                self._add_point(connection, line_num, stream_key, timestamp,
+                                value)
+            await connection.drain()
+        except (ConnectionError, OSError, ValueError):
+            # ValueError is a line over the reader limit
+            connection.closed = True
+        finally:
+            connection.task.cancel()
+            writer.close()
+
+    def _add_point(self, connection, line_num, stream_key, timestamp, value):
+        stream = self.streams.get(stream_key)
+        if stream is None:
+            stream = self.streams[stream_key] = _Stream(
+                    stream_key, ContextualAnomalyDetector(
+                        **self.detector_params))
+        stream.points.append((connection, line_num, timestamp, value))
+        self.num_records += 1
+        if not stream.draining:
+            stream.draining = True
+            asyncio.ensure_future(self._drain_stream(stream))
+
+    async def _drain_stream(self, stream):
+        """
+        Scores the queued points of a stream batch after batch until its
+        queue is empty. Only one drain runs per stream. A batch the
+        detector fails on is answered with an error for each of its points,
+        which frees their slots, and the next batches are still scored.
+        """
+        loop = asyncio.get_running_loop()
+        points = stream.points
+        try:
+            while points:
+                batch = [points.popleft() for _ in
+                         range(min(len(points), self.max_batch_size))]
+                try:
+                    scores = await loop.run_in_executor(
+                            self.executor, score_points, stream.detector,
+                            [value for _, _, _, value in batch])
+                except Exception as exc:
+                    scores = [exc] * len(batch)
+                self.num_batches += 1
+                self._answer(stream.stream_key, batch, scores)
+        finally:
+            stream.draining = False
+
+    def _answer(self, stream_key, batch, scores):
+        alert_threshold = self.alert_threshold
+        for (connection, line_num, timestamp, _), score in zip(batch, scores):
+            if isinstance(score, Exception):
+                connection.answer('error,%d,%s\n' % (line_num, score))
+            elif alert_threshold is None or score >= alert_threshold:
+                connection.answer('%s,%s,%r\n' % (stream_key, timestamp,
+                                                  score))
+            else:
+                connection.skip()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Serve contextual anomaly detectors over TCP or a '
+                        'Unix socket.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--unix', help='listen on this Unix socket path '
+                                       'instead of TCP')
+    parser.add_argument('--max-batch-size', type=int, default=256,
+                        help='maximum number of points of a stream scored '
+                             'at once')
+    parser.add_argument('--max-pending', type=int, default=1024,
+                        help='maximum number of unanswered records per '
+                             'connection')
+    parser.add_argument('--alert-threshold', type=float,
+                        help='only answer the records scoring at least '
+                             'this much')
+    parser.add_argument('--profile-dir',
+                        help='profile every stream on SIGUSR1 and write '
+                             'the reports to this directory')
+    parser.add_argument('--profile-steps', type=int, default=1000,
+                        help='number of steps profiled per stream')
+    parser.add_argument('--profile-seconds', type=float,
+                        help='maximum profiling time per stream')
+    parser.add_argument('--profile-no-allocations', action='store_true',
+                        help='do not trace the allocations when profiling')
+    add_detector_arguments(parser)
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    server = ScoringServer(get_detector_params(args),
+                           max_batch_size=args.max_batch_size,
+                           max_pending=args.max_pending,
+                           alert_threshold=args.alert_threshold)
+    await server.start(host=args.host, port=args.port, path=args.unix)
+    if args.profile_dir is not None and hasattr(signal, 'SIGUSR1'):
+        asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, lambda: server.start_profiling(
+                    output_dir=args.profile_dir,
+                    num_steps=args.profile_steps,
+                    duration=args.profile_seconds,
+                    trace_allocations=not args.profile_no_allocations))
+    sys.stderr.write('listening on %s\n' % (server.get_addresses(),))
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Process-wide dictionaries of encodings and fact groups shared by detectors.
+
+Detectors of a family of metrics with the same encoding parameters build the
+same encodings and the same right semi context facts (the right facts are
+sensor facts only). A detector created with a dictionary_id takes them from
+the SharedDictionary of that id instead of building its own copies, and only
+keeps its own contexts, counters and links.
+"""
+
+import threading
+
+# Bounds of the shared tables, they are cleared when full like the encodings
+# cache of a detector
+MAX_SHARED_FACT_GROUPS = 1 << 20
+
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+class SharedDictionary(object):
+    """
+    Encodings and interned fact groups of the detectors referencing the same
+    dictionary id. It is read-mostly: entries are only ever added (or the
+    tables cleared when full), never changed, and every operation on it is a
+    single dict operation, so the detectors of several threads can share it.
+    """
+    def __init__(self, dictionary_id, encoding_key):
+        """
+        :param dictionary_id: The id the detectors reference it by
+        :param encoding_key: Hashable encoding parameters of the detectors,
+                             all of them must have the same
+        """
+        self.dictionary_id = dictionary_id
+        self.encoding_key = encoding_key
+        self.encodings = {}  # scaled input value => Encoding
+        self.fact_groups = {}  # facts => the same facts, the shared tuple
+        self.max_fact_groups = MAX_SHARED_FACT_GROUPS
+
+    def intern(self, facts):
+        """
+        :param facts: tuple of facts
+        :return: The shared tuple equal to facts
+        """
+        interned = self.fact_groups.get(facts)
+        if interned is None:
+            if len(self.fact_groups) >= self.max_fact_groups:
+                self.fact_groups.clear()
+            interned = self.fact_groups.setdefault(facts, facts)
+        return interned
+
+    def get_stats(self):
+        return {
+            'num_encodings': len(self.encodings),
+            'num_fact_groups': len(self.fact_groups),
+        }
+
+
+def get_shared_dictionary(dictionary_id, encoding_key):
+    """
+    :param dictionary_id: Hashable id of the dictionary, it is created by
+                          the first detector referencing it
+    :param encoding_key: See SharedDictionary
+    :return: SharedDictionary
+    """
+    with _dictionaries_lock:
+        dictionary = _dictionaries.get(dictionary_id)
+        if dictionary is None:
+            dictionary = _dictionaries[dictionary_id] = SharedDictionary(
+                    dictionary_id, encoding_key)
+    if dictionary.encoding_key != encoding_key:
+        raise ValueError('dictionary %r is shared by detectors with other '
+                         'encoding parameters' % (dictionary_id,))
+    return dictionary
+
+
+def clear_shared_dictionaries():
+    """
+    Forgets every dictionary, the detectors referencing one keep it.
+
+    :return: None
+    """
+    with _dictionaries_lock:
+        _dictionaries.clear()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Binary snapshots of detector state.
+
+A snapshot is a single file:
+
+    magic (8 bytes) | version (uint32 LE) | header size (uint32 LE)
+    | header (JSON, utf-8) | arrays
+
+The header holds the scalar state and a table of the arrays (dtype, shape
+and offset in the file). Every array starts on an ARRAY_ALIGNMENT boundary
+so it can be memory-mapped in place.
+
+Snapshots of another version are rejected rather than converted, the
+detector has to be trained again (or the snapshot taken again with the
+matching version).
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b'CADSNAP\0'
+SNAPSHOT_VERSION = 2
+ARRAY_ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct('<8sII')
+
+
+def _align(offset):
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def write_snapshot(path, header, arrays):
+    """
+    Writes a snapshot. The file is written next to path then renamed over it
+    so a reader never sees a partial snapshot.
+
+    :param path: The snapshot path
+    :param header: JSON serializable dict of scalar state
+    :param arrays: dict of name => 1-d numpy array
+    :return: None
+    """
+    arrays = dict((name, np.ascontiguousarray(values))
+                  for name, values in arrays.items())
+
+    # The offsets depend on the header size which depends on the offsets,
+    # the array table is written relative to the end of the header and
+    # rebased on read
+    table = {}
+    offset = 0
+    for name, values in arrays.items():
+        table[name] = {
+            'dtype': values.dtype.str,
+            'shape': list(values.shape),
+            'offset': offset,
+        }
+        offset = _align(offset + values.nbytes)
+    header_bytes = json.dumps({'state': header, 'arrays': table},
+                              sort_keys=True).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+
+    tmp_path = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmp_path, 'wb') as file:
+        file.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                  len(header_bytes)))
+        file.write(header_bytes)
+        for name, values in arrays.items():
+            file.seek(data_start + table[name]['offset'])
+            file.write(values.data)
+        file.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, mmap=True):
+    """
+    Reads a snapshot.
+
+    :param path: The snapshot path
+    :param mmap: Memory-map the arrays copy-on-write instead of reading them,
+                 processes loading the same snapshot share the pages they
+                 don't write to
+    :return: (header dict, dict of name => numpy array)
+    """
+    with open(path, 'rb') as file:
+        preamble = file.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise ValueError('%s: truncated snapshot' % path)
+        magic, version, header_size = _PREAMBLE.unpack(preamble)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('%s: not a detector snapshot' % path)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError('%s: snapshot version %d is not supported, '
+                             'only version %d snapshots can be loaded'
+                             % (path, version, SNAPSHOT_VERSION))
+        header = json.loads(file.read(header_size).decode('utf-8'))
+        data_start = _align(_PREAMBLE.size + header_size)
+
+        arrays = {}
+        for name, desc in header['arrays'].items():
+            dtype = np.dtype(desc['dtype'])
+            shape = tuple(desc['shape'])
+            offset = data_start + desc['offset']
+            if not np.prod(shape):
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='c',
+                                         offset=offset, shape=shape)
+            else:
+                file.seek(offset)
+                arrays[name] = np.fromfile(file, dtype=dtype,
+                                           count=int(np.prod(shape)))\
+                    .reshape(shape)
+    return header['state'], arrays
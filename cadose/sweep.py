@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+Parallel hyperparameter sweep.
+
+Runs every configuration of a parameter grid on one or more labeled series
+and ranks the configurations by how well their alerts match the labeled
+anomaly windows:
+
+    python -m cadose.sweep cpu.csv mem.csv --label-column anomaly \
+        --grid base_threshold=0.5,0.75 rest_period=1,5 \
+               num_norm_value_bits=8,10
+
+base_threshold and rest_period only post-process the raw score of every
+point, so the configurations differing only by them share one model pass
+(see MODEL_PARAMS). Model passes run in a process pool, the series are
+placed once in a shared memory block the workers map instead of being
+pickled to each of them.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+from multiprocessing import shared_memory
+from timeit import default_timer as timer
+
+import numpy as np
+
+from cadose.alert_policy import AlertPolicy
+from cadose.cad_driver import DETECTOR_DEFAULTS
+from cadose.cad_ose import ContextualAnomalyDetector
+
+# Parameters the learned model depends on, the others only post-process
+# the raw scores
+MODEL_PARAMS = ('min_value', 'max_value', 'max_lsemi_ctxs_len',
+                'max_active_neurons_num', 'num_norm_value_bits', 'max_ctxs',
+                'compact', 'bitset', 'max_idle_steps', 'compaction_interval')
+
+
+class LabeledSeries(object):
+    def __init__(self, name, values, windows):
+        """
+        :param name: Name of the series
+        :param values: 1-d array like of values
+        :param windows: list of (start, end) point index ranges, end
+                        excluded, of the labeled anomalies
+        """
+        self.name = name
+        self.values = np.asarray(values, dtype=np.float64).ravel()
+        self.windows = [(int(start), int(end)) for start, end in windows]
+
+
+def windows_from_labels(labels):
+    """
+    :param labels: 1-d array like, non zero for the anomalous points
+    :return: list of (start, end) ranges of consecutive anomalous points
+    """
+    labels = np.concatenate([[0], np.asarray(labels) != 0, [0]]) \
+        .astype(np.int8)
+    edges = np.flatnonzero(np.diff(labels))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def expand_grid(grid):
+    """
+    :param grid: dict of parameter name => list of values
+    :return: list of dicts, one per combination
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+def post_process(raw_scores, base_threshold, rest_period):
+    """
+    Applies the rest period of ContextualAnomalyDetector._score_facts to the
+    raw scores of a model pass: a score is zeroed when one of the
+    rest_period previous raw scores (1.0 before the first point) reached
+    base_threshold.
+
+    :param raw_scores: list of raw scores
+    :return: np.ndarray of the scores the detector would have returned
+    """
+    return AlertPolicy(base_threshold, rest_period).apply_many(raw_scores)
+
+
+def evaluate(scores, windows, threshold):
+    """
+    Matches the alerts (scores >= threshold) with the labeled windows.
+
+    :return: dict with the number of alerts, the window recall, the alert
+             precision and their F1
+    """
+    alerts = scores >= threshold
+    num_alerts = int(np.count_nonzero(alerts))
+    in_windows = np.zeros(len(scores), dtype=np.bool_)
+    num_detected = 0
+    for start, end in windows:
+        in_windows[start:end] = True
+        if alerts[start:end].any():
+            num_detected += 1
+    recall = num_detected / float(len(windows)) if windows else 1.0
+    precision = np.count_nonzero(alerts & in_windows) / float(num_alerts) \
+        if num_alerts else (1.0 if not windows else 0.0)
+    f1 = 2 * precision * recall / (precision + recall) \
+        if precision + recall else 0.0
+    return {
+        'num_alerts': num_alerts,
+        'recall': recall,
+        'precision': precision,
+        'f1': f1,
+    }
+
+
+def _get_peak_rss():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _model_pass(task):
+    """
+    Pool worker: runs one model over one series of the shared block.
+
+    :param task: (shared memory name, block length, start, end, model
+                 params)
+    :return: dict with the raw scores and the cost of the pass
+    """
+    shm_name, block_len, start, end, model_params = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        values = np.ndarray((block_len,), dtype=np.float64,
+                            buffer=shm.buf)[start:end]
+        # The detector's own alert policy is not used, only the raw scores
+        detector = ContextualAnomalyDetector(
+                base_threshold=float('inf'), rest_period=1, **model_params)
+        pass_start = timer()
+        raw_scores = detector.score_policies(values).raw
+        runtime = timer() - pass_start
+        del values
+    finally:
+        shm.close()
+    return {
+        'raw_scores': raw_scores,
+        'runtime': runtime,
+        'num_ctxs': detector.get_stats()['num_ctxs'],
+        'peak_rss_bytes': _get_peak_rss(),
+    }
+
+
+def run_sweep(grid, series_list, base_params=None, num_workers=None,
+              keep_scores=False):
+    """
+    :param grid: dict of parameter name => list of values
+    :param series_list: list of LabeledSeries
+    :param base_params: Detector parameters of the values not in the grid,
+                        cad_driver.DETECTOR_DEFAULTS by default
+    :param num_workers: Size of the process pool, the number of CPUs by
+                        default
+    :param keep_scores: Add the scores of every series to the results
+    :return: list of one result dict per configuration, best first (mean
+             F1 over the series, then total model time)
+    """
+    base_params = dict(DETECTOR_DEFAULTS if base_params is None
+                       else base_params)
+    configs = [dict(base_params, **combination)
+               for combination in expand_grid(grid)]
+
+    groups = {}
+    for config in configs:
+        model_params = tuple(sorted((name, config[name])
+                                    for name in MODEL_PARAMS
+                                    if name in config))
+        groups.setdefault(model_params, []).append(config)
+
+    offsets = np.cumsum([0] + [len(series.values)
+                               for series in series_list]).tolist()
+    block_len = offsets[-1]
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(1, block_len * 8))
+    try:
+        block = np.ndarray((block_len,), dtype=np.float64, buffer=shm.buf)
+        for series, start in zip(series_list, offsets):
+            block[start:start + len(series.values)] = series.values
+        del block
+
+        tasks = [(shm.name, block_len, start, end, dict(model_params))
+                 for model_params in groups
+                 for start, end in zip(offsets, offsets[1:])]
+        # A fresh worker per pass so its peak RSS is the one of the pass
+        with multiprocessing.get_context('spawn').Pool(
+                num_workers or multiprocessing.cpu_count(),
+                maxtasksperchild=1) as pool:
+            passes = pool.map(_model_pass, tasks, chunksize=1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    results = []
+    num_series = len(series_list)
+    for group_num, group_configs in enumerate(groups.values()):
+        group_passes = passes[group_num * num_series:
+                              (group_num + 1) * num_series]
+        for config in group_configs:
+            result = {
+                'params': config,
+                'runtime': sum(model_pass['runtime']
+                               for model_pass in group_passes),
+                'num_ctxs': sum(model_pass['num_ctxs']
+                                for model_pass in group_passes),
+                'peak_rss_bytes': max([model_pass['peak_rss_bytes']
+                                       for model_pass in group_passes]
+                                      or [0]),
+                'series': {},
+            }
+            f1s = []
+            for series, model_pass in zip(series_list, group_passes):
+                scores = post_process(model_pass['raw_scores'].tolist(),
+                                      config['base_threshold'],
+                                      config['rest_period'])
+                metrics = evaluate(scores, series.windows,
+                                   config['base_threshold'])
+                if keep_scores:
+                    metrics['scores'] = scores
+                result['series'][series.name] = metrics
+                f1s.append(metrics['f1'])
+            result['f1'] = float(np.mean(f1s)) if f1s else 0.0
+            results.append(result)
+
+    results.sort(key=lambda result: (-result['f1'], result['runtime']))
+    return results
+
+
+def read_labeled_csv(path, value_column, label_column):
+    """
+    :return: LabeledSeries named after the file
+    """
+    values, labels = [], []
+    with open(path, newline='') as file:
+        for line_num, record in enumerate(csv.DictReader(file), 1):
+            try:
+                values.append(float(record[value_column]))
+                labels.append(float(record[label_column] or 0))
+            except (KeyError, TypeError, ValueError):
+                raise ValueError('%s line %d: no numeric %r or %r field'
+                                 % (path, line_num, value_column,
+                                    label_column))
+    return LabeledSeries(os.path.basename(path), values,
+                         windows_from_labels(labels))
+
+
+def parse_grid(specs):
+    """
+    :param specs: list of 'name=value,value...' strings
+    :return: dict of parameter name => list of values
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        name = name.replace('-', '_')
+        if name not in DETECTOR_DEFAULTS or not values:
+            raise ValueError('bad grid parameter %r' % spec)
+        value_type = type(DETECTOR_DEFAULTS[name])
+        grid[name] = [value_type(value) for value in values.split(',')]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Rank detector configurations on labeled series.')
+    parser.add_argument('inputs', nargs='+', help='CSV files')
+    parser.add_argument('--value-column', default='value')
+    parser.add_argument('--label-column', default='label',
+                        help='non zero for the anomalous points')
+    parser.add_argument('--grid', nargs='+', required=True,
+                        help='name=value,value... per swept parameter')
+    parser.add_argument('--workers', type=int,
+                        help='process pool size, the number of CPUs by '
+                             'default')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of configurations printed')
+    parser.add_argument('--output', help='write all the results as JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        grid = parse_grid(args.grid)
+        series_list = [read_labeled_csv(path, args.value_column,
+                                        args.label_column)
+                       for path in args.inputs]
+    except (OSError, ValueError) as exc:
+        sys.stderr.write('error: %s\n' % exc)
+        return 1
+
+    results = run_sweep(grid, series_list, num_workers=args.workers)
+    for rank, result in enumerate(results[:args.top], 1):
+        swept = ' '.join('%s=%s' % (name, result['params'][name])
+                         for name in sorted(grid))
+        print('%3d  f1 %.3f  %7.2fs  %8d ctxs  %s'
+              % (rank, result['f1'], result['runtime'], result['num_ctxs'],
+                 swept))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+
+# Growth factor of the growable arrays
+GROWTH_FACTOR = 1.25
+
+
+class GrowableArray(object):
+    """
+    A typed numpy array with amortized O(1) appends. data may be bigger than
+    the array, only data[:size] is meaningful.
+    """
+    __slots__ = ('data', 'size')
+
+    def __init__(self, dtype, capacity=16):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    @classmethod
+    def wrap(cls, values):
+        """
+        Makes a growable array using values (e.g. a memory map) as storage
+        until it has to grow.
+        """
+        growable = cls.__new__(cls)
+        growable.data = values
+        growable.size = len(values)
+        return growable
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self._grow(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            self._grow(end)
+        self.data[self.size:end] = values
+        self.size = end
+
+    def view(self):
+        return self.data[:self.size]
+
+    def _grow(self, min_capacity):
+        capacity = max(min_capacity, int(GROWTH_FACTOR * len(self.data)) + 1)
+        data = np.zeros(capacity, dtype=self.data.dtype)
+        data[:self.size] = self.data[:self.size]
+        self.data = data
+
+
+class HashTable(object):
+    """
+    Open addressing int64 => int32 map stored in two numpy arrays, about a
+    quarter of the size of a dict of python ints. Keys must not be -1 (no
+    hash() is).
+    """
+    EMPTY = -1
+
+    def __init__(self, capacity=64):
+        self.keys = np.full(capacity, self.EMPTY, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.int32)
+        self.size = 0
+
+    @classmethod
+    def from_arrays(cls, keys, values):
+        """
+        Makes a table using the keys and values arrays of another one as
+        storage.
+        """
+        table = cls.__new__(cls)
+        table.keys = keys
+        table.values = values
+        table.size = int(np.count_nonzero(keys != cls.EMPTY))
+        return table
+
+    @classmethod
+    def from_items(cls, items):
+        table = cls()
+        for key, value in items:
+            table.setdefault(key, value)
+        return table
+
+    def __len__(self):
+        return self.size
+
+    def get(self, key, default=None):
+        """
+        Same as dict.get.
+        """
+        slot = self._find_slot(key)
+        if self.keys[slot] == key:
+            return int(self.values[slot])
+        return default
+
+    def setdefault(self, key, value):
+        """
+        Same as dict.setdefault.
+        """
+        slot = self._find_slot(key)
+        if self.keys[slot] == key:
+            return int(self.values[slot])
+        self.keys[slot] = key
+        self.values[slot] = value
+        self.size += 1
+        if 2 * self.size > len(self.keys):
+            self._resize(2 * len(self.keys))
+        return value
+
+    def items(self):
+        used = self.keys != self.EMPTY
+        return zip(self.keys[used].tolist(), self.values[used].tolist())
+
+    def _find_slot(self, key):
+        keys = self.keys
+        mask = len(keys) - 1
+        slot = key & mask
+        while True:
+            slot_key = keys[slot]
+            if slot_key == key or slot_key == self.EMPTY:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _resize(self, capacity):
+        items = list(self.items())
+        self.keys = np.full(capacity, self.EMPTY, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.int32)
+        for key, value in items:
+            slot = self._find_slot(key)
+            self.keys[slot] = key
+            self.values[slot] = value
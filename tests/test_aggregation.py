@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import pytest
+
+from cadose.aggregation import WindowAggregator
+
+
+@pytest.mark.parametrize('timestamp', [float('nan'), float('inf')])
+def test_non_finite_timestamps_are_rejected(timestamp):
+    aggregator = WindowAggregator(1.0, ('mean', 'count'))
+    aggregator.add([0.5], [1.0])
+    with pytest.raises(ValueError):
+        aggregator.add([1.5, timestamp], [2.0, 3.0])
+    # The rejected chunk left nothing behind
+    assert aggregator.num_samples == 1
+    windows = aggregator.flush()
+    assert windows.starts.tolist() == [0.0]
+    assert windows.aggregates['count'].tolist() == [1.0]
+
+
+def test_out_of_order_timestamps():
+    aggregator = WindowAggregator(1.0, ('mean', 'min', 'last'),
+                                  allowed_lateness=1.0)
+    assert not len(aggregator.add([0.2, 1.5, 0.7], [1.0, 5.0, 3.0]).starts)
+    windows = aggregator.add([2.1, 0.9], [7.0, 4.0])
+    assert windows.starts.tolist() == [0.0]
+    assert windows.aggregates['mean'].tolist() == [8.0 / 3.0]
+    assert windows.aggregates['min'].tolist() == [1.0]
+    # last is the latest timestamp, not the last to arrive
+    assert windows.aggregates['last'].tolist() == [4.0]
+    # Window 0 is closed, a sample for it is late
+    aggregator.add([0.5], [9.0])
+    assert aggregator.num_late == 1
+    windows = aggregator.flush()
+    assert windows.starts.tolist() == [1.0, 2.0]
+    assert np.array_equal(windows.aggregates['mean'], [5.0, 7.0])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import pytest
+
+from benchmarks import series
+from cadose.cad_ose import ContextualAnomalyDetector
+
+PARAMS = dict(min_value=0, max_value=100, base_threshold=0.75,
+              rest_period=30, max_lsemi_ctxs_len=7,
+              max_active_neurons_num=16, num_norm_value_bits=3)
+
+VALUES = np.concatenate([series.periodic(400, 1), series.random_walk(400, 2)])
+
+
+def reference_scores(values=VALUES):
+    detector = ContextualAnomalyDetector(**PARAMS)
+    return [detector.get_anomaly_score(value) for value in values]
+
+
+def test_score_many_matches_get_anomaly_score():
+    detector = ContextualAnomalyDetector(**PARAMS)
+    # In several batches, the state carries over from one to the next
+    scores = np.concatenate([detector.score_many(VALUES[:1]),
+                             detector.score_many(VALUES[1:500]),
+                             detector.score_many(VALUES[500:])])
+    assert scores.tolist() == reference_scores()
+
+
+def test_learn_many_then_score():
+    detector = ContextualAnomalyDetector(**PARAMS)
+    detector.learn_many(VALUES[:500])
+    scores = [detector.get_anomaly_score(value) for value in VALUES[500:]]
+    assert scores == reference_scores()[500:]
+
+
+@pytest.mark.parametrize('backend', ['compact', 'bitset'])
+def test_backends_match_the_object_backend(backend):
+    detector = ContextualAnomalyDetector(**dict(PARAMS, **{backend: True}))
+    assert detector.score_many(VALUES).tolist() == reference_scores()
+    reference = ContextualAnomalyDetector(**PARAMS)
+    reference.score_many(VALUES)
+    assert detector.ctx_operator.get_num_ctxs() == \
+        reference.ctx_operator.get_num_ctxs()
+
+
+def test_non_finite_values_are_rejected_before_scoring():
+    detector = ContextualAnomalyDetector(**PARAMS)
+    with pytest.raises(ValueError):
+        detector.score_many([10.0, float('nan')])
+    # Nothing of the failed batch was scored
+    assert detector.score_many(VALUES).tolist() == reference_scores()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import pytest
+
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.context_operator import NEURON_FACT_OFFSET
+from tests.test_cad_ose import PARAMS, VALUES, reference_scores
+
+
+@pytest.mark.parametrize('backend', [{}, {'compact': True}, {'bitset': True}])
+def test_compaction_keeps_the_scores(backend):
+    detector = ContextualAnomalyDetector(**dict(PARAMS, **backend))
+    scores = detector.score_many(VALUES[:300]).tolist()
+    detector.compact()
+    scores += detector.score_many(VALUES[300:600]).tolist()
+    detector.compact()
+    scores += detector.score_many(VALUES[600:]).tolist()
+    assert scores == reference_scores()
+
+
+def test_compaction_interval_keeps_the_scores():
+    detector = ContextualAnomalyDetector(compaction_interval=50, **PARAMS)
+    assert detector.score_many(VALUES).tolist() == reference_scores()
+
+
+def test_compaction_renumbers_the_contexts_densely():
+    detector = ContextualAnomalyDetector(**PARAMS)
+    detector.score_many(VALUES)
+    detector.compact()
+    ctx_operator = detector.ctx_operator
+    assert None not in ctx_operator.ctxs
+    assert len(ctx_operator.ctxs) == ctx_operator.get_num_ctxs()
+    for fact in detector.left_facts_group:
+        if fact >= NEURON_FACT_OFFSET:
+            assert fact - NEURON_FACT_OFFSET < len(ctx_operator.ctxs)
+
+
+def test_dropping_idle_contexts():
+    detector = ContextualAnomalyDetector(**PARAMS)
+    detector.score_many(VALUES)
+    num_ctxs = detector.ctx_operator.get_num_ctxs()
+    assert detector.compact(max_idle_steps=100) > 0
+    assert detector.ctx_operator.get_num_ctxs() < num_ctxs
+    # The detector goes on scoring from the smaller model
+    assert len(detector.score_many(VALUES[:100])) == 100
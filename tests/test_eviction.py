@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import numpy as np
+import pytest
+
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.context_operator import NEURON_FACT_OFFSET
+from tests.test_cad_ose import PARAMS
+
+MAX_CTXS = 300
+
+# Uniform noise keeps creating contexts, the cap is reached quickly
+VALUES = np.random.default_rng(3).uniform(0, 100, 800)
+
+
+def make_detector(**params):
+    return ContextualAnomalyDetector(**dict(
+            PARAMS, num_norm_value_bits=4, max_ctxs=MAX_CTXS, **params))
+
+
+def test_eviction_keeps_the_model_within_max_ctxs():
+    detector = make_detector()
+    ctx_operator = detector.ctx_operator
+    num_evictions = 0
+    num_ctxs = 0
+    for value in VALUES:
+        detector.get_anomaly_score(value)
+        num_evictions += ctx_operator.get_num_ctxs() < num_ctxs
+        num_ctxs = ctx_operator.get_num_ctxs()
+        assert num_ctxs <= MAX_CTXS
+        # Evicted contexts don't leave free slots behind
+        assert len(ctx_operator.ctxs) <= MAX_CTXS
+        for fact in detector.left_facts_group:
+            if fact >= NEURON_FACT_OFFSET:
+                assert ctx_operator.ctxs[fact - NEURON_FACT_OFFSET] \
+                    is not None
+    assert num_evictions
+
+
+def test_score_many_evicts_like_get_anomaly_score():
+    detector = make_detector()
+    scores = [detector.get_anomaly_score(value) for value in VALUES]
+    assert make_detector().score_many(VALUES).tolist() == scores
+
+
+def test_evicted_model_snapshot_scores_the_same(tmp_path):
+    detector = make_detector()
+    detector.score_many(VALUES)
+    path = str(tmp_path / 'detector.snap')
+    detector.save(path)
+    loaded = ContextualAnomalyDetector.load(path)
+    assert loaded.ctx_operator.max_ctxs == MAX_CTXS
+    rest = VALUES[::-1]
+    assert loaded.score_many(rest).tolist() == \
+        detector.score_many(rest).tolist()
+
+
+@pytest.mark.parametrize('backend', ['compact', 'bitset'])
+def test_other_backends_refuse_max_ctxs(backend):
+    with pytest.raises(ValueError):
+        make_detector(**{backend: True})
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import pytest
+
+from cadose.fact_groups import FactGroupTable
+
+
+def test_intern_gives_sequential_ids_and_stores_groups_once():
+    table = FactGroupTable()
+    assert table.intern((1, 2)) == 0
+    assert table.intern((3,)) == 1
+    # An equal tuple built separately gets the id of the stored one
+    facts = tuple([1, 2])
+    assert table.intern(facts) == 0
+    assert table[0] is not facts
+    assert len(table) == 2
+
+
+def test_remove_keeps_the_other_ids():
+    table = FactGroupTable()
+    for facts in [(1,), (2,), (3,)]:
+        table.intern(facts)
+    table.remove({1})
+    assert table[1] is None
+    assert len(table) == 2
+    assert table.intern((3,)) == 2
+    # A removed group comes back with a new id
+    assert table.intern((2,)) == 3
+
+
+def test_from_groups_skips_the_removed_groups():
+    table = FactGroupTable.from_groups([(1,), None, (2, 3)])
+    assert len(table) == 2
+    assert table.intern((2, 3)) == 2
+    assert table.intern((4,)) == 3
+    with pytest.raises(KeyError):
+        table.remove({1})
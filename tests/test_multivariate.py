@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+from benchmarks import series
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.multivariate import MultivariateAnomalyDetector
+
+INPUTS = [
+    dict(name='cpu', min_value=0, max_value=100, num_norm_value_bits=4),
+    dict(name='io', min_value=0, max_value=100, num_norm_value_bits=4),
+]
+
+
+def make_detector():
+    return MultivariateAnomalyDetector(
+            INPUTS, base_threshold=0.75, rest_period=1, max_lsemi_ctxs_len=7,
+            max_active_neurons_num=15)
+
+
+def input_range(detector, name):
+    input_ = detector.inputs[detector.input_names.index(name)]
+    return range(input_.fact_offset,
+                 input_.fact_offset + 2 * input_.num_norm_value_bits)
+
+
+def test_above_max_value_stays_in_its_input_range():
+    detector = make_detector()
+    encoding = detector._encode({'cpu': 150, 'io': 0})
+    assert len(set(encoding.facts)) == len(encoding.facts)
+    cpu_facts = input_range(detector, 'cpu')
+    io_facts = input_range(detector, 'io')
+    assert sum(fact in cpu_facts for fact in encoding.facts) == 4
+    assert sum(fact in io_facts for fact in encoding.facts) == 1
+    assert encoding == detector._encode({'cpu': 100, 'io': 0})
+
+
+def test_encode_many_clamps_like_encode():
+    detector = make_detector()
+    encodings = detector._encode_many({'cpu': [150, 1e6, 50],
+                                       'io': [0, 250, 50]})
+    for encoding in encodings:
+        assert len(set(encoding.facts)) == len(encoding.facts)
+    assert encodings[0].facts == detector._encode(
+            {'cpu': 150, 'io': 0}).facts
+    assert encodings[1].facts == detector._encode(
+            {'cpu': 100, 'io': 100}).facts
+
+
+def test_single_input_scores_like_contextual_anomaly_detector():
+    values = series.periodic(300, 1)
+    detector = MultivariateAnomalyDetector(
+            [dict(name='value', min_value=0, max_value=100,
+                  num_norm_value_bits=4)],
+            base_threshold=0.75, rest_period=1, max_lsemi_ctxs_len=7,
+            max_active_neurons_num=15)
+    reference = ContextualAnomalyDetector(
+            min_value=0, max_value=100, num_norm_value_bits=4,
+            base_threshold=0.75, rest_period=1, max_lsemi_ctxs_len=7,
+            max_active_neurons_num=15)
+    assert detector.score_many({'value': values}).tolist() == \
+        reference.score_many(values).tolist()
+
+
+def test_score_many_matches_get_anomaly_score():
+    cpu = series.periodic(200, 1)
+    io = series.random_walk(200, 2)
+    detector = make_detector()
+    scores = [detector.get_anomaly_score({'cpu': cpu_value, 'io': io_value})
+              for cpu_value, io_value in zip(cpu, io)]
+    assert make_detector().score_many({'cpu': cpu, 'io': io}).tolist() == \
+        scores
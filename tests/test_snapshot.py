@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Contextual Anomaly Detector — Open Source Edition
+#
+# Copyright © 2016 Mikhail Smirnov <smirmik@gmail.com>
+# Copyright © 2016 Gregory Petrosyan <gregory.petrosyan@gmail.com>
+# Copyright © 2019 Alexander Buchanan <alexsbuchanan@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+
+import struct
+
+import pytest
+
+from cadose.cad_ose import ContextualAnomalyDetector
+from cadose.snapshot import SNAPSHOT_VERSION
+from tests.test_cad_ose import PARAMS, VALUES, reference_scores
+
+BACKENDS = [{}, {'compact': True}, {'bitset': True}]
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+@pytest.mark.parametrize('load_backend', BACKENDS)
+@pytest.mark.parametrize('save_backend', BACKENDS)
+def test_reloaded_snapshot_scores_the_same(tmp_path, save_backend,
+                                           load_backend, mmap):
+    detector = ContextualAnomalyDetector(**dict(PARAMS, **save_backend))
+    scores = detector.score_many(VALUES[:500]).tolist()
+    path = str(tmp_path / 'detector.snap')
+    detector.save(path)
+
+    loaded = ContextualAnomalyDetector.load(path, mmap=mmap, **load_backend)
+    scores += [loaded.get_anomaly_score(value) for value in VALUES[500:]]
+    assert scores == reference_scores()
+
+
+def test_snapshot_of_another_version_is_rejected(tmp_path):
+    detector = ContextualAnomalyDetector(**PARAMS)
+    detector.score_many(VALUES[:50])
+    path = str(tmp_path / 'detector.snap')
+    detector.save(path)
+
+    # The version follows the 8 bytes of the magic
+    with open(path, 'r+b') as file:
+        file.seek(8)
+        file.write(struct.pack('<I', SNAPSHOT_VERSION - 1))
+    with pytest.raises(ValueError, match='version %d is not supported'
+                       % (SNAPSHOT_VERSION - 1)):
+        ContextualAnomalyDetector.load(path)
+
+
+def test_not_a_snapshot_is_rejected(tmp_path):
+    path = tmp_path / 'detector.snap'
+    path.write_bytes(b'not a snapshot at all')
+    with pytest.raises(ValueError, match='not a detector snapshot'):
+        ContextualAnomalyDetector.load(str(path))